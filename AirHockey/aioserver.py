@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+
+from constants import SNAPSHOT_RATE
+from server import GameServer, PlayerMixin
+from socketclient import Connection
+
+
+# Bytes buffered for a client before the transport asks us to stop writing
+WRITE_HIGH_WATER = 64 * 1024
+# Clients that let this much pile up while paused are too slow to play, they get dropped
+WRITE_LIMIT = 1024 * 1024
+# Messages that are replaced by the next one anyway, skipped while a client can't keep up.
+# Snapshots are deltas from one the client acknowledged, so skipping some is fine too
+DROPPABLE = {'GAME_UPDATE', 'SNAPSHOT'}
+
+
+class AsyncPlayer(PlayerMixin, Connection, asyncio.Protocol):
+    "One connected player, asyncio calls the protocol methods as data arrives"
+    def __init__(self, server):
+        super().__init__(None)
+        self.transport = None
+        self._recv_buffer = bytearray()
+        # Set by the transport when its write buffer is over the high water mark
+        self.paused = False
+        self.dropped = 0
+        self.setup(server)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+        transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+        self.server.clients.add(self)
+
+    def data_received(self, data):
+        self._recv_buffer += data
+        try:
+            with memoryview(self._recv_buffer) as view:
+                offset = self.parse_messages(view)
+        except Exception as e:
+            print("Client exception caught:", e)
+            self.close()
+            return
+        del self._recv_buffer[:offset]
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+
+    def send(self, header, body={}):
+        if self.paused and header in DROPPABLE:
+            self.dropped += 1
+            return
+        super().send(header, body)
+
+    def _queue(self, data):
+        if self.transport is None or self.transport.is_closing():
+            return
+        # The event loop only watches the socket for writing while this buffer isn't empty
+        self.transport.write(data)
+        if self.transport.get_write_buffer_size() > WRITE_LIMIT:
+            print(f"Client {self.address} is too slow, disconnecting")
+            self.close()
+
+    def connection_lost(self, exc):
+        self.leave()
+        self.transport = None
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class AsyncServer(GameServer):
+    "Same games as SocketServer, on an asyncio event loop with the game tick as its own task"
+    def __init__(self, host, port, snapshot_rate=SNAPSHOT_RATE):
+        super().__init__(snapshot_rate)
+        self.host = host
+        self.port = port
+
+    async def tick(self):
+        while True:
+            self.scheduler.run(self.games.values())
+            self.matchmaking()
+            await asyncio.sleep(self.scheduler.timeout())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: AsyncPlayer(self), self.host, self.port, backlog=1024)
+        print(f"Listening to port {self.port}")
+        ticker = asyncio.create_task(self.tick())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            ticker.cancel()
+            for client in list(self.clients):
+                client.close()
+
+    def listen(self):
+        try:
+            asyncio.run(self.serve())
+        except (KeyboardInterrupt, SystemExit):
+            print("Got keyboard interrupt, Exiting...")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Air hockey server on asyncio")
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=22222)
+    parser.add_argument('--snapshot-rate', type=int, default=SNAPSHOT_RATE, help="game updates per second to each client")
+    args = parser.parse_args()
+    AsyncServer(args.host, args.port, args.snapshot_rate).listen()
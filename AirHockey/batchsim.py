@@ -0,0 +1,231 @@
+"""
+Many air hockey games stepped at once with NumPy
+
+The same rules as physics.py (striker/ball collisions, wall bounces, goals
+and the computer player's policy), written over arrays with one row per
+game so thousands of games advance in one call. Useful for training an AI
+and for estimating how many games a server can simulate.
+
+Goals restart the game right away (there is no goal delay) and a game that
+reaches WIN_SCORE counts as finished and starts over with 0-0.
+
+Usage:
+    python batchsim.py --games 10000 --seconds 10
+    python batchsim.py --games 1000 --compare
+"""
+import argparse
+import time
+
+import numpy as np
+
+import physics
+from constants import *
+
+
+WIN_SCORE = 7
+TOP, DOWN = 0, 1
+
+
+class BatchSim:
+    "n games at once, ball and strikers as (n, 2) / (n, 2, 2) float arrays of pixels and pixels per tick"
+    def __init__(self, n, difficulty=AI_DIFFICULTY, tick=1000 / TICK_RATE, seed=None):
+        self.n = n
+        self.difficulty = difficulty
+        self.tick = tick
+        self.rng = np.random.default_rng(seed)
+
+        # Same board as the server: (left, top, right, bottom)
+        self.bounds = physics.Bounds(0, 50, SCREENX, SCREENY - 50)
+        b = self.bounds
+        self.board = np.array([b.left, b.top, b.right, b.bottom], dtype=float)
+        # Half of the board of every striker, indexed by side
+        halves = [physics.player_bounds(b, side) for side in (TOP, DOWN)]
+        self.halves = np.array([[h.left, h.top, h.right, h.bottom] for h in halves], dtype=float)
+        self.start = np.array([[SCREENX // 2, SCREENY // 4 + 50], [SCREENX // 2, 3 * SCREENY // 4]], dtype=float)
+
+        self.ball = np.empty((n, 2))
+        self.ball_velocity = np.empty((n, 2))
+        self.players = np.empty((n, 2, 2))
+        self.player_velocity = np.zeros((n, 2, 2))
+        # Goals scored by each side, TOP then DOWN (BaseGame.scores counts goals let in instead)
+        self.scores = np.zeros((n, 2), dtype=np.int64)
+        # Finished games, and the wins of each side over all of them
+        self.finished = 0
+        self.wins = np.zeros(2, dtype=np.int64)
+        self.steps = 0
+        self.reset(np.ones(n, dtype=bool))
+
+    def reset(self, mask):
+        "Put the games in mask back to the kick-off, the ball gets a random serve so games don't all play alike"
+        count = int(mask.sum())
+        if not count:
+            return
+        self.ball[mask] = self.bounds.center
+        angle = self.rng.uniform(0, 2 * np.pi, count)
+        speed = self.rng.uniform(0, MAX_BALL_SPEED * self.tick / 2, count)
+        self.ball_velocity[mask] = np.stack([np.cos(angle), np.sin(angle)], axis=1) * speed[:, None]
+        self.players[mask] = self.start
+        self.player_velocity[mask] = 0
+
+    def state(self):
+        "Copies of the current arrays"
+        return {
+            'ball': self.ball.copy(), 'ball_velocity': self.ball_velocity.copy(),
+            'players': self.players.copy(), 'player_velocity': self.player_velocity.copy(),
+            'scores': self.scores.copy(),
+        }
+
+    def ai_targets(self, side):
+        "(targets, max speeds) of every striker of a side, the policy of physics.ai_move"
+        left, top, right, bottom = self.halves[side]
+        player, ball = self.players[:, side], self.ball
+        in_half = (ball[:, 0] >= left) & (ball[:, 0] < right) & (ball[:, 1] >= top) & (ball[:, 1] < bottom)
+        max_speed = np.where(in_half, self.difficulty * MAX_PLAYER_SPEED / 4, self.difficulty * MAX_PLAYER_SPEED / 8)
+
+        distance = np.hypot(*(player - ball).T)
+        touching = distance < PLAYER_RADIUS + BALL_RADIUS - (2 * AI_DIFFICULTY)
+        chase = np.where(touching[:, None], 2 * player - ball, ball)
+        wait = np.stack([ball[:, 0], np.full(self.n, (top + bottom) // 2)], axis=1)
+        return np.where(in_half[:, None], chase, wait), max_speed
+
+    def move_players(self, targets, max_speeds):
+        "Moves both strikers of every game towards (n, 2, 2) targets inside their halves"
+        r = PLAYER_RADIUS
+        targets = np.clip(targets, self.halves[None, :, :2] + r, self.halves[None, :, 2:] - r)
+        velocity = targets - self.players
+        limit_speed(velocity, max_speeds * self.tick)
+        self.player_velocity = velocity
+        self.players += velocity
+
+    def collide(self, side):
+        "Ball against one striker in every game, physics.collide over arrays"
+        player, ball = self.players[:, side], self.ball
+        delta = player - ball
+        distance = np.hypot(*delta.T)
+        hit = distance <= PLAYER_RADIUS + BALL_RADIUS
+        if not hit.any():
+            return
+        distance = np.where(distance == 0, 1, distance)
+        normal = delta / distance[:, None]
+        bvi = (self.ball_velocity * normal).sum(axis=1)
+        pvi = (self.player_velocity[:, side] * normal).sum(axis=1)
+        change = np.where(hit, 2 * pvi - 2 * bvi, 0)
+        self.ball_velocity += change[:, None] * normal
+        offset = np.where(hit, PLAYER_RADIUS + BALL_RADIUS - distance + 2, 0)
+        self.ball -= normal * offset[:, None]
+
+    def move_ball(self):
+        "Bounces, moves and checks goals for every ball, returns the mask of games with a goal"
+        left, top, right, bottom = self.board
+        r = BALL_RADIUS
+        target = self.ball + self.ball_velocity
+        edge = (self.bounds.width - GOAL_WIDTH) // 2
+        goal = ((target[:, 1] - r < top) | (target[:, 1] + r > bottom)) \
+            & (target[:, 0] - r > edge) & (target[:, 0] + r < edge + GOAL_WIDTH)
+
+        out_x = (target[:, 0] - r < left) | (target[:, 0] + r > right)
+        out_y = (target[:, 1] - r < top) | (target[:, 1] + r > bottom)
+        bounce = np.stack([np.where(out_x & ~goal, -0.5, 1), np.where(out_y & ~goal, -0.5, 1)], axis=1)
+        self.ball_velocity *= bounce
+        self.ball += self.ball_velocity
+
+        inside = np.clip(self.ball, [left + r, top + r], [right - r, bottom - r])
+        self.ball = np.where(goal[:, None], self.ball, inside)
+        return goal
+
+    def step(self, targets=None):
+        """
+        Advance every game one tick, targets is an (n, 2, 2) array of where
+        each striker wants to go, None lets the computer policy play both.
+        Returns the side that scored in every game (-1 for no goal)
+        """
+        if targets is None:
+            (top, top_speed), (down, down_speed) = self.ai_targets(TOP), self.ai_targets(DOWN)
+            targets, max_speeds = np.stack([top, down], axis=1), np.stack([top_speed, down_speed], axis=1)
+        else:
+            max_speeds = np.full((self.n, 2), MAX_PLAYER_SPEED)
+        self.move_players(targets, max_speeds)
+
+        self.collide(TOP)
+        self.collide(DOWN)
+        limit_speed(self.ball_velocity, MAX_BALL_SPEED * self.tick)
+        goal = self.move_ball()
+        self.steps += 1
+
+        scorer = np.full(self.n, -1)
+        if goal.any():
+            # Same rule as BaseGame.score_goal, a ball in the top half went in the top goal, DOWN scored
+            scorer[goal] = np.where(self.ball[goal, 1] < SCREENY // 2, DOWN, TOP)
+            np.add.at(self.scores, (np.nonzero(goal)[0], scorer[goal]), 1)
+
+            won = (self.scores >= WIN_SCORE).any(axis=1)
+            if won.any():
+                self.finished += int(won.sum())
+                self.wins += (self.scores[won] >= WIN_SCORE).sum(axis=0)
+                self.scores[won] = 0
+            self.reset(goal)
+        return scorer
+
+    def run(self, steps, record=False):
+        "Step every game, returns the list of states after every step when record is set"
+        states = []
+        for _ in range(steps):
+            self.step()
+            if record:
+                states.append(self.state())
+        return states
+
+
+def limit_speed(velocity, max_speed):
+    "Scales the (..., 2) velocities down to max_speed (a scalar or an array of the leading shape) in place"
+    speed = np.hypot(velocity[..., 0], velocity[..., 1])
+    scale = np.minimum(1, max_speed / np.maximum(speed, 1e-12))
+    velocity *= scale[..., None]
+
+
+def scalar_benchmark(games, steps, tick):
+    "The same computer vs computer games with physics.py, one game at a time"
+    bounds = physics.Bounds(0, 50, SCREENX, SCREENY - 50)
+    halves = [physics.player_bounds(bounds, side) for side in (TOP, DOWN)]
+    start = time.perf_counter()
+    for _ in range(games):
+        ball = physics.Body(*bounds.center, BALL_RADIUS)
+        ball.vx = 3.0
+        players = [physics.Body(SCREENX // 2, SCREENY // 4 + 50, PLAYER_RADIUS),
+                   physics.Body(SCREENX // 2, 3 * SCREENY // 4, PLAYER_RADIUS)]
+        for _ in range(steps):
+            for player, half in zip(players, halves):
+                physics.ai_move(player, ball, half, AI_DIFFICULTY, tick)
+            if physics.step_ball(ball, players, bounds, tick):
+                ball.place(*bounds.center)
+                ball.stop()
+    return time.perf_counter() - start
+
+
+def benchmark(games, seconds, compare=False):
+    sim = BatchSim(games, seed=0)
+    steps = int(seconds * 1000 / sim.tick)
+    start = time.perf_counter()
+    sim.run(steps)
+    elapsed = time.perf_counter() - start
+
+    simulated = games * steps * sim.tick / 1000
+    print(f"{games} games x {steps} steps in {elapsed:.2f}s")
+    print(f"{simulated / elapsed:,.0f} game-seconds per second, {games * steps / elapsed:,.0f} game steps/s")
+    print(f"{sim.finished} games finished, wins top {sim.wins[0]} / down {sim.wins[1]}")
+
+    if compare:
+        sample = max(1, min(games, 200))
+        scalar = scalar_benchmark(sample, steps, sim.tick)
+        rate = sample * steps * sim.tick / 1000 / scalar
+        print(f"physics.py one game at a time: {rate:,.0f} game-seconds per second "
+              f"({simulated / elapsed / rate:.1f}x slower)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized air hockey simulation")
+    parser.add_argument('--games', type=int, default=10000, help="games stepped together")
+    parser.add_argument('--seconds', type=float, default=10, help="game time to simulate")
+    parser.add_argument('--compare', action='store_true', help="also time physics.py on a sample of the games")
+    args = parser.parse_args()
+    benchmark(args.games, args.seconds, args.compare)
@@ -1,42 +1,165 @@
 import socket
 import selectors
+import queue
+import threading
+import time
 import pygame
 
+import protocol
+from constants import NETWORK_UDP, UDP_LOSS, UDP_LATENCY
+from snapshot import SnapshotDecoder
 from socketclient import SocketClient
+from udp import UdpClient, KEEPALIVE
 
 
 SOCKET_EVENT = pygame.USEREVENT + 1
+# Messages only the latest of which matters, a newer one replaces any still waiting to go out
+COALESCED = {'PLAYER_MOVE'}
 
 
 class Client(SocketClient):
-    def __init__(self, sel, host, port):
+    """
+    The socket lives in its own thread, which blocks in select() so the game
+    loop never waits on the network. Received messages come back through a
+    queue that listen() empties once a frame, and send() hands messages to
+    the thread, waking it through a socketpair. Realtime messages go over
+    UDP when the server offers it.
+    """
+    def __init__(self, sel, host, port, codec=protocol.BINARY):
         self.host = host
         self.port = port
 
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        super().__init__(sel, sock, (host, port))
+        super().__init__(sel, sock, (host, port), codec)
+        self.snapshots = SnapshotDecoder()
+
+        # (header, body) received by the network thread, for the game loop
+        self.inbox = queue.SimpleQueue()
+        # Messages from the game loop waiting for the network thread, coalesced ones by header
+        self.outbox = []
+        self.latest = {}
+        self.lock = threading.Lock()
+        self.woken = False
+        self.wakeup, self._wakeup_reader = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self.selector.register(self._wakeup_reader, selectors.EVENT_READ, None)
+
+        self.thread = threading.Thread(target=self.pump, name='network', daemon=True)
+        self.running = False
+        self.error = None
+        self.udp_client = None
 
     def connect(self):
         self.sock.connect_ex((self.host, self.port))
-        print(f"Connected to {self.host}, port: {self.port}")
+        self.hello()
+        self.running = True
+        self.thread.start()
+        print(f"Connected to {self.host}, port: {self.port} ({self.codec.name} protocol)")
 
-    def listen(self):
-        # Must keep calling this until client closes
-        events = self.selector.select(timeout=None)
+    def pump(self):
+        "Network thread, reads and writes the socket until the client closes"
         try:
-            for key, mask in events:
-                sock = key.data
-                sock.process_event(mask)
+            while self.running:
+                timeout = None
+                if self.udp_client is not None:
+                    # Woken up for keepalives, resends and delayed test packets
+                    timeout = min(KEEPALIVE / 2, self.udp_client.timeout() or KEEPALIVE)
+                for key, mask in self.selector.select(timeout):
+                    if key.data is None:
+                        self._flush()
+                    else:
+                        key.data.process_event(mask)
+                if self.udp_client is not None:
+                    self.udp_client.flush()
         except Exception as e:
-            print("Exception caught:", e)
+            self.error = e
+        self.running = False
+
+    def _flush(self):
+        "Queue what the game loop sent since the last wakeup"
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            outbox, latest = self.outbox, self.latest
+            self.outbox, self.latest = [], {}
+            self.woken = False
+        for header, body in outbox:
+            super().send(header, body)
+        for header, body in latest.items():
+            super().send(header, body)
+
+    def send(self, header, body={}):
+        if threading.current_thread() is self.thread:
+            super().send(header, body)
+            return
+        with self.lock:
+            if header in COALESCED:
+                self.latest[header] = body
+            else:
+                self.outbox.append((header, body))
+            # One byte is enough to wake the thread however much is waiting
+            wake, self.woken = not self.woken, True
+        if wake:
+            self.wakeup.send(b'\0')
+
+    def listen(self):
+        "Post the messages received since the last frame, False once the connection is gone"
+        # Must keep calling this until client closes, never blocks the game loop
+        while True:
+            try:
+                header, body = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            pygame.event.post(pygame.event.Event(SOCKET_EVENT, {'header': header, 'body': body}))
+
+        if self.error is not None:
+            print("Exception caught:", self.error)
             return False
-        else:
-            return True
+        return True
 
     def handle_request(self, data):
         header, body = data['header'], data['body']
-        event = pygame.event.Event(SOCKET_EVENT, {'header': header, 'body': body})
-        pygame.event.post(event)
+        if header == 'UDP_TOKEN':
+            if NETWORK_UDP and self.udp_client is None:
+                self.open_udp(body['token'], body['port'])
+            return
+        if header == 'PING':
+            # Answered from this thread, the server times it for matchmaking
+            self.send('PONG', body)
+            return
+        if header == 'SNAPSHOT':
+            # The game only sees whole positions, as with older servers
+            positions = self.snapshots.decode(body)
+            if positions is None:
+                return
+            self.send('ACK', {'seq': body['seq']})
+            positions.update(time=body['time'], input=body['input'])
+            header, body = 'GAME_UPDATE', positions
+        if header == 'GAME_UPDATE':
+            # Stamped here, the game loop only sees it up to a frame later
+            body['received'] = time.perf_counter()
+        self.inbox.put((header, body))
 
+    def open_udp(self, token, port):
+        "Start the UDP channel the server offered, messages move to it once the server answers"
+        self.udp_client = UdpClient(self, (self.host, port), token, UDP_LOSS, UDP_LATENCY)
+        self.udp = self.udp_client.channel
+        self.selector.register(self.udp_client.sock, selectors.EVENT_READ, self.udp_client)
+        self.udp_client.flush()
 
-    
+    def close(self):
+        if self.thread.is_alive():
+            self.running = False
+            self.wakeup.send(b'\0')
+            self.thread.join()
+        self.selector.unregister(self._wakeup_reader)
+        self._wakeup_reader.close()
+        self.wakeup.close()
+        if self.udp_client is not None:
+            self.selector.unregister(self.udp_client.sock)
+            self.udp_client.close()
+        if self.sock is not None:
+            super().close()
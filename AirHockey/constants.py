@@ -1,5 +1,20 @@
 """All Game Constants"""
 FPS = 60
+# Simulation steps per second of the online server
+TICK_RATE = 60
+# GAME_UPDATE snapshots sent to each client per second (at most TICK_RATE)
+SNAPSHOT_RATE = 20
+# Pixels per unit of the positions in snapshots
+SNAPSHOT_QUANTUM = 1
+# Milliseconds the online client draws the ball and opponent behind the server,
+# about two snapshots so there is usually a newer one to move towards
+INTERPOLATION_DELAY = 100
+# Most milliseconds the ball is moved past the newest snapshot when one is late
+EXTRAPOLATION_LIMIT = 150
+# Longest frame the server takes a client input for, in milliseconds
+MAX_INPUT_TICK = 50
+# Seconds between two passes of the server over the matchmaking queue
+MATCHMAKING_INTERVAL = 1
 SCREENX, SCREENY = (360, 600)
 GOAL_WIDTH = SCREENX // 3
 BORDER_WIDTH = 20
@@ -12,6 +27,14 @@ MAX_BALL_SPEED = 1.6
 
 GOAL_TEXT_DELAY = 3
 
+# Wire format of online games, 'json' is bigger but readable for debugging
+NETWORK_CODEC = 'binary'
+# Use UDP for the realtime messages when the server offers it
+NETWORK_UDP = True
+# Loss (0-1) and delay in seconds added to the UDP packets the client sends, for testing
+UDP_LOSS = 0
+UDP_LATENCY = 0
+
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 RED = (255, 0, 0)
@@ -0,0 +1,341 @@
+"""
+Load test for the air hockey servers
+
+Headless bots (asyncio, no pygame) join games in pairs and play them with
+the computer player's policy, sending inputs and acking snapshots like the
+real client. The run goes through stages with more and more matches and
+measures, for each one:
+    - round trip time of PING/PONG, a ping per bot a second
+    - jitter of the snapshots: how far the time between two arriving
+      differs from the time between them on the server
+    - messages per second both ways and snapshots per bot per second
+
+A stage passes when the p99 round trip is under --max-rtt, bots get at least
+90% of the snapshots they should and nobody got disconnected. The report is
+written as JSON (with the commit and machine) so runs can be compared.
+
+Usage:
+    python loadtest.py --spawn server.py --matches 25,50,100,200 --duration 20
+    python loadtest.py --port 22222 --matches 500 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import physics
+import protocol
+from constants import *
+from snapshot import SnapshotDecoder
+from socketclient import Connection
+
+
+# Frames per second of the bots' input
+INPUT_RATE = 30
+# Seconds between pings of a bot
+PING_INTERVAL = 1.0
+# Connections opened at once while a stage starts
+CONNECT_BATCH = 50
+# Share of the expected snapshots a bot must get for the stage to pass
+MIN_SNAPSHOT_SHARE = 0.9
+
+
+class Bot(Connection, asyncio.Protocol):
+    "One headless player, plays with the AI policy from its side of the board"
+    def __init__(self, swarm):
+        super().__init__(None, protocol.BINARY)
+        self.swarm = swarm
+        self.transport = None
+        self._recv_buffer = bytearray()
+        self.snapshots = SnapshotDecoder()
+
+        self.board = physics.Bounds(0, 50, SCREENX, SCREENY - 50)
+        self.bounds = physics.player_bounds(self.board, 1)
+        self.body = physics.Body(SCREENX // 2, 3 * SCREENY // 4, PLAYER_RADIUS)
+        self.ball = physics.Body(*self.board.center, BALL_RADIUS)
+        self.playing = False
+        self.input_seq = self.ping_id = 0
+        self.pings = {}
+        # (arrival, server ms) of the last snapshot
+        self.last_snapshot = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.hello()
+        self.send('JOIN_GAME')
+
+    def data_received(self, data):
+        self._recv_buffer += data
+        with memoryview(self._recv_buffer) as view:
+            offset = self.parse_messages(view)
+        del self._recv_buffer[:offset]
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if not self.swarm.closing:
+            self.swarm.stats['disconnects'] += 1
+
+    def _queue(self, data):
+        if self.transport is not None:
+            self.transport.write(data)
+            self.swarm.stats['sent'] += 1
+
+    def handle_request(self, data):
+        header, body = data['header'], data['body']
+        stats = self.swarm.stats
+        stats['received'] += 1
+        now = time.perf_counter()
+
+        if header == 'SNAPSHOT':
+            positions = self.snapshots.decode(body)
+            if positions is None:
+                return
+            self.send('ACK', {'seq': body['seq']})
+            self.ball.place(*positions['ball'])
+            self.playing = True
+            stats['snapshots'] += 1
+            if self.last_snapshot is not None:
+                arrival, server_time = self.last_snapshot
+                server_gap = ((body['time'] - server_time) & 0xFFFF) / 1000
+                stats['jitter'].append(abs((now - arrival) - server_gap))
+            self.last_snapshot = now, body['time']
+        elif header == 'GAME_UPDATE':
+            self.ball.place(*body['ball'])
+            self.playing = True
+            stats['snapshots'] += 1
+        elif header == 'PLAYER_POS':
+            self.body.place(*body['rect'])
+            self.body.stop()
+            self.last_snapshot = None
+        elif header == 'GOAL':
+            stats['goals'] += 1
+        elif header == 'GAME_OVER':
+            stats['games'] += 1
+            self.playing = False
+            self.send('JOIN_GAME')
+        elif header == 'PING':
+            self.send('PONG', body)
+        elif header == 'MATCH_TIMEOUT':
+            stats['timeouts'] += 1
+            self.send('JOIN_GAME')
+        elif header == 'PONG':
+            sent = self.pings.pop(body['id'], None)
+            if sent is not None:
+                stats['rtt'].append(now - sent)
+
+    def step(self, tick):
+        "One input frame, tick in milliseconds"
+        if not self.playing or self.transport is None:
+            return
+        physics.ai_move(self.body, self.ball, self.bounds, AI_DIFFICULTY, tick)
+        self.input_seq = (self.input_seq + 1) & 0xFFFF
+        # The server moves the striker towards the target, the AI step is well within its speed
+        self.send('PLAYER_INPUT', {'seq': self.input_seq, 'target': self.body.center, 'tick': min(round(tick), 255)})
+
+    def ping(self):
+        if self.transport is None:
+            return
+        self.ping_id = (self.ping_id + 1) & 0xFFFFFFFF
+        self.pings[self.ping_id] = time.perf_counter()
+        self.send('PING', {'id': self.ping_id})
+
+
+class Swarm:
+    "The bots of one process, stepped together by one timer"
+    def __init__(self, host, port, bots):
+        self.host = host
+        self.port = port
+        self.count = bots
+        self.bots = []
+        self.closing = False
+        self.failed = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'sent': 0, 'received': 0, 'snapshots': 0, 'goals': 0, 'games': 0,
+                      'timeouts': 0, 'disconnects': 0, 'rtt': [], 'jitter': []}
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        for start in range(0, self.count, CONNECT_BATCH):
+            batch = range(start, min(start + CONNECT_BATCH, self.count))
+            results = await asyncio.gather(
+                *(loop.create_connection(lambda: Bot(self), self.host, self.port) for _ in batch),
+                return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    self.failed += 1
+                else:
+                    self.bots.append(result[1])
+
+    async def run(self, duration, warmup):
+        await self.connect()
+        frame, frames = 1 / INPUT_RATE, 0
+        # Pings are spread over the interval instead of all bots pinging at once
+        ping_frames = max(1, round(PING_INTERVAL * INPUT_RATE))
+        for bot in self.bots:
+            bot.ping_slot = random.randrange(ping_frames)
+
+        start = last = time.perf_counter()
+        measuring = False
+        while True:
+            now = time.perf_counter()
+            if not measuring and now - start >= warmup:
+                self.reset_stats()
+                measured = now
+                measuring = True
+            if measuring and now - measured >= duration:
+                break
+
+            tick = (now - last) * 1000
+            last = now
+            for bot in self.bots:
+                bot.step(tick)
+                if frames % ping_frames == bot.ping_slot:
+                    bot.ping()
+            frames += 1
+            await asyncio.sleep(max(0.0, frame - (time.perf_counter() - now)))
+
+        elapsed = time.perf_counter() - measured
+        self.closing = True
+        for bot in self.bots:
+            if bot.transport is not None:
+                bot.transport.close()
+        await asyncio.sleep(0.1)
+        return dict(self.stats, bots=len(self.bots), failed=self.failed, elapsed=elapsed)
+
+
+def run_swarm(host, port, bots, duration, warmup):
+    "Entry point of a bot process"
+    try:
+        import resource
+        # Thousands of sockets need more than the usual 1024 file descriptors
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+    return asyncio.run(Swarm(host, port, bots).run(duration, warmup))
+
+
+def percentiles(values, points=(50, 95, 99)):
+    "Percentiles (in ms) of a list of seconds"
+    if not values:
+        return {f"p{p}": None for p in points + ('max',)}
+    values = sorted(values)
+    result = {f"p{p}": round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 2) for p in points}
+    result['max'] = round(values[-1] * 1000, 2)
+    return result
+
+
+def run_stage(host, port, matches, duration, warmup, processes, snapshot_rate, max_rtt):
+    "Run 2 * matches bots spread over the processes, returns the stage summary"
+    bots = 2 * matches
+    shares = [bots // processes + (i < bots % processes) for i in range(processes)]
+    jobs = [(host, port, share, duration, warmup) for share in shares if share]
+    if len(jobs) == 1:
+        results = [run_swarm(*jobs[0])]
+    else:
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.starmap(run_swarm, jobs)
+
+    total = {key: sum(r[key] for r in results) for key in ('sent', 'received', 'snapshots', 'goals', 'games',
+                                                           'timeouts', 'disconnects', 'bots', 'failed')}
+    elapsed = max(r['elapsed'] for r in results)
+    rtt = [v for r in results for v in r['rtt']]
+    jitter = [v for r in results for v in r['jitter']]
+
+    snapshot_rate_per_bot = total['snapshots'] / elapsed / total['bots'] if total['bots'] else 0
+    rtt_ms = percentiles(rtt)
+    passed = (total['failed'] == 0 and total['disconnects'] == 0
+              and rtt_ms['p99'] is not None and rtt_ms['p99'] <= max_rtt
+              and snapshot_rate_per_bot >= MIN_SNAPSHOT_SHARE * snapshot_rate)
+    return {
+        'matches': matches, 'bots': total['bots'], 'failed_connections': total['failed'],
+        'disconnects': total['disconnects'], 'seconds': round(elapsed, 2),
+        'rtt_ms': rtt_ms, 'snapshot_jitter_ms': percentiles(jitter, (50, 99)),
+        'messages_in_per_s': round(total['received'] / elapsed),
+        'messages_out_per_s': round(total['sent'] / elapsed),
+        'snapshots_per_bot_s': round(snapshot_rate_per_bot, 2),
+        'goals': total['goals'], 'games_finished': total['games'] // 2,
+        'match_timeouts': total['timeouts'],
+        'passed': passed,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def spawn_server(script, port):
+    "Start a server next to this file, its output is kept for the report"
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    log = open(f"loadtest-{os.path.splitext(script)[0]}.log", 'w')
+    server = subprocess.Popen([sys.executable, '-u', path, '--port', str(port)], stdout=log, stderr=subprocess.STDOUT)
+    time.sleep(1.5)
+    if server.poll() is not None:
+        raise RuntimeError(f"{script} exited, see {log.name}")
+    return server, log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the air hockey server with headless bots")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=22222)
+    parser.add_argument('--spawn', metavar='SCRIPT', help="start this server (server.py, aioserver.py, shard.py) first")
+    parser.add_argument('--matches', default='10,50,100', help="comma separated matches of every stage")
+    parser.add_argument('--duration', type=float, default=15, help="seconds measured per stage")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds before measuring, for games to start")
+    parser.add_argument('--processes', type=int, default=1, help="bot processes")
+    parser.add_argument('--snapshot-rate', type=float, default=SNAPSHOT_RATE, help="snapshot rate of the server")
+    parser.add_argument('--max-rtt', type=float, default=50, help="p99 round trip in ms for a stage to pass")
+    parser.add_argument('--report', default='loadtest-report.json')
+    args = parser.parse_args()
+
+    server = log = None
+    if args.spawn:
+        server, log = spawn_server(args.spawn, args.port)
+
+    stages = []
+    try:
+        for matches in [int(m) for m in args.matches.split(',')]:
+            stage = run_stage(args.host, args.port, matches, args.duration, args.warmup,
+                              args.processes, args.snapshot_rate, args.max_rtt)
+            stages.append(stage)
+            rtt, jitter = stage['rtt_ms'], stage['snapshot_jitter_ms']
+            print(f"{matches} matches: rtt p50 {rtt['p50']}ms p99 {rtt['p99']}ms, jitter p99 {jitter['p99']}ms, "
+                  f"{stage['messages_in_per_s']} msgs/s in, {stage['messages_out_per_s']} out, "
+                  f"{stage['snapshots_per_bot_s']} snapshots/bot/s, {stage['disconnects']} disconnects "
+                  f"-> {'pass' if stage['passed'] else 'FAIL'}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            log.close()
+
+    passed = [s['matches'] for s in stages if s['passed']]
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': git_commit(),
+        'protocol_version': protocol.PROTOCOL_VERSION, 'server': args.spawn or f"{args.host}:{args.port}",
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'config': {'duration': args.duration, 'warmup': args.warmup, 'processes': args.processes,
+                   'input_rate': INPUT_RATE, 'snapshot_rate': args.snapshot_rate, 'max_rtt_ms': args.max_rtt},
+        'stages': stages,
+        'capacity_matches': max(passed) if passed else 0,
+    }
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Capacity: {report['capacity_matches']} matches, report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,19 @@ import time
 import selectors
 import pygame
 
+import physics
 from constants import *
 from sprites import Player, AIPlayer, Ball, BaseGame
+from prediction import Predictor, Interpolator
 from ui import UIManager
 from client import Client, SOCKET_EVENT
+from protocol import CODEC_NAMES
 
 
 class AirHockey(BaseGame):
     def __init__(self):
         super().__init__()
+        self.clock = pygame.time.Clock()
         self.screen = pygame.display.set_mode((SCREENX, SCREENY))
         self.ui = UIManager(self)
         self.client = None
@@ -52,7 +56,9 @@ class AirHockey(BaseGame):
         if self.client:
             return
 
-        self.client = Client(sel, 'localhost', 22222)
+        self.client = Client(sel, 'localhost', 22222, CODEC_NAMES[NETWORK_CODEC])
+        self.predictor = Predictor(self.player2.body, physics.player_bounds(self.board_rect, 1))
+        self.interpolator = Interpolator(self.board_rect)
         self.client.connect()
         self.client.send('JOIN_GAME')
         self.state = 'WAITING'
@@ -66,17 +72,24 @@ class AirHockey(BaseGame):
     def handle_online_event(self, event):
         if event.header == 'GAME_UPDATE':
             self.state = 'PLAYING'
-            self.ball.rect.center = event.body['ball']
-            self.player1.rect.center = event.body['opponent']
+            body = event.body
+            # Drawn from the buffer every frame, old servers send no time
+            self.interpolator.push(body['received'], body.get('time'), body['ball'], body['opponent'])
+            if 'input' in body:
+                self.predictor.reconcile(body['input'], body['player'])
         elif event.header == 'GOAL':
             self.goal = True
-            self.scores = event.body['scores']
+            self.scores = list(event.body['scores'])
         elif event.header == 'PLAYER_POS':
-            self.player2.rect.center = event.body['rect']
+            self.predictor.reset(event.body['rect'])
+            self.interpolator.clear()
             self.goal = False
         elif event.header == 'GAME_OVER':
             self.state = 'PAUSED'
             self.ui.pause_message = 'You win!' if event.body['winner'] else 'You lose!'
+        elif event.header == 'MATCH_TIMEOUT':
+            print("No opponent found")
+            self.disconnect_client()
 
     def run(self):
         self.ui.prepare()
@@ -89,6 +102,12 @@ class AirHockey(BaseGame):
 
         try:
             while not self.game_over:
+                # Messages the network thread got since the last frame, handled in this one
+                if self.client:
+                    connected = self.client.listen()
+                    if not connected:
+                        self.disconnect_client()
+
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         self.game_over = True
@@ -103,17 +122,20 @@ class AirHockey(BaseGame):
                         self.handle_online_event(event)
 
                 self.ui.draw(self.screen)
-                if self.client:
-                    connected = self.client.listen()
-                    if not connected:
-                        self.disconnect_client()
-
                 if self.state == 'PLAYING' and self.client:
-                    self.player2.update()
-                    self.client.send('PLAYER_MOVE', {
-                        'rect': self.player2.rect.center, 
-                        'velocity': list(self.player2.velocity)
-                    })
+                    if self.client.version >= 2:
+                        # Moved right away, the server checks it from the input
+                        target = pygame.mouse.get_pos() if pygame.mouse.get_pressed()[0] else None
+                        self.client.send('PLAYER_INPUT', self.predictor.move(target, self.tick))
+                    else:
+                        self.player2.update()
+                        self.client.send('PLAYER_MOVE', {
+                            'rect': self.player2.center, 
+                            'velocity': list(self.player2.velocity)
+                        })
+                    positions = self.interpolator.sample(time.perf_counter())
+                    if positions:
+                        self.ball.center, self.player1.center = positions
                 elif self.state == 'PLAYING':
                     self.all_sprites.update()
 
@@ -0,0 +1,114 @@
+"""
+Matchmaking for the online servers
+
+Waiting players are kept in buckets of similar rating and round trip time,
+each an OrderedDict in the order they joined, plus an index of the bucket of
+every player. Joining, leaving and matching are all O(1): a new player is
+paired with whoever waited longest in its bucket, or added at its end.
+
+Players that waited WIDEN_AFTER seconds are also matched with the first
+player of the neighbouring buckets, and after MATCH_TIMEOUT they are taken
+out of the queue so the server can tell them. update() only looks at the
+first player of every bucket, the others joined later.
+"""
+import time
+from collections import OrderedDict
+
+
+# Rating points and seconds of round trip time per bucket
+SKILL_BUCKET = 200
+LATENCY_BUCKET = 0.05
+# Seconds before looking in the neighbouring buckets, and before giving up
+WIDEN_AFTER = 5
+MATCH_TIMEOUT = 60
+
+RATING_START = 1000
+RATING_K = 32
+
+
+class Matchmaker:
+    def __init__(self, skill_bucket=SKILL_BUCKET, latency_bucket=LATENCY_BUCKET,
+                 widen_after=WIDEN_AFTER, timeout=MATCH_TIMEOUT):
+        self.skill_bucket = skill_bucket
+        self.latency_bucket = latency_bucket
+        self.widen_after = widen_after
+        self.timeout = timeout
+        # (skill, latency) bucket -> OrderedDict of player -> time it joined
+        self.buckets = {}
+        self.where = {}
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, player):
+        return player in self.where
+
+    def bucket(self, rating, rtt):
+        return int(rating // self.skill_bucket), int((rtt or 0) // self.latency_bucket)
+
+    def enqueue(self, player, rating=RATING_START, rtt=None):
+        "Returns (player, opponent) when someone in the bucket was waiting, else queues the player"
+        if player in self.where:
+            return None
+        key = self.bucket(rating, rtt)
+        waiting = self.buckets.get(key)
+        if waiting:
+            opponent, _ = waiting.popitem(last=False)
+            del self.where[opponent]
+            if not waiting:
+                del self.buckets[key]
+            return player, opponent
+
+        self.buckets.setdefault(key, OrderedDict())[player] = time.perf_counter()
+        self.where[player] = key
+        return None
+
+    def cancel(self, player):
+        "Take a player out of the queue (left or matched elsewhere), does nothing if it isn't queued"
+        key = self.where.pop(player, None)
+        if key is None:
+            return
+        waiting = self.buckets[key]
+        del waiting[player]
+        if not waiting:
+            del self.buckets[key]
+
+    def update(self, now=None):
+        "Match the players that waited long enough across buckets, returns (pairs, players that timed out)"
+        now = time.perf_counter() if now is None else now
+        pairs, expired = [], []
+        for key in list(self.buckets):
+            while key in self.buckets:
+                player, since = next(iter(self.buckets[key].items()))
+                waited = now - since
+                if waited >= self.timeout:
+                    self.cancel(player)
+                    expired.append(player)
+                    continue
+                if waited < self.widen_after:
+                    break
+                opponent = self.neighbour(key)
+                if opponent is None:
+                    break
+                self.cancel(player)
+                self.cancel(opponent)
+                pairs.append((player, opponent))
+        return pairs, expired
+
+    def neighbour(self, key):
+        "Longest waiting player of a bucket next to key"
+        skill, latency = key
+        for dskill in (0, -1, 1):
+            for dlatency in (0, -1, 1):
+                if dskill or dlatency:
+                    waiting = self.buckets.get((skill + dskill, latency + dlatency))
+                    if waiting:
+                        return next(iter(waiting))
+        return None
+
+
+def update_ratings(winner, loser, k=RATING_K):
+    "Elo update of the two players' rating attributes"
+    expected = 1 / (1 + 10 ** ((loser.rating - winner.rating) / 400))
+    winner.rating += k * (1 - expected)
+    loser.rating -= k * (1 - expected)
@@ -0,0 +1,229 @@
+"""
+Headless air hockey simulation
+
+Bodies are plain __slots__ objects and the rules are functions over them, so
+the server never imports pygame and the client sprites only draw what the
+bodies say. Bounds can be a Bounds or a pygame.Rect, only their edges are
+used. Speeds are in pixels per millisecond and tick is the step in
+milliseconds, like the rest of the game.
+"""
+import math
+import time
+
+from constants import *
+
+
+class Bounds:
+    "Axis aligned rectangle with the pygame.Rect attributes the simulation needs"
+    __slots__ = ('left', 'top', 'width', 'height')
+
+    def __init__(self, left, top, width, height):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+    @property
+    def right(self):
+        return self.left + self.width
+
+    @property
+    def bottom(self):
+        return self.top + self.height
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def centerx(self):
+        return self.left + self.width // 2
+
+    @property
+    def centery(self):
+        return self.top + self.height // 2
+
+    @property
+    def center(self):
+        return self.centerx, self.centery
+
+    def collidepoint(self, x, y):
+        return self.left <= x < self.right and self.top <= y < self.bottom
+
+
+class Body:
+    "A round body (ball or striker), position of its center and velocity per tick"
+    __slots__ = ('x', 'y', 'vx', 'vy', 'radius')
+
+    def __init__(self, x, y, radius):
+        self.x = x
+        self.y = y
+        self.vx = self.vy = 0.0
+        self.radius = radius
+
+    @property
+    def center(self):
+        "Position rounded to whole pixels, for drawing and sending"
+        return round(self.x), round(self.y)
+
+    def place(self, x, y):
+        self.x, self.y = x, y
+
+    def stop(self):
+        self.vx = self.vy = 0.0
+
+    def speed(self):
+        return math.hypot(self.vx, self.vy)
+
+
+def limit_speed(body, max_speed):
+    speed = body.speed()
+    if speed > max_speed:
+        body.vx *= max_speed / speed
+        body.vy *= max_speed / speed
+
+
+def check_bounds(body, bounds):
+    "Ensures that the body (its bounding box) is within the bounds"
+    r = body.radius
+    if body.x - r < bounds.left:
+        body.x = bounds.left + r
+    elif body.x + r > bounds.right:
+        body.x = bounds.right - r
+
+    if body.y - r < bounds.top:
+        body.y = bounds.top + r
+    elif body.y + r > bounds.bottom:
+        body.y = bounds.bottom - r
+    return body
+
+
+def collide(ball, player):
+    "Check collisions between the ball and a striker and bounce accordingly"
+    # https://stackoverflow.com/a/345863
+    # Check for collisions (distance b/w centers <= sum of radii)
+    dx, dy = player.x - ball.x, player.y - ball.y
+    distance = math.hypot(dx, dy)
+    if distance > player.radius + ball.radius:
+        return False
+
+    # Get projections of both velocities in the direction of collision
+    distance = distance or 1
+    nx, ny = dx / distance, dy / distance
+    bvi = ball.vx * nx + ball.vy * ny
+    pvi = player.vx * nx + player.vy * ny
+
+    # Apply collision in 1D (mass of player >> mass of ball)
+    bvf = 2 * pvi - bvi
+    ball.vx += (bvf - bvi) * nx
+    ball.vy += (bvf - bvi) * ny
+
+    # Prevent sticking
+    offset = player.radius + ball.radius - distance + 2
+    ball.x -= nx * offset
+    ball.y -= ny * offset
+    return True
+
+
+def is_goal(x, y, radius, bounds):
+    "Is a ball at (x, y) through one of the goals"
+    if y - radius < bounds.top or y + radius > bounds.bottom:
+        goal_edge_size = (bounds.width - GOAL_WIDTH) // 2
+        return x - radius > goal_edge_size and x + radius < goal_edge_size + GOAL_WIDTH
+    return False
+
+
+def move_ball(ball, bounds, scored=False):
+    "Moves the ball one tick, bouncing off the walls, returns True when it is in a goal"
+    # Once a goal is scored the ball keeps going into the net
+    if scored or is_goal(ball.x + ball.vx, ball.y + ball.vy, ball.radius, bounds):
+        ball.x += ball.vx
+        ball.y += ball.vy
+        return True
+
+    # Do bouncing of walls
+    r = ball.radius
+    tx, ty = ball.x + ball.vx, ball.y + ball.vy
+    if tx - r < bounds.left or tx + r > bounds.right:
+        ball.vx *= -0.5
+    if ty - r < bounds.top or ty + r > bounds.bottom:
+        ball.vy *= -0.5
+
+    ball.x += ball.vx
+    ball.y += ball.vy
+    check_bounds(ball, bounds)
+    return False
+
+
+def step_ball(ball, players, bounds, tick, scored=False):
+    "One tick of the ball against both strikers and the walls, returns True when it is in a goal"
+    for player in players:
+        collide(ball, player)
+
+    # Restrict max speed
+    limit_speed(ball, MAX_BALL_SPEED * tick)
+    return move_ball(ball, bounds, scored)
+
+
+def move_towards(body, target, max_speed, tick):
+    "Moves a striker towards target at no more than max_speed, its velocity is the step taken"
+    body.vx, body.vy = target[0] - body.x, target[1] - body.y
+    limit_speed(body, max_speed * tick)
+    body.x += body.vx
+    body.y += body.vy
+
+
+def move_player(body, target, bounds, tick):
+    "Moves a player's striker towards target kept inside its half (bounds), the same on clients and the server"
+    target = check_bounds(Body(target[0], target[1], body.radius), bounds)
+    move_towards(body, (target.x, target.y), MAX_PLAYER_SPEED, tick)
+
+
+def player_bounds(bounds, side):
+    "Half of the board a striker stays in, side 0 is the top"
+    height = bounds.height // 2
+    return Bounds(bounds.left, bounds.top + (0 if side == 0 else height), bounds.width, height)
+
+
+def ai_move(player, ball, bounds, difficulty, tick):
+    "Moves a computer striker within its half (bounds) one tick"
+    if bounds.collidepoint(ball.x, ball.y):
+        # ball is in my field!
+        max_speed = difficulty * MAX_PLAYER_SPEED / 4
+        distance = math.hypot(player.x - ball.x, player.y - ball.y)
+        if distance < player.radius + ball.radius - (2 * AI_DIFFICULTY):
+            target = 2 * player.x - ball.x, 2 * player.y - ball.y
+        else:
+            target = ball.x, ball.y
+    else:
+        # Just move horizontally towards the ball, vertically to center
+        max_speed = difficulty * MAX_PLAYER_SPEED / 8
+        target = ball.x, bounds.centery
+
+    # Keep the target inside my half
+    target = check_bounds(Body(target[0], target[1], player.radius), bounds)
+    move_towards(player, (target.x, target.y), max_speed, tick)
+
+
+class BaseGame:
+    "Base Game Class to be used by both server and client"
+    def __init__(self):
+        self.player1 = self.player2 = self.ball = None
+        self.board_rect = None
+        self.winner = None
+        self.goal = False
+        self.time_of_goal = self.tick = 0
+        self.scores = [0, 0]
+
+    def score_goal(self):
+        self.goal = True
+        self.time_of_goal = time.time()
+        if self.ball.center[1] < SCREENY//2:
+            self.scores[0] += 1
+        else:
+            self.scores[1] += 1
+
+        if self.scores[0] == 7:
+            self.winner = self.player1
+        elif self.scores[1] == 7:
+            self.winner = self.player2
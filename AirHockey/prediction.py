@@ -0,0 +1,147 @@
+"""
+Smooth online play
+
+The local striker is predicted: every input moves it right away and is sent
+to the server numbered. Snapshots say where the server has the striker after
+the last input it applied, the inputs it hadn't seen yet are replayed on top
+of that and the striker only jumps when the two disagree.
+
+The ball and the opponent are drawn a little in the past (INTERPOLATION_DELAY)
+between the two snapshots around that time, using the server's timestamps.
+When the next snapshot is late the ball keeps moving with the physics from
+the newest one.
+"""
+import math
+from collections import deque
+
+import physics
+from constants import *
+
+
+# Pixels the replayed striker may be off before it is moved, rounding in snapshots is up to 1px
+RECONCILE_TOLERANCE = 2
+
+
+class Predictor:
+    "Moves the local striker as inputs happen and corrects it from the server"
+    def __init__(self, body, bounds):
+        self.body = body
+        self.bounds = bounds
+        self.seq = 0
+        # (seq, target, tick) sent but not applied by the server yet
+        self.pending = deque()
+        self.corrections = 0
+
+    def move(self, target, tick):
+        "Apply an input locally (target None to stay), returns the PLAYER_INPUT body"
+        if target is None:
+            target = self.body.center
+        target = round(target[0]), round(target[1])
+        tick = max(1, min(round(tick), MAX_INPUT_TICK))
+        self.seq = (self.seq + 1) & 0xFFFF
+        physics.move_player(self.body, target, self.bounds, tick)
+        self.pending.append((self.seq, target, tick))
+        return {'seq': self.seq, 'target': target, 'tick': tick}
+
+    def reconcile(self, last_input, position):
+        "The server has the striker at position after last_input, replay what came after"
+        # Sequence numbers wrap, anything up to half the range behind is old
+        while self.pending and (last_input - self.pending[0][0]) & 0xFFFF < 0x8000:
+            self.pending.popleft()
+
+        replay = physics.Body(*position, self.body.radius)
+        for _, target, tick in self.pending:
+            physics.move_player(replay, target, self.bounds, tick)
+        if math.hypot(replay.x - self.body.x, replay.y - self.body.y) > RECONCILE_TOLERANCE:
+            self.body.place(replay.x, replay.y)
+            self.corrections += 1
+
+    def reset(self, position):
+        "The server put the striker back (new game or after a goal)"
+        self.body.place(*position)
+        self.body.stop()
+        self.pending.clear()
+
+
+class Interpolator:
+    "Buffer of (server ms, ball, opponent) snapshots, sampled INTERPOLATION_DELAY behind the server"
+    def __init__(self, bounds, delay=INTERPOLATION_DELAY, limit=EXTRAPOLATION_LIMIT):
+        self.bounds = bounds
+        self.delay = delay
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        self.snapshots = deque(maxlen=32)
+        # Server time minus local time in ms, smoothed over snapshots
+        self.offset = None
+        self.last_raw = None
+        # Shortest gap between snapshots seen, the server's send interval
+        self.interval = None
+
+    def push(self, received, server_time, ball, opponent):
+        "Add a snapshot received at local time received (seconds), server_time is None for old servers"
+        local = received * 1000
+        if server_time is None:
+            server_ms = local
+        elif self.last_raw is None:
+            server_ms = server_time
+        else:
+            # The server sends 16 bits of milliseconds
+            server_ms = self.snapshots[-1][0] + ((server_time - self.last_raw) & 0xFFFF)
+        if self.snapshots and server_ms <= self.snapshots[-1][0]:
+            return
+        self.last_raw = server_time
+
+        if self.snapshots:
+            newest = self.snapshots[-1]
+            gap = server_ms - newest[0]
+            self.interval = gap if self.interval is None else min(self.interval, gap)
+            if gap > 1.5 * self.interval:
+                # Nothing changed in between (the server skips those), hold still until just before this one
+                self.snapshots.append((server_ms - self.interval,) + newest[1:])
+
+        self.snapshots.append((server_ms, tuple(ball), tuple(opponent)))
+        offset = server_ms - local
+        self.offset = offset if self.offset is None else self.offset + (offset - self.offset) * 0.1
+
+    def sample(self, now):
+        "(ball, opponent) to draw at local time now (seconds), None before the first snapshot"
+        if not self.snapshots:
+            return None
+        render = now * 1000 + self.offset - self.delay
+        # Keep one snapshot at or before the render time
+        while len(self.snapshots) > 2 and self.snapshots[1][0] <= render:
+            self.snapshots.popleft()
+
+        for (t0, ball0, opponent0), (t1, ball1, opponent1) in zip(self.snapshots, list(self.snapshots)[1:]):
+            if t0 <= render <= t1:
+                k = (render - t0) / (t1 - t0)
+                return lerp(ball0, ball1, k), lerp(opponent0, opponent1, k)
+
+        oldest, newest = self.snapshots[0], self.snapshots[-1]
+        if render < oldest[0] or len(self.snapshots) < 2:
+            return oldest[1], oldest[2]
+        return self.extrapolate(render), newest[2]
+
+    def extrapolate(self, render):
+        "Ball moved on from the newest snapshot with the physics, velocity from the last two"
+        (t0, ball0, _), (t1, ball1, opponent) = self.snapshots[-2], self.snapshots[-1]
+        elapsed = min(render - t1, self.limit)
+        step = 1000 / TICK_RATE
+        ball = physics.Body(*ball1, BALL_RADIUS)
+        ball.vx, ball.vy = (ball1[0] - ball0[0]) / (t1 - t0) * step, (ball1[1] - ball0[1]) / (t1 - t0) * step
+        players = physics.Body(*opponent, PLAYER_RADIUS),
+        steps, part = divmod(elapsed, step)
+        for _ in range(int(steps)):
+            if physics.step_ball(ball, players, self.bounds, step):
+                break
+        else:
+            # Part of a tick, so the ball doesn't move in 1 tick jumps
+            ball.x += ball.vx * part / step
+            ball.y += ball.vy * part / step
+        return ball.x, ball.y
+
+
+def lerp(a, b, k):
+    return a[0] + (b[0] - a[0]) * k, a[1] + (b[1] - a[1]) * k
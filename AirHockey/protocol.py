@@ -0,0 +1,205 @@
+"""
+Wire formats of the online game
+
+Every message is a header name and a body dict. The binary codec packs it as
+a 1 byte message type followed by a fixed struct layout, the JSON codec keeps
+the old 4 byte length prefixed JSON for debugging.
+
+A connection starts with the client sending HELLO (always binary) with its
+protocol version and the codec it wants, the server answers with the version
+and codec both sides use from then on. Peers that start with anything else
+are old JSON clients and are answered in JSON.
+
+Version 2 clients get SNAPSHOT instead of GAME_UPDATE: only the fields that
+changed since a snapshot the client acknowledged, see snapshot.py. They send
+PLAYER_INPUT instead of PLAYER_MOVE and the server moves their striker.
+Version 3 clients are offered a UDP channel for the realtime messages, see
+udp.py. Version 4 clients answer the server's PING, so its matchmaking
+knows their round trip time, and are told with MATCH_TIMEOUT when nobody
+could be found for them.
+"""
+import json
+import struct
+
+
+PROTOCOL_VERSION = 4
+# Oldest version the server still talks to
+MIN_VERSION = 1
+
+
+class ProtocolError(ValueError):
+    "Raised for messages that can't be encoded or decoded"
+
+
+class Message:
+    """
+    Fixed layout message, fields are (name, count) pairs where count 1 is a
+    single value and anything else a tuple of that many values
+    """
+    def __init__(self, type_id, header, fmt='', fields=()):
+        self.type_id = type_id
+        self.header = header
+        self.struct = struct.Struct('!' + fmt)
+        self.fields = fields
+        self.size = 1 + self.struct.size
+
+    def pack(self, body):
+        values = []
+        for name, count in self.fields:
+            if count == 1:
+                values.append(body[name])
+            else:
+                values.extend(body[name])
+        try:
+            return bytes((self.type_id,)) + self.struct.pack(*values)
+        except struct.error as e:
+            raise ProtocolError(f"Can't pack {self.header}: {e}") from None
+
+    def parse(self, buffer, offset):
+        "(body, offset after the message) or None if the buffer doesn't hold all of it yet"
+        end = offset + self.size
+        if len(buffer) < end:
+            return None
+        values = self.struct.unpack_from(buffer, offset + 1)
+        body, i = {}, 0
+        for name, count in self.fields:
+            body[name] = values[i] if count == 1 else values[i:i + count]
+            i += count
+        return body, end
+
+
+class SnapshotMessage(Message):
+    """
+    Variable layout: sequence number, game time in milliseconds and the last
+    input of the client applied (both 16 bit, wrapping), distance back to
+    the base snapshot (0 for none), a mask with 2 bits per field, then every
+    field present as a pair of int8 or int16 depending on its size
+    """
+    SIZES = {1: struct.Struct('!bb'), 2: struct.Struct('!hh')}
+
+    def __init__(self, type_id, header, fields):
+        super().__init__(type_id, header, 'HHHBB')
+        self.fields = fields
+
+    def pack(self, body):
+        seq, base = body['seq'], body['base']
+        distance = 0 if base is None else (seq - base) & 0xFFFF
+        if distance > 255:
+            raise ProtocolError(f"Can't pack {self.header}: base {base} is too old for {seq}")
+
+        mask, values = 0, []
+        for i, name in enumerate(self.fields):
+            if name not in body:
+                continue
+            x, y = body[name]
+            size = 1 if -128 <= x < 128 and -128 <= y < 128 else 2
+            try:
+                values.append(self.SIZES[size].pack(x, y))
+            except struct.error as e:
+                raise ProtocolError(f"Can't pack {self.header}: {e}") from None
+            mask |= size << (2 * i)
+        header = self.struct.pack(seq, body['time'] & 0xFFFF, body['input'], distance, mask)
+        return bytes((self.type_id,)) + header + b"".join(values)
+
+    def parse(self, buffer, offset):
+        end = offset + self.size
+        if len(buffer) < end:
+            return None
+        seq, time, last_input, distance, mask = self.struct.unpack_from(buffer, offset + 1)
+        body = {'seq': seq, 'time': time, 'input': last_input, 'base': (seq - distance) & 0xFFFF if distance else None}
+        for i, name in enumerate(self.fields):
+            size = (mask >> (2 * i)) & 3
+            if not size:
+                continue
+            pair = self.SIZES.get(size)
+            if pair is None:
+                raise ProtocolError(f"Bad field size in {self.header}: {size}")
+            if len(buffer) < end + pair.size:
+                return None
+            body[name] = pair.unpack_from(buffer, end)
+            end += pair.size
+        return body, end
+
+
+# Positions carried by SNAPSHOT, in the order of its mask
+SNAPSHOT_FIELDS = ('ball', 'opponent', 'player')
+
+MESSAGES = [
+    Message(1, 'HELLO', 'HB', (('version', 1), ('codec', 1))),
+    Message(2, 'JOIN_GAME'),
+    Message(3, 'PLAYER_MOVE', 'hhff', (('rect', 2), ('velocity', 2))),
+    Message(4, 'GAME_UPDATE', 'hhhh', (('ball', 2), ('opponent', 2))),
+    Message(5, 'PLAYER_POS', 'hh', (('rect', 2),)),
+    Message(6, 'GOAL', 'BB', (('scores', 2),)),
+    Message(7, 'GAME_OVER', '?', (('winner', 1),)),
+    SnapshotMessage(8, 'SNAPSHOT', SNAPSHOT_FIELDS),
+    Message(9, 'ACK', 'H', (('seq', 1),)),
+    Message(10, 'PLAYER_INPUT', 'HhhB', (('seq', 1), ('target', 2), ('tick', 1))),
+    Message(11, 'UDP_TOKEN', 'IH', (('token', 1), ('port', 1))),
+    Message(12, 'PING', 'I', (('id', 1),)),
+    Message(13, 'PONG', 'I', (('id', 1),)),
+    Message(14, 'MATCH_TIMEOUT'),
+]
+BY_HEADER = {m.header: m for m in MESSAGES}
+BY_TYPE = {m.type_id: m for m in MESSAGES}
+
+# Sent over UDP once both sides have it, the reliable ones are resent until acknowledged
+UDP_MESSAGES = {'GAME_UPDATE', 'SNAPSHOT', 'ACK', 'PLAYER_MOVE', 'PLAYER_INPUT', 'PLAYER_POS', 'GOAL', 'GAME_OVER'}
+RELIABLE_MESSAGES = {'PLAYER_POS', 'GOAL', 'GAME_OVER'}
+
+
+class BinaryCodec:
+    codec_id = 1
+    name = 'binary'
+
+    def encode(self, header, body):
+        message = BY_HEADER.get(header)
+        if message is None:
+            raise ProtocolError(f"Unknown message: {header}")
+        return message.pack(body)
+
+    def parse(self, buffer, offset=0):
+        "(header, body, offset after the message) or None if the message is incomplete"
+        if len(buffer) <= offset:
+            return None
+        message = BY_TYPE.get(buffer[offset])
+        if message is None:
+            raise ProtocolError(f"Unknown message type: {buffer[offset]}")
+        parsed = message.parse(buffer, offset)
+        if parsed is None:
+            return None
+        return (message.header,) + parsed
+
+
+class JSONCodec:
+    "Readable in a packet capture, several times bigger and slower than binary"
+    codec_id = 2
+    name = 'json'
+    length = struct.Struct('!I')
+
+    def encode(self, header, body):
+        message = json.dumps({"header": header, "body": body}).encode()
+        return self.length.pack(len(message)) + message
+
+    def parse(self, buffer, offset=0):
+        if len(buffer) < offset + 4:
+            return None
+        end = offset + 4 + self.length.unpack_from(buffer, offset)[0]
+        if len(buffer) < end:
+            return None
+        data = json.loads(bytes(buffer[offset + 4:end]).decode())
+        return data['header'], data['body'], end
+
+
+BINARY, JSON = BinaryCodec(), JSONCodec()
+CODECS = {codec.codec_id: codec for codec in (BINARY, JSON)}
+CODEC_NAMES = {codec.name: codec for codec in (BINARY, JSON)}
+
+
+def hello(codec, version=PROTOCOL_VERSION):
+    "HELLO message, always sent in binary so the peer can read it before choosing a codec"
+    return BINARY.encode('HELLO', {'version': version, 'codec': codec.codec_id})
+
+
+def is_hello(buffer, offset=0):
+    return len(buffer) > offset and buffer[offset] == BY_HEADER['HELLO'].type_id
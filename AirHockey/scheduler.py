@@ -0,0 +1,72 @@
+import time
+
+from constants import TICK_RATE
+
+
+class TickScheduler:
+    """
+    Advances every game by the same fixed timestep, TICK_RATE times a second.
+
+    Real time is added to an accumulator and whole steps are taken out of it,
+    so the simulation rate doesn't depend on how long the loop slept or how
+    many games are running. If the server falls too far behind the backlog is
+    dropped instead of running an ever growing number of catch-up steps.
+    """
+    def __init__(self, rate=TICK_RATE, max_steps=5, report_interval=10):
+        self.step = 1 / rate
+        self.max_steps = max_steps
+        self.report_interval = report_interval
+        self.accumulator = 0.0
+        self.last_time = self.last_report = time.perf_counter()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        # Ticks taken, ticks slower than the step, catch-up ticks, ticks dropped
+        self.ticks = self.overruns = self.late = self.dropped = 0
+        self.busy = self.max_busy = 0.0
+
+    def timeout(self):
+        "Seconds until the next tick is due, use it as the select() timeout"
+        return max(0.0, self.step - self.accumulator - (time.perf_counter() - self.last_time))
+
+    def run(self, games):
+        "Take every step that is due, returns the number of steps taken"
+        now = time.perf_counter()
+        self.accumulator += now - self.last_time
+        self.last_time = now
+
+        steps = 0
+        while self.accumulator >= self.step and steps < self.max_steps:
+            start = time.perf_counter()
+            # Games remove themselves from the list when they end
+            for game in list(games):
+                game.update(self.step)
+            busy = time.perf_counter() - start
+
+            self.accumulator -= self.step
+            self.ticks += 1
+            self.busy += busy
+            self.max_busy = max(self.max_busy, busy)
+            if busy > self.step:
+                self.overruns += 1
+            if steps:
+                self.late += 1
+            steps += 1
+
+        if self.accumulator >= self.step:
+            dropped = int(self.accumulator / self.step)
+            self.dropped += dropped
+            self.accumulator -= dropped * self.step
+
+        if now - self.last_report >= self.report_interval:
+            if games:
+                print(self.report(now - self.last_report, len(games)))
+            self.last_report = now
+            self.reset_metrics()
+        return steps
+
+    def report(self, elapsed, games):
+        average = self.busy / self.ticks * 1000 if self.ticks else 0
+        return (f"{games} games, {self.ticks / elapsed:.1f} ticks/s, tick {average:.2f}ms avg "
+                f"{self.max_busy * 1000:.2f}ms max, {self.overruns} overruns, "
+                f"{self.late} late, {self.dropped} dropped")
@@ -1,21 +1,30 @@
+import argparse
+import itertools
 import socket
 import selectors
 import time
 
-import pygame
-
-from sprites import Ball, BaseGame
+import physics
+from physics import BaseGame
 from constants import *
+from matchmaking import Matchmaker, RATING_START, update_ratings
 from socketclient import SocketClient
+from scheduler import TickScheduler
+from snapshot import SnapshotEncoder
+from udp import UdpServer
 
 
 class Game(BaseGame):
-    def __init__(self, server, client1, client2):
+    def __init__(self, server, game_id, client1, client2):
         super().__init__()
         self.server = server
+        self.id = game_id
         self.player1, self.player2 = client1, client2
-        self.board_rect = pygame.Rect(0, 50, SCREENX, SCREENY-50)
-        self.ball = Ball(self, *self.board_rect.center)
+        self.board_rect = physics.Bounds(0, 50, SCREENX, SCREENY-50)
+        self.ball = physics.Body(*self.board_rect.center, BALL_RADIUS)
+        # Simulation time since the last snapshot went out, and since the game started (ms)
+        self.since_snapshot = 0.0
+        self.time = 0.0
 
         self.player1.set_side(self, 'TOP')
         self.player2.set_side(self, 'DOWN')
@@ -36,43 +45,76 @@ class Game(BaseGame):
     def reset(self):
         self.player1.set_side(self, 'TOP')
         self.player2.set_side(self, 'DOWN')
-        self.ball.reset()
+        self.ball.place(*self.board_rect.center)
+        self.ball.stop()
         self.goal = False
 
-    def update(self):
-        if self.goal:
-            if time.time() - self.time_of_goal >= GOAL_TEXT_DELAY:
-                self.reset()
-            return
+    def update(self, dt):
+        "Advance the game by dt seconds, always the same step when called by the scheduler"
+        # Speeds are in pixels per millisecond
+        self.tick = dt * 1000
+        self.time += self.tick
+        if not self.goal:
+            players = self.player1.body, self.player2.body
+            if physics.step_ball(self.ball, players, self.board_rect, self.tick):
+                self.score_goal()
+        elif time.time() - self.time_of_goal >= GOAL_TEXT_DELAY:
+            self.reset()
 
-        self.player1.update()
-        self.player2.update()
-        self.ball.update()
-        self.tick = self.clock.tick(60)
+        # Clients are updated at the snapshot rate, whatever the tick rate
+        self.since_snapshot += dt
+        if self.since_snapshot >= self.server.snapshot_interval and self.id in self.server.games:
+            self.since_snapshot -= self.server.snapshot_interval
+            self.player1.update()
+            self.player2.update()
     
     def close(self):
-        self.server.games.remove(self)
+        self.server.games.pop(self.id, None)
+        if self.winner:
+            # winner is the side that let in the last goal (or left), see send_winner
+            loser = self.winner
+            update_ratings(self.player1 if loser is self.player2 else self.player2, loser)
         [p.reset() for p in (self.player1, self.player2)]
 
 
-class SocketPlayer(SocketClient):
-    def __init__(self, server, selector, sock, address):
-        super().__init__(selector, sock, address)
+class PlayerMixin:
+    "Game side of a connected player, shared by the selectors and asyncio servers"
+    # Set by transports that can't take more for now, updates are skipped meanwhile
+    paused = False
+
+    def setup(self, server):
         self.server = server
+        self.snapshots = SnapshotEncoder()
+        self.rating = RATING_START
+        # Round trip time in seconds, None until a version 4 client answered our PING
+        self.rtt = None
+        self.ping_sent = None
+        self.joining = False
         self.reset()
-    
+
     def reset(self):
-        self.game = self.rect = self.side = None
-        self.velocity = pygame.math.Vector2()
+        self.game = self.side = None
+        self.body = physics.Body(0, 0, PLAYER_RADIUS)
+        # Sequence number of the last PLAYER_INPUT applied
+        self.last_input = 0
+
+    def handle_hello(self, body):
+        super().handle_hello(body)
+        udp = self.server.udp
+        if udp is not None and self.version >= 3:
+            self.send('UDP_TOKEN', {'token': udp.register(self), 'port': udp.port})
+        if self.version >= 4:
+            # Measured once, before the client joins the queue
+            self.ping_sent = time.perf_counter()
+            self.send('PING', {'id': 0})
 
     def set_side(self, game, side):
         self.game = game
         self.side = side
         y = SCREENY//4 + 50 if side == 'TOP' else 3 * SCREENY//4
 
-        self.rect = pygame.Rect(0, 0, PLAYER_RADIUS, PLAYER_RADIUS)
-        self.rect.center = SCREENX//2, y
-        self.send('PLAYER_POS', {'rect': self.resolve_side(self.rect.center)})
+        self.body = physics.Body(SCREENX//2, y, PLAYER_RADIUS)
+        self.send('PLAYER_POS', {'rect': self.resolve_side(self.body.center)})
     
     def resolve_side(self, pos):
         if self.side == 'DOWN':
@@ -83,54 +125,132 @@ class SocketPlayer(SocketClient):
         return center[0] - dx, center[1] - dy
 
     def update(self):
+        if self.paused:
+            # Left to the next update, so the snapshot encoder doesn't count one that was never sent
+            return
         opponent = self.game.player2 if self == self.game.player1 else self.game.player1
-        self.send('GAME_UPDATE', {
-            'ball': self.resolve_side(self.game.ball.rect.center),
-            'opponent': self.resolve_side(opponent.rect.center)
-        })
+        positions = {
+            'ball': self.resolve_side(self.game.ball.center),
+            'opponent': self.resolve_side(opponent.body.center),
+            'player': self.resolve_side(self.body.center)
+        }
+        if self.version < 2:
+            self.send('GAME_UPDATE', positions)
+            return
+        snapshot = self.snapshots.encode(positions, round(self.game.time), self.last_input)
+        if snapshot:
+            self.send('SNAPSHOT', snapshot)
 
-    def close(self):
+    def leave(self):
+        "End the player's game and take it out of the server"
         if self.game:
             self.game.winner = self
             self.game.close()
-        if self in self.server.waiting:
-            self.server.waiting.remove(self)
-        super().close()
+        self.server.remove_client(self)
     
     def handle_request(self, data):
         header, body = data['header'], data['body']
         if header == 'JOIN_GAME':
-            self.server.find_game(self)
+            # Queued once the round trip time is known, clients join right after HELLO
+            self.joining = True
+            if self.ping_sent is None:
+                self.server.find_game(self)
         elif header == 'PLAYER_MOVE' and self.game:
-            self.rect.center = self.resolve_side(body['rect'])
-            self.velocity = pygame.math.Vector2(body['velocity'])
-            self.velocity = -self.velocity if self.side == 'TOP' else self.velocity
+            self.body.place(*self.resolve_side(body['rect']))
+            vx, vy = body['velocity']
+            # Velocities turn around with the board for the top player
+            self.body.vx, self.body.vy = (-vx, -vy) if self.side == 'TOP' else (vx, vy)
+        elif header == 'PLAYER_INPUT' and self.game:
+            # Same move as the client predicted, from where the server has the striker
+            bounds = physics.player_bounds(self.game.board_rect, 0 if self.side == 'TOP' else 1)
+            tick = min(body['tick'], MAX_INPUT_TICK)
+            physics.move_player(self.body, self.resolve_side(body['target']), bounds, tick)
+            self.last_input = body['seq']
+        elif header == 'ACK':
+            self.snapshots.ack(body['seq'])
+        elif header == 'PING':
+            self.send('PONG', body)
+        elif header == 'PONG' and self.ping_sent is not None:
+            self.rtt = time.perf_counter() - self.ping_sent
+            self.ping_sent = None
+            if self.joining:
+                self.server.find_game(self)
 
 
-class SocketServer:
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.bind((host, port))
+class SocketPlayer(PlayerMixin, SocketClient):
+    def __init__(self, server, selector, sock, address):
+        super().__init__(selector, sock, address)
+        self.setup(server)
+
+    def close(self):
+        self.leave()
+        super().close()
+
 
+class GameServer:
+    "Matchmaking and the game tick, transports are left to subclasses"
+    def __init__(self, snapshot_rate=SNAPSHOT_RATE):
         self.clients = set()
-        self.waiting = []
-        self.games = []
+        self.matchmaker = Matchmaker()
+        self.last_matchmaking = time.perf_counter()
+        # Game id -> Game, the ids are never reused
+        self.games = {}
+        self.game_ids = itertools.count(1)
+        self.scheduler = TickScheduler()
+        self.snapshot_interval = 1 / min(snapshot_rate, TICK_RATE)
+        # UdpServer of the servers that offer UDP
+        self.udp = None
     
     def find_game(self, client):
-        if not self.waiting:
-            self.waiting.append(client)
-        else:
-            opponent = self.waiting.pop(0)
-            game = Game(self, client, opponent)
-            print(f'New game created')
-            self.games.append(game)
-            return game
+        client.joining = False
+        if client.game:
+            return None
+        pair = self.matchmaker.enqueue(client, client.rating, client.rtt)
+        if pair:
+            return self.add_game(*pair)
+
+    def add_game(self, client1, client2):
+        game = Game(self, next(self.game_ids), client1, client2)
+        print(f'New game created: {game.id}')
+        self.games[game.id] = game
+        return game
+
+    def matchmaking(self):
+        "Pair the players that waited in neighbouring buckets, and send away those nobody was found for"
+        now = time.perf_counter()
+        if now - self.last_matchmaking < MATCHMAKING_INTERVAL:
+            return
+        self.last_matchmaking = now
+        pairs, expired = self.matchmaker.update(now)
+        for pair in pairs:
+            self.add_game(*pair)
+        for client in expired:
+            if client.version >= 4:
+                client.send('MATCH_TIMEOUT')
+            else:
+                # Older clients only know to go back to their menu when the connection ends
+                client.close()
+
+    def remove_client(self, client):
+        self.clients.discard(client)
+        self.matchmaker.cancel(client)
+        if self.udp is not None:
+            self.udp.unregister(client)
+
+
+class SocketServer(GameServer):
+    def __init__(self, host, port, udp=None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind((host, port))
+        self.selector = selectors.DefaultSelector()
+        self.udp = udp
 
     def accept(self):
         sock, address = self.sock.accept()
-        client = SocketPlayer(self, sel, sock, address)
+        client = SocketPlayer(self, self.selector, sock, address)
         self.clients.add(client)
         print(f'Connected to client: {address}')
 
@@ -138,35 +258,59 @@ class SocketServer:
         print(f"Listening to port {self.port}")
         self.sock.listen()
         self.sock.setblocking(False)
-        sel.register(self.sock, selectors.EVENT_READ, data=None)
+        self.selector.register(self.sock, selectors.EVENT_READ, data=None)
+        if self.udp is not None:
+            # Datagrams are read through the same client path, UdpServer has process_event
+            self.selector.register(self.udp.sock, selectors.EVENT_READ, data=self.udp)
+        self.serve()
+
+    def poll(self):
+        "One fixed rate tick for all games, then wait for sockets until the next one"
+        self.scheduler.run(self.games.values())
+        self.matchmaking()
+        if self.udp is not None:
+            self.udp.flush()
+
+        timeout = self.scheduler.timeout()
+        if self.udp is not None and self.udp.timeout() is not None:
+            timeout = min(timeout, self.udp.timeout())
+        events = self.selector.select(timeout=timeout)
+        for key, mask in events:
+            if key.data is None:
+                self.accept()
+            else:
+                client = key.data
+                try:
+                    client.process_event(mask)
+                except Exception as e:
+                    print("Client exception caught:", e)
+                    if client.sock is not None:
+                        client.close()
 
+    def serve(self):
         try:
             while True:
-                for game in self.games:
-                    game.update()
-
-                events = sel.select(timeout=1)
-                for key, mask in events:
-                    if key.data is None:
-                        self.accept()
-                    else:
-                        client = key.data
-                        try:
-                            client.process_event(mask)
-                        except Exception as e:
-                            print("Client exception caught:", e)
-                            client.close()
-                            self.clients.remove(client)
+                self.poll()
         except (KeyboardInterrupt, SystemExit):
             print("Got keyboard interrupt, Exiting...")
         except Exception as e:
             print('Server exception caught:', e)
         finally:
-            sel.close()
-            [c.close() for c in self.clients]
+            [c.close() for c in list(self.clients)]
+            self.selector.close()
             self.sock.close()
+            if self.udp is not None:
+                self.udp.close()
 
 
 if __name__ == "__main__":
-    sel = selectors.DefaultSelector()
-    SocketServer(host='', port=22222).listen()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Air hockey server")
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=22222)
+    parser.add_argument('--no-udp', action='store_true', help="keep every message on TCP")
+    parser.add_argument('--udp-loss', type=float, default=0, help="share of UDP packets to lose, for testing")
+    parser.add_argument('--udp-latency', type=float, default=0, help="seconds to delay UDP packets, for testing")
+    parser.add_argument('--udp-jitter', type=float, default=0, help="random +- seconds on the delay")
+    args = parser.parse_args()
+    udp = None if args.no_udp else UdpServer(args.host, args.port, args.udp_loss, args.udp_latency, args.udp_jitter)
+    SocketServer(args.host, args.port, udp).listen()
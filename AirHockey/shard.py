@@ -0,0 +1,291 @@
+"""
+Air hockey server spread over several processes
+
+The acceptor process takes connections, answers HELLO and pairs players on
+JOIN_GAME, then passes both sockets to a worker process over a Unix socket
+(SCM_RIGHTS fd passing). Every worker runs its own SocketServer loop and
+tick scheduler for the games it was given, and reports its load back once a
+second so new games go to the least loaded worker.
+
+Players whose game ends stay with their worker and are matched again there.
+fd passing needs Unix sockets, so this doesn't run on Windows.
+
+Usage:
+    python shard.py --workers 4 --port 22222
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import time
+
+import protocol
+from matchmaking import Matchmaker, RATING_START
+from server import GameServer, SocketServer, SocketPlayer
+from socketclient import SocketClient
+
+
+# Seconds between load reports of a worker, and between load summaries of the acceptor
+LOAD_INTERVAL = 1
+SUMMARY_INTERVAL = 10
+MAX_CONTROL_MESSAGE = 1 << 16
+SPAWN = multiprocessing.get_context('spawn')
+
+
+class WorkerServer(SocketServer):
+    "Runs the games handed over by the acceptor, its control socket takes the place of the listening socket"
+    def __init__(self, index, control):
+        GameServer.__init__(self)
+        self.index = index
+        self.sock = control
+        self.port = None
+        self.selector = selectors.DefaultSelector()
+        self.last_report = time.perf_counter()
+        self.last_ticks = self.last_busy = 0
+
+    def listen(self):
+        self.selector.register(self.sock, selectors.EVENT_READ, data=None)
+        self.serve()
+
+    def accept(self):
+        "Adopt a pair of players sent by the acceptor and start their game"
+        message, fds, _, _ = socket.recv_fds(self.sock, MAX_CONTROL_MESSAGE, 2)
+        if not message:
+            raise SystemExit
+        info = json.loads(message)
+
+        players = []
+        for fd, state in zip(fds, info['players']):
+            player = SocketPlayer(self, self.selector, socket.socket(fileno=fd), tuple(state['address']))
+            player.codec = protocol.CODECS[state['codec']]
+            player.version = state['version']
+            player.awaiting_hello = False
+            player.rating, player.rtt = state['rating'], state['rtt']
+            self.clients.add(player)
+            players.append((player, state))
+
+        # Hand over whatever the acceptor had not sent or read yet, then start the game
+        for player, state in players:
+            if state['unsent']:
+                player._queue(bytes.fromhex(state['unsent']))
+        self.add_game(players[0][0], players[1][0])
+        for player, state in players:
+            if state['unread'] and player.sock is not None:
+                player.feed(bytes.fromhex(state['unread']))
+
+    def poll(self):
+        super().poll()
+        now = time.perf_counter()
+        if now - self.last_report >= LOAD_INTERVAL:
+            self.report_load(now - self.last_report)
+            self.last_report = now
+
+    def report_load(self, elapsed):
+        scheduler = self.scheduler
+        # The scheduler resets its counters now and then, start over when it did
+        if scheduler.ticks < self.last_ticks:
+            self.last_ticks = self.last_busy = 0
+        ticks, busy = scheduler.ticks - self.last_ticks, scheduler.busy - self.last_busy
+        self.last_ticks, self.last_busy = scheduler.ticks, scheduler.busy
+        load = {
+            'games': len(self.games), 'clients': len(self.clients),
+            'tick_ms': busy / ticks * 1000 if ticks else 0.0,
+            # Share of the time spent ticking games, 1.0 means this worker is full
+            'busy': busy / elapsed,
+        }
+        self.sock.send(json.dumps(load).encode())
+
+
+def run_worker(index, control):
+    WorkerServer(index, control).listen()
+
+
+class LobbyPlayer(SocketClient):
+    "A connection waiting in the acceptor for an opponent"
+    def __init__(self, acceptor, selector, sock, address):
+        super().__init__(selector, sock, address)
+        self.acceptor = acceptor
+        self.rating = RATING_START
+        self.rtt = None
+        self.ping_sent = None
+        self.joining = False
+
+    def handle_hello(self, body):
+        super().handle_hello(body)
+        if self.version >= 4:
+            self.ping_sent = time.perf_counter()
+            self.send('PING', {'id': 0})
+
+    def handle_request(self, data):
+        if data['header'] == 'JOIN_GAME':
+            # Queued once the round trip time is known, clients join right after HELLO
+            self.joining = True
+            if self.ping_sent is None:
+                self.acceptor.find_game(self)
+        elif data['header'] == 'PING':
+            self.send('PONG', data['body'])
+        elif data['header'] == 'PONG' and self.ping_sent is not None:
+            self.rtt = time.perf_counter() - self.ping_sent
+            self.ping_sent = None
+            if self.joining:
+                self.acceptor.find_game(self)
+
+    def close(self):
+        self.acceptor.remove_client(self)
+        super().close()
+
+
+class Worker:
+    "The acceptor's handle on a worker process"
+    def __init__(self, index):
+        self.index = index
+        # SEQPACKET keeps every control message (and its fds) separate
+        self.control, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # Spawned, not forked, so workers don't inherit the other workers' control sockets
+        self.process = SPAWN.Process(target=run_worker, args=(index, child), daemon=True)
+        self.process.start()
+        child.close()
+        self.load = {'games': 0, 'clients': 0, 'tick_ms': 0.0, 'busy': 0.0}
+        # Games sent since the last load report, so a burst doesn't all go to one worker
+        self.assigned = 0
+
+    def score(self):
+        return self.load['busy'], self.load['games'] + self.assigned
+
+    def read_load(self):
+        message = self.control.recv(MAX_CONTROL_MESSAGE)
+        if not message:
+            raise RuntimeError(f"Worker {self.index} exited")
+        self.load = json.loads(message)
+        self.assigned = 0
+
+    def send_game(self, players):
+        states, socks = [], []
+        for player in players:
+            sock, unread, unsent = player.detach()
+            states.append({
+                'address': list(player.address[:2]), 'codec': player.codec.codec_id, 'version': player.version,
+                'rating': player.rating, 'rtt': player.rtt,
+                'unread': unread.hex(), 'unsent': unsent.hex()
+            })
+            socks.append(sock)
+        socket.send_fds(self.control, [json.dumps({'players': states}).encode()], [s.fileno() for s in socks])
+        # The worker has its own copies of the fds now
+        for sock in socks:
+            sock.close()
+        self.assigned += 1
+
+
+class Acceptor:
+    "Accepts connections and does the matchmaking, games are played in the workers"
+    def __init__(self, host, port, workers):
+        self.host = host
+        self.port = port
+        # Started first so they don't inherit the listening socket
+        self.workers = [Worker(i) for i in range(workers)]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.selector = selectors.DefaultSelector()
+
+        self.clients = set()
+        self.matchmaker = Matchmaker()
+        # Pairs found while parsing messages, handed over once the parsing is done
+        self.matched = []
+        self.last_summary = time.perf_counter()
+
+    def find_game(self, client):
+        client.joining = False
+        pair = self.matchmaker.enqueue(client, client.rating, client.rtt)
+        if pair:
+            self.matched.append(pair)
+
+    def remove_client(self, client):
+        self.clients.discard(client)
+        self.matchmaker.cancel(client)
+
+    def matchmaking(self):
+        "Pair the players that waited in neighbouring buckets, and send away those nobody was found for"
+        pairs, expired = self.matchmaker.update()
+        self.matched.extend(pairs)
+        for client in expired:
+            if client.version >= 4:
+                client.send('MATCH_TIMEOUT')
+            else:
+                client.close()
+
+    def accept(self):
+        sock, address = self.sock.accept()
+        self.clients.add(LobbyPlayer(self, self.selector, sock, address))
+
+    def dispatch(self):
+        "Send every matched pair to the least loaded worker"
+        matched, self.matched = self.matched, []
+        for pair in matched:
+            if any(player.sock is None for player in pair):
+                # One of them left in the meantime, the other one waits again
+                for player in pair:
+                    if player.sock is not None:
+                        self.find_game(player)
+                continue
+            for player in pair:
+                self.clients.discard(player)
+            worker = min(self.workers, key=Worker.score)
+            worker.send_game(pair)
+
+    def summary(self):
+        for worker in self.workers:
+            load = worker.load
+            print(f"Worker {worker.index} (pid {worker.process.pid}): {load['games']} games, "
+                  f"{load['clients']} clients, tick {load['tick_ms']:.2f}ms, {load['busy']:.0%} busy")
+        print(f"Acceptor: {len(self.clients)} connections, {len(self.matchmaker)} waiting")
+
+    def listen(self):
+        print(f"Listening to port {self.port} with {len(self.workers)} workers")
+        self.sock.listen(1024)
+        self.sock.setblocking(False)
+        self.selector.register(self.sock, selectors.EVENT_READ, data=None)
+        for worker in self.workers:
+            self.selector.register(worker.control, selectors.EVENT_READ, data=worker)
+
+        try:
+            while True:
+                for key, mask in self.selector.select(timeout=LOAD_INTERVAL):
+                    if key.data is None:
+                        self.accept()
+                    elif isinstance(key.data, Worker):
+                        key.data.read_load()
+                    else:
+                        client = key.data
+                        try:
+                            client.process_event(mask)
+                        except Exception as e:
+                            print("Client exception caught:", e)
+                            if client.sock is not None:
+                                client.close()
+                self.matchmaking()
+                self.dispatch()
+
+                now = time.perf_counter()
+                if now - self.last_summary >= SUMMARY_INTERVAL:
+                    self.summary()
+                    self.last_summary = now
+        except (KeyboardInterrupt, SystemExit):
+            print("Got keyboard interrupt, Exiting...")
+        finally:
+            [c.close() for c in list(self.clients)]
+            for worker in self.workers:
+                worker.control.close()
+            self.selector.close()
+            self.sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Air hockey server with games spread over worker processes")
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=22222)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    Acceptor(args.host, args.port, args.workers).listen()
@@ -0,0 +1,95 @@
+"""
+Delta compressed game state
+
+The server numbers every snapshot it sends a client and keeps it until the
+client acknowledges a newer one. Each snapshot only carries the fields that
+differ from the last snapshot the client acknowledged (its baseline), as
+differences of quantized positions, so they mostly fit in a byte. Snapshots
+that get lost or dropped don't matter, the next one is still relative to
+something the client has. Without a baseline every field is sent whole.
+Snapshots stop while nothing moves, once the client acknowledged the state.
+"""
+from collections import OrderedDict
+
+from constants import SNAPSHOT_QUANTUM
+from protocol import SNAPSHOT_FIELDS
+
+
+# Snapshots kept for a baseline, a client further behind gets full snapshots
+HISTORY = 32
+
+
+class SnapshotEncoder:
+    "Server side, one per connection"
+    def __init__(self, quantum=SNAPSHOT_QUANTUM):
+        self.quantum = quantum
+        self.seq = 0
+        # Unacknowledged snapshots by sequence number, the baseline is the first one
+        self.sent = OrderedDict()
+        self.base = None
+
+    def encode(self, positions, time=0, last_input=0):
+        "SNAPSHOT body for the positions, None when the client acknowledged these already"
+        state = {name: (round(positions[name][0] / self.quantum), round(positions[name][1] / self.quantum))
+                 for name in SNAPSHOT_FIELDS}
+        acked = self.sent.get(self.base) if self.base is not None else None
+        # Sent again until acknowledged, the last one may have been lost or dropped
+        if acked == (state, last_input):
+            return None
+
+        baseline = acked[0] if acked else None
+        self.seq = (self.seq + 1) & 0xFFFF
+        body = {'seq': self.seq, 'time': time, 'input': last_input, 'base': self.base if acked else None}
+        for name, (x, y) in state.items():
+            if baseline is None:
+                body[name] = x, y
+            elif baseline[name] != (x, y):
+                body[name] = x - baseline[name][0], y - baseline[name][1]
+
+        self.sent[self.seq] = state, last_input
+        if len(self.sent) > HISTORY:
+            seq, _ = self.sent.popitem(last=False)
+            if seq == self.base:
+                self.base = None
+        return body
+
+    def ack(self, seq):
+        "The client has snapshot seq, it becomes the baseline and older ones are forgotten"
+        if seq not in self.sent:
+            # Already forgotten or never sent
+            return
+        while next(iter(self.sent)) != seq:
+            self.sent.popitem(last=False)
+        self.base = seq
+
+
+class SnapshotDecoder:
+    "Client side, rebuilds whole positions from the deltas"
+    def __init__(self, quantum=SNAPSHOT_QUANTUM):
+        self.quantum = quantum
+        self.received = OrderedDict()
+
+    def decode(self, body):
+        "Positions of a SNAPSHOT, None if its baseline is gone (don't acknowledge it then)"
+        base = body['base']
+        if base is None:
+            baseline = {name: (0, 0) for name in SNAPSHOT_FIELDS}
+        else:
+            baseline = self.received.get(base)
+            if baseline is None:
+                return None
+            # The server never goes back to a baseline older than this one
+            while next(iter(self.received)) != base:
+                self.received.popitem(last=False)
+
+        state = {}
+        for name in SNAPSHOT_FIELDS:
+            x, y = baseline[name]
+            if name in body:
+                x, y = x + body[name][0], y + body[name][1]
+            state[name] = x, y
+
+        self.received[body['seq']] = state
+        if len(self.received) > HISTORY:
+            self.received.popitem(last=False)
+        return {name: (x * self.quantum, y * self.quantum) for name, (x, y) in state.items()}
@@ -1,70 +1,200 @@
-import json
 import selectors
-import struct
+from collections import deque
 
+import protocol
 
-class SocketClient:
+
+# Initial size of the receive buffer, it doubles when a message doesn't fit
+RECV_BUFFER_SIZE = 1 << 16
+# Most bytes asked from the socket at once
+RECV_CHUNK = 1 << 14
+# Buffers handed to a single sendmsg() call (IOV_MAX is 1024 on Linux)
+MAX_IOV = 64
+
+
+class Connection:
+    "Codec negotiation and message framing, shared by the selectors and asyncio transports"
+    def __init__(self, address, codec=None):
+        self.address = address
+        # None until the peer's HELLO picks one (accepting side)
+        self.codec = codec
+        self.version = protocol.PROTOCOL_VERSION
+        # HELLO is binary whatever the codec, so it is looked for until it arrives
+        self.awaiting_hello = codec is None
+        # udp.Channel for the realtime messages, once the peer was offered one
+        self.udp = None
+
+    def parse_messages(self, data, offset=0):
+        "Handles every complete message in data from offset on, returns the offset of the first incomplete one"
+        while offset < len(data):
+            if self.awaiting_hello and protocol.is_hello(data, offset):
+                codec = protocol.BINARY
+            elif self.codec is None:
+                # Old clients send JSON right away
+                codec = self.codec = protocol.JSON
+                self.awaiting_hello = False
+            else:
+                codec = self.codec
+
+            parsed = codec.parse(data, offset)
+            if parsed is None:
+                break
+            header, body, offset = parsed
+
+            if header == 'HELLO':
+                self.handle_hello(body)
+            else:
+                self.handle_request({"header": header, "body": body})
+        return offset
+
+    def hello(self):
+        "Start the connection, sends our version and codec to the accepting side"
+        self.awaiting_hello = True
+        self._queue(protocol.hello(self.codec))
+
+    def handle_hello(self, body):
+        "Agree on the protocol version and codec of the connection"
+        if body['version'] < protocol.MIN_VERSION:
+            raise RuntimeError(f"Socket {self.address} uses unsupported protocol version {body['version']}")
+        self.awaiting_hello = False
+        self.version = min(body['version'], protocol.PROTOCOL_VERSION)
+        codec = protocol.CODECS.get(body['codec'], protocol.BINARY)
+        if self.codec is None:
+            # Accepting side, answer with what both of us will use
+            self.codec = codec
+            self._queue(protocol.hello(codec, self.version))
+        else:
+            self.codec = codec
+
+    def send(self, header, body={}):
+        "Packs the message and writes it to buffer, or to the UDP channel"
+        data = (self.codec or protocol.BINARY).encode(header, body)
+        if self.udp is not None and header in protocol.UDP_MESSAGES:
+            if self.udp.active:
+                self.udp.queue(data, header in protocol.RELIABLE_MESSAGES)
+                return
+            # Whatever got stuck on UDP goes first
+            self.fall_back_to_tcp()
+        self._queue(data)
+
+    def fall_back_to_tcp(self):
+        "Send the reliable messages of a UDP channel whose peer went quiet over TCP"
+        if self.udp is not None:
+            for data in self.udp.fall_back():
+                self._queue(data)
+
+    def _queue(self, data):
+        "Hands encoded bytes to the transport"
+        raise NotImplementedError
+
+    def handle_request(self, data):
+        "This method will be called anytime a message is recieved from the socket"
+        raise NotImplementedError
+
+
+class SocketClient(Connection):
     "Supposed to handle sending and recieving data for both client and server"
-    def __init__(self, selector, sock, address):
+    def __init__(self, selector, sock, address, codec=None):
+        super().__init__(address, codec)
         self.selector = selector
         self.sock = sock
-        self.address = address
 
-        self._recv_buffer = b""
-        self._write_buffer = b""
-        self._recv_header = None
+        # Unread data lives in _recv_buffer[_recv_start:_recv_end], messages are parsed in place
+        self._recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._recv_start = self._recv_end = 0
+        # Encoded messages waiting to be sent, the first one may be partly sent already
+        self._write_queue = deque()
+        self.write_pending = 0
 
         self.sock.setblocking(False)
-        self.selector.register(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+        # Write interest is only added while there is something to send, or select() would never sleep
+        self.selector.register(self.sock, selectors.EVENT_READ, self)
+
+    def _reserve(self, size):
+        "Make room for size more bytes after _recv_end, moving or growing the buffer only when needed"
+        if len(self._recv_buffer) - self._recv_end >= size:
+            return
+        unread = self._recv_end - self._recv_start
+        if len(self._recv_buffer) - unread >= size:
+            # Move the unread tail (usually part of one message) to the front, the regions may overlap
+            self._recv_buffer[:unread] = bytes(self._recv_view[self._recv_start:self._recv_end])
+        else:
+            buffer = bytearray(max(2 * len(self._recv_buffer), unread + size))
+            buffer[:unread] = self._recv_view[self._recv_start:self._recv_end]
+            self._recv_view.release()
+            self._recv_buffer, self._recv_view = buffer, memoryview(buffer)
+        self._recv_start, self._recv_end = 0, unread
 
     def _recv(self):
-        "Directly recieves data from socket if available"
+        "Directly recieves data from socket into the buffer if available"
+        self._reserve(RECV_CHUNK)
         try:
-            data = self.sock.recv(2048)
+            received = self.sock.recv_into(self._recv_view[self._recv_end:], RECV_CHUNK)
         except BlockingIOError:
             pass
         else:
-            if data:
-                self._recv_buffer += data
+            if received:
+                self._recv_end += received
             else:
                 raise RuntimeError(f"Socket {self.address} got closed while recieving data")
-        
-    def _read_buffer(self, length):
-        "Helper function to read a specified amount of data from the recv buffer"
-        read = self._recv_buffer[:length]
-        self._recv_buffer = self._recv_buffer[length:]
-        return read
 
     def read(self):
         "Main read function, unpacks data and sends message to handle_request() method"
         self._recv()
-        request_complete = True
-        while self._recv_buffer and request_complete:
-            request_complete = False
-            if self._recv_header is None:
-                if len(self._recv_buffer) >= 4:
-                    self._recv_header = struct.unpack('!I', self._read_buffer(4))[0]
-            
-            if self._recv_header is not None:
-                if len(self._recv_buffer) >= self._recv_header:
-                    message = self._read_buffer(self._recv_header)
-                    data = json.loads(message.decode())
-                    self._recv_header = None
-                    request_complete = True
-                    self.handle_request(data)
+        self._parse()
+
+    def _parse(self):
+        # The codecs parse straight from the buffer, nothing is copied per message
+        with self._recv_view[self._recv_start:self._recv_end] as data:
+            self._recv_start += self.parse_messages(data)
+
+        if self._recv_start == self._recv_end:
+            self._recv_start = self._recv_end = 0
+
+    def feed(self, data):
+        "Handle bytes that were received for this connection somewhere else"
+        self._reserve(len(data))
+        self._recv_buffer[self._recv_end:self._recv_end + len(data)] = data
+        self._recv_end += len(data)
+        self._parse()
 
     def write(self):
         """
-        Main write function, sends everything in _write_buffer to socket.
-        Use send() method to fill the _write_buffer
+        Main write function, sends everything in _write_queue to socket.
+        Use send() method to fill the _write_queue
         """
-        if self._write_buffer:
-            try:
-                sent = self.sock.send(self._write_buffer)
-            except BlockingIOError:
-                pass
+        if not self._write_queue:
+            return
+        try:
+            if hasattr(self.sock, 'sendmsg'):
+                # Scatter-gather, queued messages go out in one call without being joined
+                count = min(len(self._write_queue), MAX_IOV)
+                sent = self.sock.sendmsg([self._write_queue[i] for i in range(count)])
             else:
-                self._write_buffer = self._write_buffer[sent:]
+                # Windows has no sendmsg
+                sent = self.sock.send(self._write_queue[0])
+        except BlockingIOError:
+            return
+
+        self.write_pending -= sent
+        while sent:
+            chunk = self._write_queue[0]
+            if sent < len(chunk):
+                # Keep the unsent part without copying it
+                self._write_queue[0] = memoryview(chunk)[sent:]
+                break
+            sent -= len(chunk)
+            self._write_queue.popleft()
+
+        if not self._write_queue:
+            self.selector.modify(self.sock, selectors.EVENT_READ, self)
+
+    def _queue(self, data):
+        if not self._write_queue and self.sock is not None:
+            self.selector.modify(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+        self._write_queue.append(data)
+        self.write_pending += len(data)
 
     def process_event(self, mask):
         "Checks whether socket is available for reading/writing and calls read() and write() accordingly"
@@ -73,18 +203,18 @@ class SocketClient:
         if mask & selectors.EVENT_WRITE:
             self.write()
 
-    def send(self, header, body={}):
-        "Packs the message and writes it to buffer"
-        message = json.dumps({"header": header, "body": body}).encode()
-        length = struct.pack('!I', len(message))
-        self._write_buffer += length + message
+    def detach(self):
+        "Unregisters the socket without closing it, returns (sock, unread bytes, unsent bytes)"
+        self.selector.unregister(self.sock)
+        sock, self.sock = self.sock, None
+        unread = bytes(self._recv_view[self._recv_start:self._recv_end])
+        unsent = b"".join(self._write_queue)
+        self._write_queue.clear()
+        self.write_pending = 0
+        return sock, unread, unsent
 
     def close(self):
         "Unregisters selectors and closes the socket"
         self.selector.unregister(self.sock)
         self.sock.close()
         self.sock = None
-    
-    def handle_request(self, data):
-        "This method will be called anytime a message is recieved from the socket"
-        raise NotImplementedError
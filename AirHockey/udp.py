@@ -0,0 +1,395 @@
+"""
+UDP channel for the realtime messages of online games
+
+TCP stays for HELLO and matchmaking. Once a version 3 client has said hello
+the server sends it a UDP_TOKEN, and both sides move the messages in
+protocol.UDP_MESSAGES to UDP as soon as they have heard from the other side
+over it, so a lost packet no longer holds up every message behind it.
+
+Every datagram starts with the token, its sequence number and the newest
+sequence number received from the peer plus a bitfield of the 32 before it.
+Snapshots and inputs are unreliable: a datagram older than the newest one
+received is dropped whole (snapshot deltas are relative to acknowledged
+ones, so that is fine). GOAL, GAME_OVER and PLAYER_POS are reliable: they
+carry an id, are sent again until a datagram holding them is acknowledged,
+and are handed over once each and in order. When the peer goes quiet for
+PEER_TIMEOUT the reliable messages still waiting go over TCP instead.
+
+Shim loses, delays and reorders outgoing datagrams to try all this on
+localhost, running this file does that for a pair of channels:
+    python udp.py --loss 0.2 --latency 0.05 --jitter 0.03
+"""
+import argparse
+import heapq
+import random
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+import protocol
+
+
+# Token, sequence number, newest sequence number received, bits of the 32 before it, reliable messages
+HEADER = struct.Struct('!IHHIB')
+# Id and length of a reliable message
+RELIABLE = struct.Struct('!HH')
+# Bytes in a datagram, safely under the usual 1500 byte MTU
+MAX_PACKET = 1200
+# Seconds before a reliable message that wasn't acknowledged is sent again
+RESEND_TIMEOUT = 0.1
+# Seconds between datagrams when there is nothing to send, they carry the acks and keep NAT open
+KEEPALIVE = 0.25
+# Seconds without a datagram from the peer before going back to TCP
+PEER_TIMEOUT = 5
+
+
+def newer(a, b):
+    "Is sequence number a after b (they wrap at 16 bits)"
+    return a != b and (a - b) & 0xFFFF < 0x8000
+
+
+class Channel:
+    "Sequencing, acks and resends for one peer, the sockets are left to the caller"
+    def __init__(self, token):
+        self.token = token
+        self.seq = 0
+        # Newest sequence number received and bits for the 32 before it
+        self.remote_seq = None
+        self.received_bits = 0
+        self.last_received = self.last_sent = None
+
+        self.unreliable = []
+        # Reliable messages not acknowledged yet: id -> [data, time last sent]
+        self.outgoing = OrderedDict()
+        self.next_id = 0
+        # Reliable ids in each datagram sent, until it is acknowledged or too old to be
+        self.in_packet = OrderedDict()
+        self.expected = 0
+        self.early = {}
+        self.ack_pending = False
+        self.stats = {'sent': 0, 'received': 0, 'stale': 0, 'duplicates': 0, 'resent': 0}
+
+    @property
+    def active(self):
+        "Has the peer been heard from over UDP lately"
+        return self.last_received is not None and time.perf_counter() - self.last_received < PEER_TIMEOUT
+
+    def queue(self, data, reliable=False):
+        "Add an encoded message to the next datagram"
+        if reliable:
+            self.outgoing[self.next_id] = [data, None]
+            self.next_id = (self.next_id + 1) & 0xFFFF
+        else:
+            self.unreliable.append(data)
+
+    def fall_back(self):
+        "Reliable messages the quiet peer never acknowledged, for the caller to send over TCP"
+        if self.active:
+            return []
+        # Their ids stay as empty messages, so a peer heard from again still gets every id in order
+        pending = [message[0] for message in self.outgoing.values() if message[0]]
+        for message in self.outgoing.values():
+            message[0] = b''
+        return pending
+
+    def packets(self, now):
+        "Datagrams to send now, empty when there is nothing to say"
+        due = [(i, m) for i, m in self.outgoing.items() if m[1] is None or now - m[1] >= RESEND_TIMEOUT]
+        keepalive = self.last_sent is None or now - self.last_sent >= KEEPALIVE
+        if not (due or self.unreliable or self.ack_pending or keepalive):
+            return []
+
+        packets = []
+        while not packets or due or self.unreliable:
+            packets.append(self._packet(due, now))
+        self.last_sent = now
+        self.ack_pending = False
+        return packets
+
+    def _packet(self, due, now):
+        # The first one is 1, an ack of 0 means nothing received yet
+        self.seq = (self.seq + 1) & 0xFFFF
+        parts, size, ids = [], HEADER.size, []
+        while due and len(ids) < 255 and size + RELIABLE.size + len(due[0][1][0]) <= MAX_PACKET:
+            i, message = due.pop(0)
+            if message[1] is not None:
+                self.stats['resent'] += 1
+            message[1] = now
+            parts.append(RELIABLE.pack(i, len(message[0])) + message[0])
+            size += RELIABLE.size + len(message[0])
+            ids.append(i)
+        while self.unreliable and size + len(self.unreliable[0]) <= MAX_PACKET:
+            data = self.unreliable.pop(0)
+            parts.append(data)
+            size += len(data)
+        if not parts and (due or self.unreliable):
+            # Too big for any datagram
+            (due or self.unreliable).pop(0)
+
+        self.in_packet[self.seq] = ids
+        # Only the last 33 datagrams can be acknowledged, older ones are resent by timeout
+        while len(self.in_packet) > 33:
+            self.in_packet.popitem(last=False)
+        self.stats['sent'] += 1
+        header = HEADER.pack(self.token, self.seq, self.remote_seq or 0, self.received_bits, len(ids))
+        return header + b"".join(parts)
+
+    def receive(self, datagram, now):
+        "Messages (encoded) of a datagram to hand over, reliable ones first"
+        if len(datagram) < HEADER.size:
+            raise protocol.ProtocolError("Datagram too short")
+        _, seq, ack, ack_bits, count = HEADER.unpack_from(datagram)
+        self.last_received = now
+        self.acknowledged(ack, ack_bits)
+
+        newest = self.remote_seq is None or newer(seq, self.remote_seq)
+        if newest:
+            if self.remote_seq is not None:
+                shift = (seq - self.remote_seq) & 0xFFFF
+                self.received_bits = ((self.received_bits << shift) | (1 << (shift - 1))) & 0xFFFFFFFF if shift <= 32 else 0
+            self.remote_seq = seq
+        else:
+            back = (self.remote_seq - seq) & 0xFFFF
+            if back == 0 or (back <= 32 and self.received_bits & (1 << (back - 1))):
+                self.stats['duplicates'] += 1
+                return []
+            if back <= 32:
+                self.received_bits |= 1 << (back - 1)
+        self.stats['received'] += 1
+
+        messages, offset = [], HEADER.size
+        for _ in range(count):
+            i, length = RELIABLE.unpack_from(datagram, offset)
+            data = bytes(datagram[offset + RELIABLE.size:offset + RELIABLE.size + length])
+            offset += RELIABLE.size + length
+            if i == self.expected:
+                messages.append(data)
+                self.expected = (self.expected + 1) & 0xFFFF
+                while self.expected in self.early:
+                    messages.append(self.early.pop(self.expected))
+                    self.expected = (self.expected + 1) & 0xFFFF
+            elif newer(i, self.expected):
+                self.early[i] = data
+        if count:
+            self.ack_pending = True
+
+        if offset < len(datagram):
+            if newest:
+                messages.append(bytes(datagram[offset:]))
+            else:
+                # A newer datagram already got here, its state replaces this one
+                self.stats['stale'] += 1
+        # Empty reliable messages were sent over TCP already
+        return [message for message in messages if message]
+
+    def acknowledged(self, ack, ack_bits):
+        "The peer got datagram ack and the ones set in ack_bits, their reliable messages are done"
+        if not ack:
+            return
+        for back in range(33):
+            if back and not ack_bits & (1 << (back - 1)):
+                continue
+            for i in self.in_packet.pop((ack - back) & 0xFFFF, ()):
+                self.outgoing.pop(i, None)
+
+
+class Shim:
+    "Loses, delays and reorders datagrams before handing them to send(data, address)"
+    def __init__(self, send, loss=0.0, latency=0.0, jitter=0.0, seed=None):
+        self.send = send
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.delayed = []
+        self.count = self.lost = 0
+
+    def sendto(self, data, address, now=None):
+        self.count += 1
+        if self.random.random() < self.loss:
+            self.lost += 1
+            return
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay <= 0:
+            self.send(data, address)
+            return
+        now = time.perf_counter() if now is None else now
+        heapq.heappush(self.delayed, (now + delay, self.count, data, address))
+
+    def flush(self, now=None):
+        "Send the datagrams that are due"
+        now = time.perf_counter() if now is None else now
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, data, address = heapq.heappop(self.delayed)
+            self.send(data, address)
+
+    def timeout(self, now=None):
+        "Seconds until the next datagram is due, None if none is waiting"
+        if not self.delayed:
+            return None
+        now = time.perf_counter() if now is None else now
+        return max(0.0, self.delayed[0][0] - now)
+
+
+class Endpoint:
+    "A non-blocking UDP socket, optionally behind a Shim"
+    def __init__(self, sock, loss=0.0, latency=0.0, jitter=0.0):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.shim = Shim(self._send, loss, latency, jitter) if loss or latency or jitter else None
+
+    def _send(self, data, address):
+        try:
+            if address is None:
+                self.sock.send(data)
+            else:
+                self.sock.sendto(data, address)
+        except (BlockingIOError, ConnectionRefusedError):
+            # UDP, the peer will do without it
+            pass
+
+    def sendto(self, data, address=None):
+        if self.shim:
+            self.shim.sendto(data, address)
+        else:
+            self._send(data, address)
+
+    def datagrams(self):
+        "Everything waiting in the socket, as (data, address)"
+        while True:
+            try:
+                yield self.sock.recvfrom(MAX_PACKET)
+            except (BlockingIOError, ConnectionRefusedError):
+                return
+
+    def timeout(self):
+        return self.shim.timeout() if self.shim else None
+
+    def close(self):
+        self.sock.close()
+        self.sock = None
+
+
+class UdpServer(Endpoint):
+    "The server's UDP socket, shared by every player that got a token"
+    def __init__(self, host, port, loss=0.0, latency=0.0, jitter=0.0):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        super().__init__(sock, loss, latency, jitter)
+        self.port = sock.getsockname()[1]
+        self.players = {}
+
+    def register(self, player):
+        "Give the player a channel, returns its token"
+        token = random.getrandbits(32)
+        while token in self.players:
+            token = random.getrandbits(32)
+        self.players[token] = player
+        player.udp = Channel(token)
+        player.udp_address = None
+        return token
+
+    def unregister(self, player):
+        if player.udp is not None:
+            self.players.pop(player.udp.token, None)
+
+    def process_event(self, mask):
+        now = time.perf_counter()
+        for data, address in self.datagrams():
+            if len(data) < HEADER.size:
+                continue
+            player = self.players.get(HEADER.unpack_from(data)[0])
+            if player is None:
+                continue
+            # Follows the client if its address changes (NAT rebinding)
+            player.udp_address = address
+            try:
+                for message in player.udp.receive(data, now):
+                    player.parse_messages(memoryview(message))
+            except Exception as e:
+                print("UDP exception caught:", e)
+
+    def flush(self):
+        now = time.perf_counter()
+        for player in self.players.values():
+            if player.udp_address is not None:
+                player.fall_back_to_tcp()
+                for packet in player.udp.packets(now):
+                    self.sendto(packet, player.udp_address)
+        if self.shim:
+            self.shim.flush(now)
+
+
+class UdpClient(Endpoint):
+    "Client end of the channel, a UDP socket connected to the server"
+    def __init__(self, connection, address, token, loss=0.0, latency=0.0, jitter=0.0):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(address)
+        super().__init__(sock, loss, latency, jitter)
+        self.connection = connection
+        self.channel = Channel(token)
+
+    def process_event(self, mask):
+        now = time.perf_counter()
+        for data, _ in self.datagrams():
+            for message in self.channel.receive(data, now):
+                self.connection.parse_messages(memoryview(message))
+
+    def flush(self):
+        "Send what is queued, or a keepalive, the server learns our address from the first one"
+        now = time.perf_counter()
+        self.connection.fall_back_to_tcp()
+        for packet in self.channel.packets(now):
+            self.sendto(packet)
+        if self.shim:
+            self.shim.flush(now)
+
+
+def simulate(seconds, loss, latency, jitter, rate=60):
+    "A server and client channel through Shims, checks what arrives and prints the stats"
+    step, now = 1 / rate, 0.0
+    server, client = Channel(1), Channel(1)
+    inbox = {'server': [], 'client': []}
+    shims = {
+        'server': Shim(lambda data, _: inbox['client'].append(data), loss, latency, jitter, seed=1),
+        'client': Shim(lambda data, _: inbox['server'].append(data), loss, latency, jitter, seed=2),
+    }
+    snapshots, reliable, control = [], [], 0
+    for tick in range(int(seconds * rate)):
+        now = tick * step
+        server.queue(b'S' + tick.to_bytes(4, 'big'))
+        if tick % 30 == 0:
+            server.queue(b'G' + control.to_bytes(4, 'big'), reliable=True)
+            control += 1
+        client.queue(b'I' + tick.to_bytes(4, 'big'))
+
+        for name, channel in (('server', server), ('client', client)):
+            for packet in channel.packets(now):
+                shims[name].sendto(packet, None, now)
+            shims[name].flush(now)
+        for data in inbox['client']:
+            for message in client.receive(data, now):
+                (reliable if message[:1] == b'G' else snapshots).append(int.from_bytes(message[1:], 'big'))
+        for data in inbox['server']:
+            server.receive(data, now)
+        inbox['client'].clear()
+        inbox['server'].clear()
+
+    assert reliable == list(range(len(reliable))), "reliable messages out of order"
+    assert snapshots == sorted(snapshots), "stale snapshot delivered"
+    print(f"{seconds}s at {rate} ticks/s, {loss:.0%} loss, {latency * 1000:.0f}±{jitter * 1000:.0f}ms each way")
+    print(f"Snapshots delivered {len(snapshots)}/{int(seconds * rate)}, stale dropped {client.stats['stale']}")
+    print(f"Reliable delivered {len(reliable)}/{control} in order, "
+          f"{len(server.outgoing)} in flight, {server.stats['resent']} resends")
+    print(f"Server datagrams {server.stats['sent']}, client datagrams {client.stats['sent']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a UDP channel pair over a lossy link")
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--loss', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds each way")
+    parser.add_argument('--jitter', type=float, default=0.02, help="seconds, up and down")
+    args = parser.parse_args()
+    simulate(args.seconds, args.loss, args.latency, args.jitter)
@@ -0,0 +1,150 @@
+"""
+Parallel PGN database analysis
+
+Splits a PGN file into byte ranges and replays every range in its own
+process through the rules core, so throughput grows with the number of
+cores. Workers open the file themselves and only send back one row of
+statistics per game, which the main process writes to a CSV file in file
+order.
+
+A game belongs to the range its [Event ...] tag starts in (the seven tag
+roster puts Event first), so ranges can be cut anywhere in the file.
+
+Usage:
+    python analyze.py games.pgn stats.csv
+    python analyze.py games.pgn stats.csv --processes 8 --chunk 16
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+from bitboard import CASTLE, EN_PASSANT, move_flag, promotion_piece
+from pgn import PGNError, read_games, parse_san
+import board as rules
+
+
+GAME_START = b'[Event '
+# Default size of every range in MB, several ranges per core balance uneven games
+CHUNK_MB = 8
+
+COLUMNS = (
+    'game', 'white', 'black', 'result', 'plies', 'checks', 'captures',
+    'castles', 'en_passant', 'promotions', 'ending', 'fifty_moves', 'error'
+)
+
+
+def shards(path, chunk):
+    "(start, end) byte ranges covering the file"
+    size = os.path.getsize(path)
+    return [(start, min(start + chunk, size)) for start in range(0, size, chunk)] or [(0, 0)]
+
+
+def shard_lines(path, start, end):
+    "Yields the lines of every game whose [Event tag starts in [start, end)"
+    with open(path, 'rb') as f:
+        if start:
+            # Skip the rest of the line we landed in, then up to the first game
+            f.seek(start - 1)
+            f.readline()
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line or line.startswith(GAME_START):
+                    break
+            if not line or offset >= end:
+                return
+        else:
+            line = f.readline()
+
+        while line:
+            yield line.decode('utf-8', 'replace')
+            offset = f.tell()
+            line = f.readline()
+            # The next game belongs to the next range
+            if offset >= end and line.startswith(GAME_START):
+                break
+
+
+def game_stats(game):
+    "Replays a PGNGame and returns its row of COLUMNS (without the game number)"
+    board = None
+    plies = checks = captures = castles = en_passant = promotions = 0
+    error = ''
+    try:
+        board = rules.Board.from_fen(game.start_fen())
+        for text in game.moves:
+            move = parse_san(board.position, text)
+            flag = move_flag(move)
+            if board.captured_square(move) is not None:
+                captures += 1
+            if flag == CASTLE:
+                castles += 1
+            elif flag == EN_PASSANT:
+                en_passant += 1
+            elif promotion_piece(move) is not None:
+                promotions += 1
+
+            board.play(move)
+            plies += 1
+            if board.in_check():
+                checks += 1
+    except (PGNError, ValueError) as e:
+        # A bad [FEN] tag only fails this game, like in pgn.py's validator
+        error = f"Ply {plies + 1}: {e}" if board is not None else f"FEN: {e}"
+
+    ending = (board.result() or '') if board is not None else ''
+    return [
+        game.headers.get('White', '?'), game.headers.get('Black', '?'), game.result,
+        plies, checks, captures, castles, en_passant, promotions,
+        ending, int(ending == rules.FIFTY_MOVES), error
+    ]
+
+
+def analyze_shard(args):
+    "Worker: statistics of every game in one byte range"
+    path, start, end = args
+    return [game_stats(game) for game in read_games(shard_lines(path, start, end))]
+
+
+def analyze(path, output, processes=None, chunk=CHUNK_MB << 20):
+    "Writes the statistics of every game of a PGN file to a CSV file, returns the number of games"
+    processes = processes or os.cpu_count() or 1
+    jobs = [(path, start, end) for start, end in shards(path, chunk)]
+    games = plies = errors = 0
+    start = time.perf_counter()
+
+    with open(output, 'w', newline='', encoding='utf-8') as f, multiprocessing.Pool(processes) as pool:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        # imap keeps file order while the ranges are replayed in parallel
+        for rows in pool.imap(analyze_shard, jobs):
+            for row in rows:
+                games += 1
+                plies += row[3]
+                errors += bool(row[-1])
+                writer.writerow([games] + row)
+
+    elapsed = time.perf_counter() - start or 1e-9
+    print(f"{games} games ({errors} invalid), {plies} moves in {elapsed:.2f}s on {processes} processes")
+    print(f"{games / elapsed:,.1f} games/s, {plies / elapsed:,.0f} moves/s")
+    return games
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a PGN file in parallel and write per game statistics")
+    parser.add_argument('pgn', help="PGN file to analyze")
+    parser.add_argument('output', help="CSV file to write")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--chunk', type=float, default=CHUNK_MB, metavar='MB',
+                        help=f"size of the byte range given to a worker at once (default: {CHUNK_MB})")
+    args = parser.parse_args(argv)
+
+    analyze(args.pgn, args.output, args.processes, max(int(args.chunk * (1 << 20)), 1))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
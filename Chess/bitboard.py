@@ -0,0 +1,633 @@
+"""
+Bitboard chess position and legal move generator
+
+Squares are numbered the same way as Game.board: square y * 8 + x is
+board[y][x], so square 0 is a8 and square 63 is h1. Every (color, piece type)
+gets its own 64-bit integer, and moves are packed into a single int:
+    bits 0-5: from square, bits 6-11: to square, bits 12-14: flag
+"""
+import random
+
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+COLOR_NAMES = ('WHITE', 'BLACK')
+PIECE_NAMES = ('PAWN', 'KNIGHT', 'BISHOP', 'ROOK', 'QUEEN', 'KING')
+
+# Move flags, promotions are PROMOTION + (piece type - KNIGHT)
+NORMAL, DOUBLE_PUSH, EN_PASSANT, CASTLE, PROMOTION = range(5)
+
+# Castling rights
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+
+FULL = (1 << 64) - 1
+# Rows (y) in Game.board order, row 0 is black's back rank
+ROWS = [0xFF << (8 * y) for y in range(8)]
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+
+# Shared (color, piece type) records stored in Position.squares
+PIECES = tuple(tuple((color, ptype) for ptype in range(6)) for color in (WHITE, BLACK))
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FEN_PIECES = 'pnbrqk'
+FEN_CASTLING = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+
+
+def square(y, x):
+    return y * 8 + x
+
+
+def encode_move(frm, to, flag=NORMAL):
+    return frm | (to << 6) | (flag << 12)
+
+
+def move_from(move):
+    return move & 63
+
+
+def move_to(move):
+    return (move >> 6) & 63
+
+
+def move_flag(move):
+    return move >> 12
+
+
+def promotion_piece(move):
+    "Piece type a pawn promotes to, None if the move is not a promotion"
+    flag = move >> 12
+    return flag - PROMOTION + KNIGHT if flag >= PROMOTION else None
+
+
+def square_name(sq):
+    return 'abcdefgh'[sq & 7] + str(8 - (sq >> 3))
+
+
+def parse_square(name):
+    return square(8 - int(name[1]), 'abcdefgh'.index(name[0]))
+
+
+def move_uci(move):
+    "Long algebraic notation of a move (e2e4, e7e8q)"
+    promo = promotion_piece(move)
+    return square_name(move_from(move)) + square_name(move_to(move)) + ('nbrq'[promo - KNIGHT] if promo else '')
+
+
+def iter_bits(bb):
+    "Yields the square of every set bit, lowest first"
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _leaper_table(deltas):
+    "Attack table for pieces that jump a fixed set of (dx, dy) offsets"
+    table = []
+    for sq in range(64):
+        y, x = divmod(sq, 8)
+        bb = 0
+        for dx, dy in deltas:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < 8 and 0 <= ny < 8:
+                bb |= 1 << square(ny, nx)
+        table.append(bb)
+    return table
+
+
+def _line_table(dx, dy):
+    "Mask of the full line through every square, excluding the square itself"
+    table = []
+    for sq in range(64):
+        y, x = divmod(sq, 8)
+        bb = 0
+        for sign in (1, -1):
+            nx, ny = x + sign * dx, y + sign * dy
+            while 0 <= nx < 8 and 0 <= ny < 8:
+                bb |= 1 << square(ny, nx)
+                nx, ny = nx + sign * dx, ny + sign * dy
+        table.append(bb)
+    return table
+
+
+def _row_table():
+    "Sliding attacks along a single row for every column and row occupancy"
+    table = []
+    for x in range(8):
+        attacks = []
+        for occ in range(256):
+            bb = 0
+            for step in (1, -1):
+                nx = x + step
+                while 0 <= nx < 8:
+                    bb |= 1 << nx
+                    if occ >> nx & 1:
+                        break
+                    nx += step
+            attacks.append(bb)
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_table([(1, 2), (2, 1), (-1, 2), (2, -1), (-1, -2), (-2, -1), (-2, 1), (1, -2)])
+KING_ATTACKS = _leaper_table([(1, 1), (0, 1), (1, 0), (-1, -1), (0, -1), (-1, 0), (-1, 1), (1, -1)])
+# Squares attacked by a pawn of each color, white pawns move towards row 0
+PAWN_ATTACKS = (_leaper_table([(1, -1), (-1, -1)]), _leaper_table([(1, 1), (-1, 1)]))
+
+FILE_MASKS = _line_table(0, 1)
+DIAGONAL_MASKS = _line_table(1, 1)
+ANTI_DIAGONAL_MASKS = _line_table(1, -1)
+ROW_ATTACKS = _row_table()
+
+
+def _between_table():
+    "Squares strictly between two squares on a shared line, 0 if they are not aligned"
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        y, x = divmod(sq, 8)
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]:
+            bb = 0
+            nx, ny = x + dx, y + dy
+            while 0 <= nx < 8 and 0 <= ny < 8:
+                table[sq][square(ny, nx)] = bb
+                bb |= 1 << square(ny, nx)
+                nx, ny = nx + dx, ny + dy
+    return table
+
+
+BETWEEN = _between_table()
+
+# Castling: (right, king from, king to, rook from, rook to, squares that must be empty)
+CASTLES = (
+    (
+        (WHITE_KINGSIDE, 60, 62, 63, 61, (1 << 61) | (1 << 62)),
+        (WHITE_QUEENSIDE, 60, 58, 56, 59, (1 << 57) | (1 << 58) | (1 << 59)),
+    ),
+    (
+        (BLACK_KINGSIDE, 4, 6, 7, 5, (1 << 5) | (1 << 6)),
+        (BLACK_QUEENSIDE, 4, 2, 0, 3, (1 << 1) | (1 << 2) | (1 << 3)),
+    ),
+)
+# Rights that survive a move touching each square
+CASTLE_MASK = [15] * 64
+CASTLE_MASK[60] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLE_MASK[63] &= ~WHITE_KINGSIDE
+CASTLE_MASK[56] &= ~WHITE_QUEENSIDE
+CASTLE_MASK[4] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLE_MASK[7] &= ~BLACK_KINGSIDE
+CASTLE_MASK[0] &= ~BLACK_QUEENSIDE
+
+# Zobrist keys, seeded so hashes are the same in every process
+_rng = random.Random(0x5EED)
+ZOBRIST_PIECES = [[[_rng.getrandbits(64) for _ in range(64)] for _ in range(6)] for _ in range(2)]
+ZOBRIST_CASTLING = [_rng.getrandbits(64) for _ in range(16)]
+# Indexed by the column of the en passant square
+ZOBRIST_EP = [_rng.getrandbits(64) for _ in range(8)]
+ZOBRIST_TURN = _rng.getrandbits(64)
+
+
+def _flip(bb):
+    "Mirror a bitboard vertically (byte swap)"
+    return int.from_bytes(bb.to_bytes(8, 'little'), 'big')
+
+
+def _line_attacks(occ, sq, mask):
+    "Hyperbola quintessence: sliding attacks along a line with one square per row"
+    bit = 1 << sq
+    forward = occ & mask
+    reverse = _flip(forward)
+    forward -= bit << 1
+    reverse -= _flip(bit) << 1
+    forward ^= _flip(reverse & FULL)
+    return forward & mask
+
+
+def bishop_attacks(sq, occ):
+    return _line_attacks(occ, sq, DIAGONAL_MASKS[sq]) | _line_attacks(occ, sq, ANTI_DIAGONAL_MASKS[sq])
+
+
+def rook_attacks(sq, occ):
+    shift = sq & 56
+    row = ROW_ATTACKS[sq & 7][(occ >> shift) & 0xFF] << shift
+    return row | _line_attacks(occ, sq, FILE_MASKS[sq])
+
+
+class Position:
+    "Pure-data chess position with no pygame dependency"
+    def __init__(self):
+        # pieces[color][piece type] is a bitboard
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupancy = [0, 0]
+        # (color, piece type) on every square or None, for quick lookups
+        self.squares = [None] * 64
+        self.kings = [None, None]
+
+        self.turn = WHITE
+        self.castling = 0
+        self.ep_square = None
+        self.halfmove = 0
+        self.fullmove = 1
+        # Undo records: (move, captured piece type, castling, en passant square, halfmove, key, attack info)
+        self.history = []
+        # Checkers, pins and attacked squares of the current position, see attack_info()
+        self._attack_info = None
+
+        # Zobrist key, updated incrementally by put(), remove() and make_move()
+        self.key = 0
+        # Number of times every key was reached, for repetition detection
+        self.seen = {}
+
+    @classmethod
+    def initial(cls):
+        "The standard starting position"
+        return cls.from_fen(START_FEN)
+
+    @classmethod
+    def from_fen(cls, fen):
+        "Builds a position from a FEN string, raises ValueError if it is malformed"
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Invalid FEN: {fen!r}")
+
+        position = cls()
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN board: {fields[0]!r}")
+        for y, row in enumerate(rows):
+            x = 0
+            for c in row:
+                if c.isdigit():
+                    x += int(c)
+                elif c.lower() in FEN_PIECES and x < 8:
+                    position.put(BLACK if c.islower() else WHITE, FEN_PIECES.index(c.lower()), square(y, x))
+                    x += 1
+                else:
+                    raise ValueError(f"Invalid FEN row: {row!r}")
+            if x != 8:
+                raise ValueError(f"Invalid FEN row: {row!r}")
+        if None in position.kings:
+            raise ValueError("Both kings must be on the board")
+
+        if fields[1] not in ('w', 'b'):
+            raise ValueError(f"Invalid FEN side to move: {fields[1]!r}")
+        position.turn = WHITE if fields[1] == 'w' else BLACK
+        for c, right in FEN_CASTLING:
+            if c in fields[2]:
+                position.castling |= right
+        # Rights whose king or rook isn't on its square could never be used, they are dropped
+        for color in (WHITE, BLACK):
+            for right, king, _, rook, _, _ in CASTLES[color]:
+                if position.squares[king] != PIECES[color][KING] or position.squares[rook] != PIECES[color][ROOK]:
+                    position.castling &= ~right
+        if fields[3] != '-':
+            if len(fields[3]) != 2 or fields[3][0] not in 'abcdefgh' or fields[3][1] not in '12345678':
+                raise ValueError(f"Invalid FEN en passant square: {fields[3]!r}")
+            ep = parse_square(fields[3])
+            # The pawn that just moved two squares stands one square past it, on the 6th/3rd row
+            rank, pawn = (2, ep + 8) if position.turn == WHITE else (5, ep - 8)
+            moved = ep // 8 == rank and position.squares[pawn] == PIECES[position.turn ^ 1][PAWN]
+            # Same rule as make_move, only keep it if a pawn can capture
+            if (moved and position.squares[ep] is None
+                    and PAWN_ATTACKS[position.turn ^ 1][ep] & position.pieces[position.turn][PAWN]):
+                position.ep_square = ep
+        if len(fields) >= 6:
+            position.halfmove, position.fullmove = int(fields[4]), int(fields[5])
+
+        position.key ^= position.state_key()
+        position.seen[position.key] = 1
+        return position
+
+    def fen(self):
+        "FEN string of the position"
+        rows = []
+        for y in range(8):
+            row, empty = '', 0
+            for piece in self.squares[y * 8:y * 8 + 8]:
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row, empty = row + str(empty), 0
+                c = FEN_PIECES[piece[1]]
+                row += c.upper() if piece[0] == WHITE else c
+            rows.append(row + (str(empty) if empty else ''))
+
+        castling = ''.join(c for c, right in FEN_CASTLING if self.castling & right) or '-'
+        ep = square_name(self.ep_square) if self.ep_square is not None else '-'
+        return f"{'/'.join(rows)} {'wb'[self.turn]} {castling} {ep} {self.halfmove} {self.fullmove}"
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.pieces = [self.pieces[0][:], self.pieces[1][:]]
+        position.occupancy = self.occupancy[:]
+        position.squares = self.squares[:]
+        position.kings = self.kings[:]
+        position.turn = self.turn
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.halfmove = self.halfmove
+        position.fullmove = self.fullmove
+        position.history = self.history[:]
+        position._attack_info = self._attack_info
+        position.key = self.key
+        position.seen = self.seen.copy()
+        return position
+
+    def put(self, color, ptype, sq):
+        bit = 1 << sq
+        self.pieces[color][ptype] |= bit
+        self.occupancy[color] |= bit
+        self.squares[sq] = PIECES[color][ptype]
+        self.key ^= ZOBRIST_PIECES[color][ptype][sq]
+        if ptype == KING:
+            self.kings[color] = sq
+
+    def remove(self, color, ptype, sq):
+        bit = 1 << sq
+        self.pieces[color][ptype] ^= bit
+        self.occupancy[color] ^= bit
+        self.squares[sq] = None
+        self.key ^= ZOBRIST_PIECES[color][ptype][sq]
+
+    def state_key(self):
+        "Part of the Zobrist key that does not depend on piece placement"
+        key = ZOBRIST_CASTLING[self.castling]
+        if self.ep_square is not None:
+            key ^= ZOBRIST_EP[self.ep_square & 7]
+        if self.turn == BLACK:
+            key ^= ZOBRIST_TURN
+        return key
+
+    def compute_key(self):
+        "Zobrist key computed from scratch, the incremental self.key must always match it"
+        key = self.state_key()
+        for sq, piece in enumerate(self.squares):
+            if piece:
+                key ^= ZOBRIST_PIECES[piece[0]][piece[1]][sq]
+        return key
+
+    def repetitions(self):
+        "How many times the current position has been reached"
+        return self.seen.get(self.key, 0)
+
+    def piece_at(self, sq):
+        "(color, piece type) on the square, None if empty"
+        return self.squares[sq]
+
+    def attackers(self, sq, color, occ=None):
+        "Bitboard of all pieces of color attacking sq"
+        if occ is None:
+            occ = self.occupancy[WHITE] | self.occupancy[BLACK]
+        pieces = self.pieces[color]
+        attackers = (KNIGHT_ATTACKS[sq] & pieces[KNIGHT]) | (KING_ATTACKS[sq] & pieces[KING])
+        attackers |= PAWN_ATTACKS[color ^ 1][sq] & pieces[PAWN]
+
+        diagonal = pieces[BISHOP] | pieces[QUEEN]
+        if diagonal:
+            attackers |= bishop_attacks(sq, occ) & diagonal
+        straight = pieces[ROOK] | pieces[QUEEN]
+        if straight:
+            attackers |= rook_attacks(sq, occ) & straight
+        return attackers
+
+    def is_attacked(self, sq, color, occ=None):
+        "Is sq attacked by any piece of color"
+        return bool(self.attackers(sq, color, occ))
+
+    def in_check(self, color=None):
+        if color is None or color == self.turn:
+            return bool(self.attack_info()[0])
+        return self.is_attacked(self.kings[color], color ^ 1)
+
+    def attacked_squares(self, color, occ=None):
+        "Bitboard of every square attacked by color"
+        if occ is None:
+            occ = self.occupancy[WHITE] | self.occupancy[BLACK]
+        pieces = self.pieces[color]
+
+        pawns = pieces[PAWN]
+        if color == WHITE:
+            attacked = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else:
+            attacked = ((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)
+        attacked &= FULL
+
+        for sq in iter_bits(pieces[KNIGHT]):
+            attacked |= KNIGHT_ATTACKS[sq]
+        for sq in iter_bits(pieces[BISHOP] | pieces[QUEEN]):
+            attacked |= bishop_attacks(sq, occ)
+        for sq in iter_bits(pieces[ROOK] | pieces[QUEEN]):
+            attacked |= rook_attacks(sq, occ)
+        return attacked | KING_ATTACKS[self.kings[color]]
+
+    def attack_info(self):
+        """
+        Returns (checkers, check mask, pin rays, attacked) for the side to move.
+        - checkers: enemy pieces giving check
+        - check mask: squares a non-king move must land on (everything if not in check)
+        - pin rays: {square of a pinned piece: squares it can still move to}
+        - attacked: squares attacked by the enemy, as if our king was not there
+        Computed once per position, make_move() and unmake_move() keep it up to date.
+        """
+        if self._attack_info is not None:
+            return self._attack_info
+
+        us, them = self.turn, self.turn ^ 1
+        king = self.kings[us]
+        own, enemy = self.occupancy[us], self.occupancy[them]
+        occ = own | enemy
+        pieces = self.pieces[them]
+
+        checkers = self.attackers(king, them, occ)
+        if not checkers:
+            check_mask = FULL
+        elif checkers & (checkers - 1):
+            # Double check, only the king can move
+            check_mask = 0
+        else:
+            check_mask = checkers | BETWEEN[king][checkers.bit_length() - 1]
+
+        # Enemy sliders that would attack the king if it weren't for exactly one of our pieces
+        pins = {}
+        snipers = (rook_attacks(king, enemy) & (pieces[ROOK] | pieces[QUEEN]))
+        snipers |= (bishop_attacks(king, enemy) & (pieces[BISHOP] | pieces[QUEEN]))
+        for sniper in iter_bits(snipers):
+            between = BETWEEN[king][sniper] & occ
+            if between and not between & (between - 1) and between & own:
+                pins[between.bit_length() - 1] = BETWEEN[king][sniper] | (1 << sniper)
+
+        # Without our king on the board, so it can't step back along a slider's line
+        attacked = self.attacked_squares(them, occ ^ (1 << king))
+        self._attack_info = (checkers, check_mask, pins, attacked)
+        return self._attack_info
+
+    def pseudo_legal_moves(self):
+        "All moves ignoring whether our own king is left in check"
+        moves = []
+        us, them = self.turn, self.turn ^ 1
+        own, enemy = self.occupancy[us], self.occupancy[them]
+        occ = own | enemy
+        empty = ~occ & FULL
+        pieces = self.pieces[us]
+
+        # Pawn pushes are generated for all pawns at once
+        pawns = pieces[PAWN]
+        if us == WHITE:
+            step, last_row, double_row = -8, ROWS[0], ROWS[4]
+            single = (pawns >> 8) & empty
+            double = (single >> 8) & empty & double_row
+        else:
+            step, last_row, double_row = 8, ROWS[7], ROWS[3]
+            single = (pawns << 8) & empty
+            double = (single << 8) & empty & double_row
+
+        for to in iter_bits(single):
+            if (1 << to) & last_row:
+                moves.extend(encode_move(to - step, to, PROMOTION + i) for i in range(4))
+            else:
+                moves.append(encode_move(to - step, to))
+        for to in iter_bits(double):
+            moves.append(encode_move(to - 2 * step, to, DOUBLE_PUSH))
+
+        for frm in iter_bits(pawns):
+            for to in iter_bits(PAWN_ATTACKS[us][frm] & enemy):
+                if (1 << to) & last_row:
+                    moves.extend(encode_move(frm, to, PROMOTION + i) for i in range(4))
+                else:
+                    moves.append(encode_move(frm, to))
+            if self.ep_square is not None and PAWN_ATTACKS[us][frm] >> self.ep_square & 1:
+                moves.append(encode_move(frm, self.ep_square, EN_PASSANT))
+
+        targets = ~own & FULL
+        for frm in iter_bits(pieces[KNIGHT]):
+            for to in iter_bits(KNIGHT_ATTACKS[frm] & targets):
+                moves.append(encode_move(frm, to))
+        for frm in iter_bits(pieces[BISHOP]):
+            for to in iter_bits(bishop_attacks(frm, occ) & targets):
+                moves.append(encode_move(frm, to))
+        for frm in iter_bits(pieces[ROOK]):
+            for to in iter_bits(rook_attacks(frm, occ) & targets):
+                moves.append(encode_move(frm, to))
+        for frm in iter_bits(pieces[QUEEN]):
+            for to in iter_bits((bishop_attacks(frm, occ) | rook_attacks(frm, occ)) & targets):
+                moves.append(encode_move(frm, to))
+
+        king = self.kings[us]
+        for to in iter_bits(KING_ATTACKS[king] & targets):
+            moves.append(encode_move(king, to))
+
+        # 1. Both rook and king never moved (castling rights)
+        # 2. Space between rook and king must be empty
+        # 3. King must not be in check or pass through an attacked square
+        if self.castling:
+            checkers, _, _, attacked = self.attack_info()
+            for right, frm, to, _, rook_to, between in CASTLES[us]:
+                if self.castling & right and not between & occ:
+                    if not checkers and not attacked & ((1 << rook_to) | (1 << to)):
+                        moves.append(encode_move(frm, to, CASTLE))
+        return moves
+
+    def is_legal(self, move):
+        "Checks a pseudo-legal move does not leave our king attacked, a lookup in attack_info()"
+        checkers, check_mask, pins, attacked = self.attack_info()
+        frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+
+        if frm == self.kings[self.turn]:
+            # Castling was fully checked when it was generated
+            return flag == CASTLE or not attacked >> to & 1
+        if flag == EN_PASSANT:
+            return self._is_legal_en_passant(frm, to)
+        if not check_mask >> to & 1:
+            return False
+        return frm not in pins or bool(pins[frm] >> to & 1)
+
+    def _is_legal_en_passant(self, frm, to):
+        "En passant removes two pieces from a line, so play it out on the occupancy"
+        us, them = self.turn, self.turn ^ 1
+        captured = 1 << (to + 8 if us == WHITE else to - 8)
+        occ = ((self.occupancy[WHITE] | self.occupancy[BLACK]) ^ (1 << frm) ^ captured) | (1 << to)
+        return not self.attackers(self.kings[us], them, occ) & ~captured
+
+    def legal_moves(self):
+        return [m for m in self.pseudo_legal_moves() if self.is_legal(m)]
+
+    def make_move(self, move):
+        "Plays a legal move for the side to move, unmake_move() takes it back"
+        us, them = self.turn, self.turn ^ 1
+        frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+        ptype = self.squares[frm][1]
+
+        captured = self.squares[to]
+        self.history.append((
+            move, captured and captured[1], self.castling, self.ep_square, self.halfmove, self.key, self._attack_info
+        ))
+        self._attack_info = None
+        self.key ^= self.state_key()
+        if captured:
+            self.remove(them, captured[1], to)
+        elif flag == EN_PASSANT:
+            self.remove(them, PAWN, to + 8 if us == WHITE else to - 8)
+
+        self.remove(us, ptype, frm)
+        self.put(us, ptype if flag < PROMOTION else flag - PROMOTION + KNIGHT, to)
+
+        if flag == CASTLE:
+            for _, _, king_to, rook_from, rook_to, _ in CASTLES[us]:
+                if king_to == to:
+                    self.remove(us, ROOK, rook_from)
+                    self.put(us, ROOK, rook_to)
+
+        self.castling &= CASTLE_MASK[frm] & CASTLE_MASK[to]
+        # Only remember the en passant square if it can actually be captured
+        self.ep_square = None
+        if flag == DOUBLE_PUSH:
+            ep = (frm + to) // 2
+            if PAWN_ATTACKS[us][ep] & self.pieces[them][PAWN]:
+                self.ep_square = ep
+
+        if ptype == PAWN or captured or flag == EN_PASSANT:
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        if us == BLACK:
+            self.fullmove += 1
+        self.turn = them
+
+        self.key ^= self.state_key()
+        self.seen[self.key] = self.seen.get(self.key, 0) + 1
+
+    def unmake_move(self):
+        "Reverts the last move played with make_move()"
+        move, captured, castling, ep_square, halfmove, key, self._attack_info = self.history.pop()
+        them, us = self.turn, self.turn ^ 1
+
+        count = self.seen[self.key] - 1
+        if count:
+            self.seen[self.key] = count
+        else:
+            del self.seen[self.key]
+        frm, to, flag = move & 63, (move >> 6) & 63, move >> 12
+
+        ptype = self.squares[to][1]
+        self.remove(us, ptype, to)
+        self.put(us, PAWN if flag >= PROMOTION else ptype, frm)
+
+        if captured is not None:
+            self.put(them, captured, to)
+        elif flag == EN_PASSANT:
+            self.put(them, PAWN, to + 8 if us == WHITE else to - 8)
+        elif flag == CASTLE:
+            for _, _, king_to, rook_from, rook_to, _ in CASTLES[us]:
+                if king_to == to:
+                    self.remove(us, ROOK, rook_to)
+                    self.put(us, ROOK, rook_from)
+
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove = halfmove
+        if us == BLACK:
+            self.fullmove -= 1
+        self.turn = us
+        # put() and remove() changed the key as well, the saved one is simpler
+        self.key = key
@@ -0,0 +1,140 @@
+"""
+Chess rules without pygame
+
+Board wraps a bitboard Position with everything a game needs on top of move
+generation: whose turn it is, looking up moves by square, promotion, undo and
+the end of game rules (mate, stalemate, 50 move rule, repetition and
+insufficient material). It never touches pygame, so batch jobs can play
+thousands of games without a display.
+"""
+from bitboard import (
+    Position, COLOR_NAMES, PIECE_NAMES, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, WHITE,
+    EN_PASSANT, CASTLE, CASTLES, move_from, move_to, move_flag, promotion_piece
+)
+
+# Game results, returned by Board.result()
+CHECKMATE = 'CHECKMATE'
+STALEMATE = 'STALEMATE'
+FIFTY_MOVES = 'FIFTY_MOVES'
+REPETITION = 'REPETITION'
+INSUFFICIENT_MATERIAL = 'INSUFFICIENT_MATERIAL'
+
+
+class PieceRecord:
+    "A piece on the board, (color, piece) use the same names as the sprites"
+    __slots__ = ('color', 'piece', 'y', 'x')
+
+    def __init__(self, color, piece, y, x):
+        self.color = color
+        self.piece = piece
+        self.y = y
+        self.x = x
+
+    def __repr__(self):
+        return f"PieceRecord({self.color}, {self.piece}, y={self.y}, x={self.x})"
+
+
+class Board:
+    "Rules of a chess game, played out on a bitboard Position"
+    def __init__(self, position=None):
+        self.position = position if position is not None else Position.initial()
+        # Where the game started, for saving it as PGN
+        self.start_fen = self.position.fen()
+        self.start_ply = len(self.position.history)
+        # Legal moves of the current position, reset whenever it changes
+        self._legal = None
+
+    @classmethod
+    def from_fen(cls, fen):
+        return cls(Position.from_fen(fen))
+
+    def fen(self):
+        return self.position.fen()
+
+    @property
+    def turn(self):
+        return COLOR_NAMES[self.position.turn]
+
+    @property
+    def move50(self):
+        "Half moves (plies) since the last capture or pawn move"
+        return self.position.halfmove
+
+    def legal_moves(self):
+        if self._legal is None:
+            self._legal = self.position.legal_moves()
+        return self._legal
+
+    def in_check(self):
+        return self.position.in_check()
+
+    def piece_at(self, y, x):
+        piece = self.position.squares[y * 8 + x]
+        if piece is None:
+            return None
+        return PieceRecord(COLOR_NAMES[piece[0]], PIECE_NAMES[piece[1]], y, x)
+
+    def pieces(self):
+        "Every piece on the board as a PieceRecord"
+        return [
+            PieceRecord(COLOR_NAMES[piece[0]], PIECE_NAMES[piece[1]], sq >> 3, sq & 7)
+            for sq, piece in enumerate(self.position.squares) if piece
+        ]
+
+    def moves_from(self, y, x, promotion=QUEEN):
+        "Legal moves of the piece on (y, x) as {(y, x): move}, promotions only to the given piece"
+        origin = y * 8 + x
+        moves = {}
+        for move in self.legal_moves():
+            if move_from(move) == origin and promotion_piece(move) in (None, promotion):
+                moves[divmod(move_to(move), 8)] = move
+        return moves
+
+    def captured_square(self, move):
+        "(y, x) of the piece the move captures, None if it captures nothing"
+        to = move_to(move)
+        if move_flag(move) == EN_PASSANT:
+            to += 8 if self.position.turn == WHITE else -8
+        elif self.position.squares[to] is None:
+            return None
+        return divmod(to, 8)
+
+    def rook_move(self, move):
+        "((y, x), (y, x)) of the rook that moves along with a castling king, None otherwise"
+        if move_flag(move) != CASTLE:
+            return None
+        for _, _, king_to, rook_from, rook_to, _ in CASTLES[self.position.turn]:
+            if king_to == move_to(move):
+                return divmod(rook_from, 8), divmod(rook_to, 8)
+
+    def play(self, move):
+        "Plays a legal move"
+        self.position.make_move(move)
+        self._legal = None
+
+    def undo(self):
+        "Takes back the last move and returns it"
+        move = self.position.history[-1][0]
+        self.position.unmake_move()
+        self._legal = None
+        return move
+
+    def insufficient_material(self):
+        "Only kings left, or kings and a single knight or bishop"
+        white, black = self.position.pieces
+        if white[PAWN] | black[PAWN] | white[ROOK] | black[ROOK] | white[QUEEN] | black[QUEEN]:
+            return False
+        minors = white[KNIGHT] | black[KNIGHT] | white[BISHOP] | black[BISHOP]
+        return not minors & (minors - 1)
+
+    def result(self):
+        "None while the game goes on, otherwise how it ended (the side to move lost a CHECKMATE)"
+        if not self.legal_moves():
+            return CHECKMATE if self.in_check() else STALEMATE
+        if self.position.halfmove >= 100:
+            return FIFTY_MOVES
+        if self.position.repetitions() >= 3:
+            return REPETITION
+        if self.insufficient_material():
+            return INSUFFICIENT_MATERIAL
+        return None
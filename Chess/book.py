@@ -0,0 +1,171 @@
+"""
+Opening book in a memory-mapped file of sorted, fixed-size entries
+
+The layout follows Polyglot: 16 byte big-endian records of
+(key u64, move u16, weight u16, learn u32) sorted by key, so a lookup is a
+binary search over the mmap and never reads the whole file. Keys are our own
+Zobrist keys (Position.key) and moves our packed move ints, so books are not
+interchangeable with Polyglot .bin files. learn holds the number of games the
+move was played in.
+
+Usage:
+    python book.py build games.pgn book.bin --plies 20 --min-games 2
+    python book.py probe book.bin --fen "<fen>"
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+
+from bitboard import Position, START_FEN, WHITE, move_uci
+from pgn import PGNError, read_games, parse_san
+
+
+ENTRY = struct.Struct('>QHHI')
+# Points for the side that played the move, a loss still counts as played
+RESULT_POINTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}
+MAX_WEIGHT = 0xFFFF
+
+
+class Book:
+    "Read only opening book, open it with `with Book(path) as book:` or close() it"
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            self.data = b''
+        self.size = len(self.data) // ENTRY.size
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def key_at(self, index):
+        return ENTRY.unpack_from(self.data, index * ENTRY.size)[0]
+
+    def find(self, key):
+        "Index of the first entry of key (or where it would be)"
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def entries(self, position):
+        "[(move, weight, games)] of the position, best first, only legal moves"
+        key = position.key
+        entries = []
+        index = self.find(key)
+        while index < self.size:
+            entry_key, move, weight, learn = ENTRY.unpack_from(self.data, index * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight, learn))
+            index += 1
+
+        # Guard against key collisions with positions that aren't in the book
+        if entries:
+            legal = set(position.legal_moves())
+            entries = [e for e in entries if e[0] in legal]
+        entries.sort(key=lambda e: -e[1])
+        return entries
+
+    def choose(self, position, rng=random):
+        "A random book move weighted by how well it scored, None when out of book"
+        entries = [e for e in self.entries(position) if e[1]]
+        if not entries:
+            return None
+        return rng.choices([e[0] for e in entries], weights=[e[1] for e in entries])[0]
+
+
+def build(pgn_path, output, max_plies=20, min_games=1):
+    "Writes a book of the first max_plies of every game in a PGN file, returns the number of entries"
+    # (key, move) -> [points, games]
+    stats = {}
+    games = 0
+    start = time.perf_counter()
+    with open(pgn_path, encoding='utf-8', errors='replace') as f:
+        for game in read_games(f):
+            points = RESULT_POINTS.get(game.result)
+            if points is None:
+                continue
+            games += 1
+            try:
+                position = Position.from_fen(game.start_fen())
+                for text in game.moves[:max_plies]:
+                    move = parse_san(position, text)
+                    record = stats.setdefault((position.key, move), [0, 0])
+                    record[0] += points[position.turn != WHITE]
+                    record[1] += 1
+                    position.make_move(move)
+            except (PGNError, ValueError):
+                # Keep the moves before the error, they were legal
+                continue
+
+    entries = sorted(
+        (key, move, points, count) for (key, move), (points, count) in stats.items() if count >= min_games
+    )
+    # Scale weights down together so the best move still fits in 16 bits
+    top = max((e[2] for e in entries), default=0)
+    scale = MAX_WEIGHT / top if top > MAX_WEIGHT else 1
+    with open(output, 'wb') as f:
+        for key, move, points, count in entries:
+            weight = int(points * scale) if points else 0
+            f.write(ENTRY.pack(key, move, weight, min(count, 0xFFFFFFFF)))
+
+    print(f"{games} games, {len(entries)} entries in {time.perf_counter() - start:.2f}s")
+    return len(entries)
+
+
+def probe(path, fen):
+    "Prints the book moves of a position and how long the lookup took"
+    position = Position.from_fen(fen)
+    with Book(path) as book:
+        start = time.perf_counter()
+        entries = book.entries(position)
+        elapsed = time.perf_counter() - start
+        total = sum(e[1] for e in entries) or 1
+        for move, weight, games in entries:
+            print(f"{move_uci(move):6} {weight * 100 / total:5.1f}%  {games} games")
+        print(f"{len(entries)} moves, {len(book)} entries, lookup {elapsed * 1e6:.0f}us")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe a chess opening book")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help="create a book from a PGN file")
+    build_parser.add_argument('pgn')
+    build_parser.add_argument('book')
+    build_parser.add_argument('--plies', type=int, default=20, help="moves of every game to include")
+    build_parser.add_argument('--min-games', type=int, default=1, help="drop moves played in fewer games")
+    probe_parser = sub.add_parser('probe', help="list the book moves of a position")
+    probe_parser.add_argument('book')
+    probe_parser.add_argument('--fen', default=START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build(args.pgn, args.book, args.plies, args.min_games)
+    else:
+        probe(args.book, args.fen)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,24 @@
-import copy
+import contextlib
+import sys
+
 import pygame
 
+import board as rules
+from book import Book
+from engine import Engine, EngineThread
 from pieces import *
 
 # BASIC CONFIGURATIONS
 SCREENX, SCREENY = 700, 500
 FPS = 30
-
-# For storage reference
+# Color played by the computer ('WHITE' or 'BLACK'), None for human vs human
+AI_COLOR = None
+# Seconds the computer is allowed to think per move
+AI_TIME = 2
+# Opening book file made with book.py, None to always search
+AI_BOOK = None
+
+# Sprite class for every piece type of the rules core
 PIECE_TYPE = {
     "PAWN": Pawn,
     "ROOK": Rook,
@@ -18,22 +29,26 @@ PIECE_TYPE = {
 }
 
 
+# What to print when the game ends
+RESULT_MESSAGES = {
+    rules.STALEMATE: "Stalemate: It's a tie!",
+    rules.FIFTY_MOVES: "Tie: 50 moves without a capture or a pawn movement",
+    rules.REPETITION: "Tie: Same position repeated 3 times",
+    rules.INSUFFICIENT_MATERIAL: "Tie: Not enough pieces left to checkmate",
+}
+
+
 class Game:
     # 2 seperate lists for the board and their respective blocks (Block class)
     board = [[] for _ in range(8)]
     blocks = [[] for _ in range(8)]
-    # Stores all valid moves for current piece
-    moves = []
-    # Current player color
-    turn = 'WHITE'
+    # Stores all valid moves for current piece, (y, x) -> bitboard move
+    moves = {}
     # Other boolean values
     running = True
     selected = None
-    inCheck = False
-    # Number of moves without capture / pawn movement (Tie)
-    move50 = 0
 
-    def __init__(self):
+    def __init__(self, fen=None):
         pygame.init()
 
         # Basic pygame modules
@@ -41,42 +56,77 @@ class Game:
         self.screen = pygame.display.set_mode((SCREENX, SCREENY))
 
         # Sprite groups one for all pieces and one for all sprites
-        self.all_sprites = pygame.sprite.Group()
+        # Only sprites that changed are drawn again, and only their rects are sent to the display
+        self.all_sprites = pygame.sprite.LayeredDirty()
         self.piece_sprites = pygame.sprite.Group()
-
-        self.create_board()
-        self.board_history = []
-        self.run()
+        self.background = pygame.Surface((SCREENX, SCREENY))
+        self.all_sprites.clear(self.screen, self.background)
+
+        self.create_board(fen)
+
+        # The engine searches in a background thread while the board keeps rendering
+        # The opening book is closed when the game exits
+        with contextlib.ExitStack() as books:
+            self.engine = None
+            if AI_COLOR:
+                book = books.enter_context(Book(AI_BOOK)) if AI_BOOK else None
+                self.engine = Engine(time_limit=AI_TIME, book=book)
+            self.thinking = None
+            self.run()
+            if self.thinking is not None:
+                # Stop a search still running, it may be reading the book
+                self.engine.stopped = True
+                self.thinking.join()
 
         pygame.quit()
 
-    def copy_board(self, board):
-        "Returs a copy of the 2d board"
-        return [[c for c in r] for r in board]
+    # Game state lives in the rules core, the sprites only show it
+    @property
+    def turn(self):
+        "Current player color"
+        return self.rules.turn
+
+    @property
+    def move50(self):
+        "Number of half moves without capture / pawn movement (Tie at 100)"
+        return self.rules.move50
+
+    @property
+    def in_check(self):
+        return self.rules.in_check()
 
-    def create_board(self):
+    def create_board(self, fen=None):
         "Create the board UI and place chess pieces on the board"
         for i in range(8):
             for j in range(8):
                 self.blocks[i].append(Block(j, i, (i+j)%2 == 0))
 
-        pieces = [Rook, Knight, Bishop, Queen, King, Bishop, Knight, Rook]
-        self.board = [
-            [pieces[i](i, 0, 'BLACK') for i in range(8)],
-            [Pawn(i, 1, 'BLACK') for i in range(8)],
-            [None for _ in range(8)],
-            [None for _ in range(8)],
-            [None for _ in range(8)],
-            [None for _ in range(8)],
-            [Pawn(i, 6, 'WHITE') for i in range(8)],
-            [pieces[i](i, 7, 'WHITE') for i in range(8)]
-        ]
+        self.all_sprites.add(self.blocks)
 
-        self.piece_sprites.add(self.board[0:2], self.board[6:8])
-        self.all_sprites.add(self.blocks, self.piece_sprites)
-
-        # Store kings for both players, useful for checks and castling
-        self.kings = {'WHITE': self.board[7][4], 'BLACK': self.board[0][4]}
+        # Start from the initial position unless a FEN string is given
+        self.rules = rules.Board.from_fen(fen) if fen else rules.Board()
+        self.board = self.place_pieces()
+        self.board_history = []
+        king = self.kings[self.turn]
+        self.blocks[king.y][king.x].check(self.in_check)
+
+    def fen(self):
+        "FEN string of the current position"
+        return self.rules.fen()
+
+    def place_pieces(self):
+        "Create a sprite for every piece of the rules core, returns the 2d board"
+        board = [[None for _ in range(8)] for _ in range(8)]
+        # Store kings for both players, useful for checks
+        self.kings = {}
+
+        for record in self.rules.pieces():
+            p = PIECE_TYPE[record.piece](record.x, record.y, record.color)
+            board[record.y][record.x] = p
+            self.add_piece(p)
+            if record.piece == 'KING':
+                self.kings[record.color] = p
+        return board
 
     def select_piece(self):
         "Get the selected piece, unselect if already selected, get all valid moves"
@@ -89,164 +139,147 @@ class Game:
                 self.blocks[self.selected.y][self.selected.x].select()
 
             self.selected = clicked_sprites[0]
-            moves = clicked_sprites[0].moves(self.board)
-            # Check if castling is possible
-            is_king = isinstance(self.selected, King)
-            if is_king:
-                moves += self.check_castle(self.board)
-
-            self.moves = copy.deepcopy(moves)
-            # validate every move
-            for m in moves:
-                boardcpy = self.copy_board(self.board)
-                boardcpy[m[0]][m[1]] = self.selected
-                boardcpy[self.selected.y][self.selected.x] = None
-
-                if self.is_check(boardcpy, m[1], m[0], is_king=is_king):
-                    self.moves.remove(m)
-
+            # Only legal moves are returned, no need to validate them again
+            self.show_moves(self.rules.moves_from(self.selected.y, self.selected.x))
             self.blocks[self.selected.y][self.selected.x].select()
 
-    def move_piece(self, piece, y, x):
-        "Move a chess piece in the board"
-        opiece = self.board[y][x]
-
-        if isinstance(piece, Pawn) or opiece:
-            self.move50 = 0
-
-            # Kill whoever is in that place
-            if opiece:
-                opiece.kill()
-        else:
-            self.move50 += 1
-
-        # To ensure en passant rule, we must remove all previous pawn double moves
-        pawns = [p for p in self.piece_sprites if p.color == self.turn and isinstance(p, Pawn)]
-        for pawn in pawns:
-            pawn.double = False
-
-        # Store original positions for future reference
-        ox, oy = piece.x, piece.y
-        # Change coordinates of the moving piece
-        ep = piece.move(x, y, self.board)
+    def show_moves(self, moves):
+        "Set the moves of the selected piece and mark their blocks"
+        for y, x in self.moves:
+            self.blocks[y][x].set_mark(None)
+        self.moves = moves
+        for y, x in moves:
+            self.blocks[y][x].set_mark(CAPTURE if self.board[y][x] else MOVE)
+
+    def place_piece(self, piece, y, x):
+        "Move a sprite to a new square of the 2d board"
+        self.board[piece.y][piece.x] = None
         self.board[y][x] = piece
-        # Original position of piece now empty
-        self.board[oy][ox] = None
+        piece.x, piece.y = x, y
 
+    def move_piece(self, piece, y, x):
+        "Move a chess piece in the board"
+        move = self.moves[(y, x)]
+        oy, ox = piece.y, piece.x
+        rook = queen = None
+
+        # Kill whoever is in that place (or right behind it for en passant)
+        opiece = None
+        captured = self.rules.captured_square(move)
+        if captured:
+            opiece = self.board[captured[0]][captured[1]]
+            self.board[captured[0]][captured[1]] = None
+            opiece.kill()
+
+        self.place_piece(piece, y, x)
         self.blocks[oy][ox].select()
-        piece.moved = True
         self.selected = None
-        self.moves = []
+        self.show_moves({})
 
         # Castling...
-        if isinstance(piece, King) and abs(x - ox) == 2:
-            rook = self.board[piece.y][7 if (x - ox) > 0 else 0]
-            diff = 1 if rook.x == 0 else -1
-
-            self.blocks[rook.y][rook.x].select()
-            self.move_piece(rook, piece.y, x + diff)
+        rook_move = self.rules.rook_move(move)
+        if rook_move:
+            (ry, rx), (ny, nx) = rook_move
+            rook = self.board[ry][rx]
+            self.place_piece(rook, ny, nx)
 
         # Pawn Promotion...
-        if isinstance(piece, Pawn) and y in [0, 7]:
-            # Just gonna promote it to queen cuz... why not
+        promotion = rules.promotion_piece(move)
+        if promotion is not None:
+            # Players always get a queen, the engine may pick something else
             # First kill the original pawn
             piece.kill()
-            # Create the queen and add it to sprite groups and board
-            queen = Queen(x, y, self.turn)
+            # Create the new piece and add it to sprite groups and board
+            queen = PIECE_TYPE[rules.PIECE_NAMES[promotion]](x, y, self.turn)
             self.add_piece(queen)
             self.board[y][x] = queen
 
-    def serialize(self, board):
-        "Make it so the board can be easily stored"
-        boardcpy = self.copy_board(board)
-        for row in range(8):
-            for col in range(8):
-                if boardcpy[row][col]:
-                    boardcpy[row][col] = boardcpy[row][col].serialize()
-
-        return boardcpy
-
-    def deserialize(self, board):
-        "Extract data from serialized blocks"
-        for row in range(8):
-            for col in range(8):
-                if board[row][col]:
-                    pos, piece, color, moved, double = board[row][col]
+        self.rules.play(move)
+        # Enough to put the sprites back, the rules core keeps its own undo record
+        self.board_history.append((piece, (oy, ox), opiece, rook and (rook, ry, rx), queen))
 
-                    p = PIECE_TYPE[piece](pos[1], pos[0], color)
-                    p.moved = moved
-                    p.double = double
+    def undo(self):
+        "Take back the last move, sprites are put back in place instead of being recreated"
+        piece, (oy, ox), opiece, rook, queen = self.board_history.pop()
+        self.rules.undo()
 
-                    board[row][col] = p
-                    self.blocks[p.y][p.x].check(False)
-
-                    if isinstance(p, King):
-                        self.kings[color] = p
-        return board
+        if self.selected:
+            self.blocks[self.selected.y][self.selected.x].select()
+            self.selected = None
+            self.show_moves({})
+        # Clear the check highlights, set again below for the player to move
+        for king in self.kings.values():
+            self.blocks[king.y][king.x].check(False)
+
+        if queen:
+            queen.kill()
+            self.board[queen.y][queen.x] = piece
+            self.add_piece(piece)
+        self.place_piece(piece, oy, ox)
+
+        if rook:
+            self.place_piece(*rook)
+        if opiece:
+            self.board[opiece.y][opiece.x] = opiece
+            self.add_piece(opiece)
 
-    def is_check(self, board, x=None, y=None, is_king=False):
-        "Look for a check, return True if it is a checkmate"
-        # Get all enemy pieces that do not occupy x,y (place we are going to put our piece)
-        enemies = [e for e in self.piece_sprites if e.color != self.turn and e.x != x and e.y != y]
         king = self.kings[self.turn]
+        self.blocks[king.y][king.x].check(self.in_check)
 
-        for e in enemies:
-            # Loop through all enemy moves and see if the king's position lies in it
-            moves = e.moves(board)
-            if not is_king and (king.y, king.x) in moves:
-                return True
-            if is_king and (y, x) in moves:
-                return True
-        return False
+    def is_check(self):
+        "Is the current player's king under attack"
+        return self.rules.in_check()
 
     def add_piece(self, sprite):
         "Add the sprite back to sprite groups"
+        sprite.dirty = 1
         self.all_sprites.add(sprite)
         self.piece_sprites.add(sprite)
 
-    def check_castle(self, board):
-        "Check if castling is possible, return the possible moves"
-        # Get the king and valid rooks
-        king = self.kings[self.turn]
-        rooks = [r for r in self.piece_sprites if r.color == self.turn and isinstance(r, Rook) and not r.moved]
-        rook1 = [r for r in rooks if r.x == 0]
-        rook2 = [r for r in rooks if r.x == 7]
-        valid = []
-
-        # 1. Both rook and king never moved
-        # 2. King should not be in a check
-        # 3. Space between rook and king must be empty
-        if not rooks or king.moved or self.in_check:
-            return []
-        if rook1 and not (board[king.y][king.x-1] or board[king.y][king.x-2] or board[king.y][king.x-3]):
-            valid.append((king.y, king.x-2))
+    def is_mate(self):
+        "Look for a checkmate, see if player has any other possible moves"
+        return not self.rules.legal_moves()
 
-        if rook2 and not (board[king.y][king.x+1] or board[king.y][king.x+2]):
-            valid.append((king.y, king.x+2))
+    def play(self, piece, y, x):
+        "Play one of the selected piece's moves and hand the turn to the other player"
+        king = self.kings[self.turn]
+        self.blocks[king.y][king.x].check(False)
 
-        return valid
+        # Move the piece, this also swaps turns
+        self.move_piece(piece, y, x)
 
-    def is_mate(self):
-        "Look for a checkmate, see if player has any other possible moves"
-        mate = True
-        pieces = [p for p in self.piece_sprites if p.color == self.turn]
-
-        for p in pieces:
-            # Once we have found it is not a mate break
-            if not mate:
-                break
-
-            for my, mx in p.moves(self.board):
-                # Simulate all posible moves and see if any are valid
-                boardcpy = self.copy_board(self.board)
-                boardcpy[my][mx] = p
-                boardcpy[p.y][p.x] = None
-
-                if not self.is_check(boardcpy, mx, my, is_king=isinstance(p, King)):
-                    print('nope', p)
-                    mate = False
-                    break
-        return mate
+        king = self.kings[self.turn]
+        self.blocks[king.y][king.x].check(self.in_check)
+
+        result = self.rules.result()
+        if result:
+            self.running = False
+            if result == rules.CHECKMATE:
+                print("Checkmate:", self.turn, "has lost")
+            else:
+                print(RESULT_MESSAGES[result])
+
+    def engine_turn(self):
+        return self.engine is not None and self.turn == AI_COLOR
+
+    def update_engine(self):
+        "Start the engine on its turn, play its move once the search thread is done"
+        if self.thinking is None:
+            self.thinking = EngineThread(self.engine, self.rules.position)
+            self.thinking.start()
+        elif not self.thinking.is_alive():
+            move = self.thinking.move
+            self.thinking = None
+            if move is None:
+                return
+
+            fy, fx = divmod(rules.move_from(move), 8)
+            ty, tx = divmod(rules.move_to(move), 8)
+            # Select the piece like a player would, so the highlights stay consistent
+            self.selected = self.board[fy][fx]
+            self.blocks[fy][fx].select()
+            self.show_moves({(ty, tx): move})
+            self.play(self.selected, ty, tx)
 
     def run(self):
         "Main game loop"
@@ -255,16 +288,22 @@ class Game:
                 if event.type == pygame.QUIT:
                     self.running = False
 
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_u and self.board_history:
-                        [[p.kill() for p in r if p] for r in self.board]
-
-                        undo_game = self.board_history.pop()
-                        self.board = self.deserialize(undo_game["board"])
-                        self.move50 = undo_game["move50"]
-                        self.turn = undo_game["turn"]
+                elif event.type == pygame.VIDEOEXPOSE:
+                    # The window was covered, nothing on screen can be trusted
+                    self.all_sprites.repaint_rect(self.screen.get_rect())
 
-                        [[self.add_piece(p) for p in r if p] for r in self.board]
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_u and self.board_history and not self.thinking:
+                        self.undo()
+                        # Against the computer take back its reply as well
+                        if self.engine_turn() and self.board_history:
+                            self.undo()
+                    elif event.key == pygame.K_f:
+                        print(self.fen())
+
+                elif event.type == pygame.MOUSEBUTTONDOWN and self.engine_turn():
+                    # Players can't touch the board while the computer is playing
+                    pass
 
                 elif event.type == pygame.MOUSEBUTTONDOWN and not self.selected:
                     # If no piece is selected, select a piece
@@ -278,58 +317,22 @@ class Game:
                     y = int((y - BOARD_RECT[1]) // BLOCK_SIZE[1])
 
                     if (y, x) in self.moves:
-                        self.board_history.append({
-                            "board": self.serialize(self.board),
-                            "turn": self.turn,
-                            "move50": self.move50
-                        })
-
-                        king = self.kings[self.turn]
-                        self.blocks[king.y][king.x].check(False)
-
-                        # Move the piece and swap turns
-                        self.move_piece(self.selected, y, x)
-
-                        # assume the king is not in check (validating moves was done above)
-                        king = self.kings[self.turn]
-                        self.blocks[king.y][king.x].check(False)
-
-                        self.turn = 'BLACK' if self.turn == 'WHITE' else 'WHITE'
-                        self.in_check = self.is_check(self.board)
-
-                        king = self.kings[self.turn]
-                        self.blocks[king.y][king.x].check(self.in_check)
-
-                        mate = self.is_mate()
-                        # Mate: No move possible
-                        if mate:
-                            self.running = False
-                            if self.inCheck:
-                                print("Checkmate:", self.turn, "has lost")
-                            else:
-                                print("Stalemate: It's a tie!")
-
-                        if self.move50 >= 50:
-                            self.running = False
-                            print("Tie: 50 moves without a capture or a pawn movement")
-
+                        self.play(self.selected, y, x)
                     else:
                         self.select_piece()
 
-            # Draw everything
-            self.piece_sprites.update()
-            self.all_sprites.draw(self.screen)
-
-            # Show all possible move sets as circle dots
-            for my, mx in self.moves:
-                cx = int(BOARD_RECT[0] + BLOCK_SIZE[0] * (mx + 0.5))
-                cy = int(BOARD_RECT[1] + BLOCK_SIZE[1] * (my + 0.5))
+            if self.engine_turn() and self.running:
+                self.update_engine()
 
-                pygame.draw.circle(self.screen, GREY, (cx, cy), 10)
-
-            pygame.display.flip()
+            # Draw what changed, an idle board sends nothing to the display
+            self.piece_sprites.update()
+            pygame.display.update(self.all_sprites.draw(self.screen))
             self.clock.tick(FPS)
 
+        if self.thinking:
+            self.engine.stop()
+
 
 if __name__ == "__main__":
-    game = Game()
+    # Optionally start from a FEN position: python chess.py "<fen>"
+    game = Game(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,328 @@
+"""
+Chess computer opponent: negamax alpha-beta search on top of bitboard.Position
+
+- Iterative deepening under a time budget
+- Transposition table, MVV-LVA capture ordering, killer and history heuristics
+- Quiescence search over captures and promotions
+- Material + piece-square table evaluation
+- Optional opening book (book.py), played before searching
+"""
+import threading
+import time
+
+from bitboard import WHITE, BLACK, PAWN, QUEEN, KING, EN_PASSANT, PROMOTION, iter_bits, promotion_piece
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+
+INFINITY = 1000000
+MATE = 100000
+# Scores above this are mates, the distance to mate is MATE - score
+MATE_BOUND = MATE - 1000
+MAX_PLY = 128
+
+PIECE_VALUES = (100, 320, 330, 500, 900, 0)
+
+# Piece-square tables from white's point of view, indexed by square (a8 first)
+# https://www.chessprogramming.org/Simplified_Evaluation_Function
+PAWN_TABLE = (
+    0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5,  5, 10, 25, 25, 10,  5,  5,
+    0,  0,  0, 20, 20,  0,  0,  0,
+    5, -5,-10,  0,  0,-10, -5,  5,
+    5, 10, 10,-20,-20, 10, 10,  5,
+    0,  0,  0,  0,  0,  0,  0,  0,
+)
+KNIGHT_TABLE = (
+    -50,-40,-30,-30,-30,-30,-40,-50,
+    -40,-20,  0,  0,  0,  0,-20,-40,
+    -30,  0, 10, 15, 15, 10,  0,-30,
+    -30,  5, 15, 20, 20, 15,  5,-30,
+    -30,  0, 15, 20, 20, 15,  0,-30,
+    -30,  5, 10, 15, 15, 10,  5,-30,
+    -40,-20,  0,  5,  5,  0,-20,-40,
+    -50,-40,-30,-30,-30,-30,-40,-50,
+)
+BISHOP_TABLE = (
+    -20,-10,-10,-10,-10,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5, 10, 10,  5,  0,-10,
+    -10,  5,  5, 10, 10,  5,  5,-10,
+    -10,  0, 10, 10, 10, 10,  0,-10,
+    -10, 10, 10, 10, 10, 10, 10,-10,
+    -10,  5,  0,  0,  0,  0,  5,-10,
+    -20,-10,-10,-10,-10,-10,-10,-20,
+)
+ROOK_TABLE = (
+    0,  0,  0,  0,  0,  0,  0,  0,
+    5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    0,  0,  0,  5,  5,  0,  0,  0,
+)
+QUEEN_TABLE = (
+    -20,-10,-10, -5, -5,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5,  5,  5,  5,  0,-10,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+    0,  0,  5,  5,  5,  5,  0, -5,
+    -10,  5,  5,  5,  5,  5,  0,-10,
+    -10,  0,  5,  0,  0,  0,  0,-10,
+    -20,-10,-10, -5, -5,-10,-10,-20,
+)
+KING_TABLE = (
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -20,-30,-30,-40,-40,-30,-30,-20,
+    -10,-20,-20,-20,-20,-20,-20,-10,
+    20, 20,  0,  0,  0,  0, 20, 20,
+    20, 30, 10,  0,  0, 10, 30, 20,
+)
+KING_ENDGAME_TABLE = (
+    -50,-40,-30,-20,-20,-30,-40,-50,
+    -30,-20,-10,  0,  0,-10,-20,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-30,  0,  0,  0,  0,-30,-30,
+    -50,-30,-30,-30,-30,-30,-30,-50,
+)
+PIECE_SQUARE = (PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE)
+# Switch to the endgame king table once both sides have at most this much non-pawn material
+ENDGAME_MATERIAL = 1300
+
+
+def evaluate(position):
+    "Material + piece-square score in centipawns, from the side to move's point of view"
+    score = 0
+    material = [0, 0]
+    for ptype in range(KING):
+        value, table = PIECE_VALUES[ptype], PIECE_SQUARE[ptype]
+        for sq in iter_bits(position.pieces[WHITE][ptype]):
+            score += value + table[sq]
+        for sq in iter_bits(position.pieces[BLACK][ptype]):
+            # Mirror the square vertically for black
+            score -= value + table[sq ^ 56]
+        if ptype != PAWN:
+            material[WHITE] += value * bin(position.pieces[WHITE][ptype]).count('1')
+            material[BLACK] += value * bin(position.pieces[BLACK][ptype]).count('1')
+
+    table = KING_ENDGAME_TABLE if max(material) <= ENDGAME_MATERIAL else KING_TABLE
+    score += table[position.kings[WHITE]] - table[position.kings[BLACK] ^ 56]
+    return score if position.turn == WHITE else -score
+
+
+def is_capture(position, move):
+    return position.squares[(move >> 6) & 63] is not None or move >> 12 == EN_PASSANT
+
+
+def mvv_lva(position, move):
+    "Most valuable victim, least valuable attacker"
+    victim = position.squares[(move >> 6) & 63]
+    victim = PAWN if victim is None else victim[1]
+    attacker = position.squares[move & 63][1]
+    return 10 * PIECE_VALUES[victim] - PIECE_VALUES[attacker] // 10
+
+
+class SearchTimeout(Exception):
+    "Raised inside the search when the time budget runs out or stop() is called"
+
+
+class Engine:
+    "Iterative deepening alpha-beta searcher, one instance per computer player"
+    def __init__(self, time_limit=2.0, max_depth=32, table_size=1 << 18, book=None):
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.table = TranspositionTable(table_size)
+        # book.Book to play from while the position is in it
+        self.book = book
+
+        self.stopped = False
+        self.nodes = 0
+        self.deadline = 0
+        # Summary of every completed iteration: (depth, score, nodes, seconds, best move)
+        self.info = []
+
+    def stop(self):
+        "Ask a running search to return as soon as possible (thread safe)"
+        self.stopped = True
+
+    def search(self, position, time_limit=None, max_depth=None):
+        "Returns the best move found within the time budget, None if there are no legal moves"
+        # Work on a copy, a timeout leaves moves made on the searched position
+        position = position.copy()
+        time_limit = self.time_limit if time_limit is None else time_limit
+        max_depth = self.max_depth if max_depth is None else max_depth
+
+        self.info = []
+        moves = position.legal_moves()
+        if len(moves) <= 1:
+            return moves[0] if moves else None
+
+        if self.book is not None:
+            move = self.book.choose(position)
+            if move is not None:
+                return move
+
+        start = time.perf_counter()
+        self.deadline = start + time_limit
+        self.stopped = False
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [[0] * 4096, [0] * 4096]
+        self.table.new_search()
+
+        best = moves[0]
+        for depth in range(1, max_depth + 1):
+            self.root_best = None
+            try:
+                score = self.negamax(position, depth, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                # The previous best move is searched first, so anything found is at least as good
+                if self.root_best is not None:
+                    best = self.root_best
+                break
+
+            best = self.table.best_move(position.key) or best
+            self.info.append((depth, score, self.nodes, time.perf_counter() - start, best))
+            if abs(score) >= MATE_BOUND:
+                break
+        return best
+
+    def check_time(self):
+        if self.stopped or time.perf_counter() >= self.deadline:
+            raise SearchTimeout
+
+    def order_moves(self, position, moves, tt_move, ply):
+        "Sorts moves in place, most promising first"
+        killers = self.killers[ply]
+        history = self.history[position.turn]
+        scores = {}
+        for move in moves:
+            if move == tt_move:
+                scores[move] = 3 * INFINITY
+            elif is_capture(position, move):
+                scores[move] = 2 * INFINITY + mvv_lva(position, move)
+            elif promotion_piece(move) == QUEEN:
+                scores[move] = 2 * INFINITY
+            elif move == killers[0]:
+                scores[move] = INFINITY + 1
+            elif move == killers[1]:
+                scores[move] = INFINITY
+            else:
+                scores[move] = history[move & 4095]
+        moves.sort(key=scores.__getitem__, reverse=True)
+        return moves
+
+    def negamax(self, position, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_time()
+
+        if ply:
+            # 50 move rule and repetitions are draws, one repetition is enough inside the tree
+            if position.halfmove >= 100 or position.repetitions() > 1:
+                return 0
+
+        in_check = position.in_check()
+        if in_check:
+            depth += 1
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiescence(position, alpha, beta, ply)
+
+        key = position.key
+        tt_move = None
+        entry = self.table.probe(key)
+        if entry:
+            tt_depth, score, flag, tt_move = entry
+            if ply and tt_depth >= depth:
+                score = score - ply if score >= MATE_BOUND else score + ply if score <= -MATE_BOUND else score
+                if flag == EXACT or (flag == LOWER and score >= beta) or (flag == UPPER and score <= alpha):
+                    return score
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, None
+        legal = 0
+        for move in self.order_moves(position, position.pseudo_legal_moves(), tt_move, ply):
+            if not position.is_legal(move):
+                continue
+            legal += 1
+
+            quiet = not is_capture(position, move) and move >> 12 < PROMOTION
+            position.make_move(move)
+            score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.unmake_move()
+
+            if score > best_score:
+                best_score, best_move = score, move
+                if ply == 0:
+                    self.root_best = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[0], killers[1] = move, killers[0]
+                            self.history[position.turn][move & 4095] += depth * depth
+                        break
+
+        if not legal:
+            return -MATE + ply if in_check else 0
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        # Mate scores are stored relative to this node
+        stored = best_score + ply if best_score >= MATE_BOUND else best_score - ply if best_score <= -MATE_BOUND else best_score
+        self.table.store(key, depth, stored, flag, best_move)
+        return best_score
+
+    def quiescence(self, position, alpha, beta, ply):
+        "Only searches captures and promotions so the evaluation is not taken mid-exchange"
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_time()
+
+        stand_pat = evaluate(position)
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        moves = [m for m in position.pseudo_legal_moves() if is_capture(position, m) or m >> 12 >= PROMOTION]
+        moves.sort(key=lambda m: mvv_lva(position, m), reverse=True)
+        for move in moves:
+            if not position.is_legal(move):
+                continue
+            position.make_move(move)
+            score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+class EngineThread(threading.Thread):
+    "Runs a search in the background so the pygame loop keeps rendering"
+    def __init__(self, engine, position):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.position = position.copy()
+        self.move = None
+
+    def run(self):
+        self.move = self.engine.search(self.position)
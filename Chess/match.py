@@ -0,0 +1,257 @@
+"""
+Headless engine vs engine matches
+
+Plays games between two engine configurations (A and B) in parallel worker
+processes. Every opening is played twice with colors swapped, each move gets
+a fixed time budget, and games are adjudicated by the rules core (mate,
+stalemate, 50 move rule, repetition, insufficient material), a move limit
+and an optional resign score. The summary gives the score of A, the Elo
+difference with its 95% error margin, and an SPRT log-likelihood ratio that
+can stop the match early once the result is clear.
+
+Usage:
+    python match.py --games 100 --time 0.1
+    python match.py --games 400 --time-a 0.2 --time-b 0.1 --sprt 0 20 --pgn games.pgn
+"""
+import argparse
+import contextlib
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import board as rules
+from book import Book
+from engine import Engine
+from pgn import parse_san, game_to_pgn
+
+
+# Short opening lines so the games don't all repeat, (name, SAN moves)
+OPENINGS = [
+    ("Ruy Lopez", "e4 e5 Nf3 Nc6 Bb5 a6"),
+    ("Italian", "e4 e5 Nf3 Nc6 Bc4 Bc5"),
+    ("Sicilian Najdorf", "e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3 a6"),
+    ("French", "e4 e6 d4 d5 Nc3 Nf6"),
+    ("Caro-Kann", "e4 c6 d4 d5 Nc3 dxe4 Nxe4 Bf5"),
+    ("Scandinavian", "e4 d5 exd5 Qxd5 Nc3 Qa5"),
+    ("Queen's Gambit Declined", "d4 d5 c4 e6 Nc3 Nf6"),
+    ("Slav", "d4 d5 c4 c6 Nf3 Nf6"),
+    ("King's Indian", "d4 Nf6 c4 g6 Nc3 Bg7 e4 d6"),
+    ("Nimzo-Indian", "d4 Nf6 c4 e6 Nc3 Bb4"),
+    ("English", "c4 e5 Nc3 Nf6 g3 d5"),
+    ("Reti", "Nf3 d5 g3 Nf6 Bg2 e6"),
+]
+
+# Results from white's point of view
+WHITE_WINS, BLACK_WINS, DRAW = '1-0', '0-1', '1/2-1/2'
+
+
+class Config:
+    "Settings of one side of the match"
+    def __init__(self, name, time_limit=0.1, max_depth=32, table_size=1 << 16, book=None):
+        self.name = name
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.table_size = table_size
+        self.book = book
+
+    def engine(self, stack):
+        "A new engine with these settings, its book is closed when stack is"
+        book = stack.enter_context(Book(self.book)) if self.book else None
+        return Engine(self.time_limit, self.max_depth, self.table_size, book)
+
+    def __repr__(self):
+        return f"{self.name} (time {self.time_limit}s, depth {self.max_depth}, hash {self.table_size})"
+
+
+def play_game(args):
+    """
+    Worker: plays one game, returns (index, result, reason, plies, nodes, seconds, pgn)
+    where nodes and seconds are {side name: total}
+    """
+    index, white, black, opening, max_plies, resign = args
+    board = rules.Board()
+    for text in opening.split():
+        board.play(parse_san(board.position, text))
+
+    # Opening books are closed with the game
+    with contextlib.ExitStack() as books:
+        engines = {'WHITE': (white, white.engine(books)), 'BLACK': (black, black.engine(books))}
+        nodes = {white.name: 0, black.name: 0}
+        seconds = {white.name: 0.0, black.name: 0.0}
+        # Consecutive moves each side has evaluated itself as lost
+        losing = {'WHITE': 0, 'BLACK': 0}
+        result = reason = None
+
+        while result is None:
+            ending = board.result()
+            if ending == rules.CHECKMATE:
+                result = BLACK_WINS if board.turn == 'WHITE' else WHITE_WINS
+                reason = "checkmate"
+            elif ending:
+                result, reason = DRAW, ending.lower().replace('_', ' ')
+            elif len(board.position.history) >= max_plies:
+                result, reason = DRAW, "move limit"
+            if result:
+                break
+
+            config, engine = engines[board.turn]
+            start = time.perf_counter()
+            move = engine.search(board.position)
+            seconds[config.name] += time.perf_counter() - start
+            nodes[config.name] += engine.nodes if engine.info else 0
+
+            # Resign after 3 moves in a row below the resign score
+            score = engine.info[-1][1] if engine.info else 0
+            losing[board.turn] = losing[board.turn] + 1 if resign and score <= -resign else 0
+            if losing[board.turn] >= 3:
+                result = BLACK_WINS if board.turn == 'WHITE' else WHITE_WINS
+                reason = "resignation"
+                break
+            board.play(move)
+
+    headers = {'Event': 'Engine match', 'Round': str(index + 1), 'White': white.name, 'Black': black.name,
+               'Result': result, 'Termination': reason}
+    plies = len(board.position.history)
+    return index, result, reason, plies, nodes, seconds, game_to_pgn(board, headers)
+
+
+def elo(score):
+    "Elo difference of a score fraction (0 < score < 1)"
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected_score(elo_diff):
+    return 1 / (1 + 10 ** (-elo_diff / 400))
+
+
+def score_stats(wins, draws, losses):
+    "(score fraction, variance of one game's score)"
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    return score, variance
+
+
+def elo_margin(wins, draws, losses):
+    "(Elo difference, 95% error margin), None when all games have the same result"
+    score, variance = score_stats(wins, draws, losses)
+    if variance == 0 or score in (0, 1):
+        return None
+    deviation = math.sqrt(variance / (wins + draws + losses))
+    low, high = max(score - 1.96 * deviation, 1e-6), min(score + 1.96 * deviation, 1 - 1e-6)
+    return elo(score), (elo(high) - elo(low)) / 2
+
+
+def sprt(wins, draws, losses, elo0, elo1):
+    "Log-likelihood ratio of H1 (elo1) against H0 (elo0), normal approximation of the game scores"
+    games = wins + draws + losses
+    if not games:
+        return 0.0
+    score, variance = score_stats(wins, draws, losses)
+    if variance == 0:
+        return 0.0
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+    return (s1 - s0) * (2 * score - s0 - s1) * games / (2 * variance)
+
+
+def sprt_bounds(alpha=0.05, beta=0.05):
+    "(lower, upper) LLR bounds, accept H0 below and H1 above"
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def run_match(a, b, games, processes=None, max_plies=300, resign=0, sprt_elo=None, pgn_path=None):
+    "Plays the match, prints progress and the summary, returns (wins, draws, losses) of A"
+    processes = processes or os.cpu_count() or 1
+    jobs = []
+    for index in range(games):
+        # Each opening twice, A plays white in the first game of the pair
+        opening = OPENINGS[(index // 2) % len(OPENINGS)][1]
+        white, black = (a, b) if index % 2 == 0 else (b, a)
+        jobs.append((index, white, black, opening, max_plies, resign))
+
+    print(f"A: {a}\nB: {b}\n{games} games on {processes} processes")
+    wins = draws = losses = 0
+    nodes = {a.name: 0, b.name: 0}
+    seconds = {a.name: 0.0, b.name: 0.0}
+    reasons = {}
+    bounds = sprt_bounds()
+    verdict = None
+    start = time.perf_counter()
+
+    pgn_file = open(pgn_path, 'w', encoding='utf-8') if pgn_path else None
+    try:
+        with multiprocessing.Pool(processes) as pool:
+            for index, result, reason, plies, game_nodes, game_seconds, pgn in pool.imap_unordered(play_game, jobs):
+                a_white = index % 2 == 0
+                if result == DRAW:
+                    draws += 1
+                elif (result == WHITE_WINS) == a_white:
+                    wins += 1
+                else:
+                    losses += 1
+                reasons[reason] = reasons.get(reason, 0) + 1
+                for name in nodes:
+                    nodes[name] += game_nodes[name]
+                    seconds[name] += game_seconds[name]
+                if pgn_file:
+                    pgn_file.write(pgn)
+
+                played = wins + draws + losses
+                print(f"Game {index + 1} ({'A' if a_white else 'B'} white): {result} by {reason} in {plies} plies"
+                      f"  [{played}/{games}  +{wins} ={draws} -{losses}]")
+
+                if sprt_elo:
+                    llr = sprt(wins, draws, losses, *sprt_elo)
+                    if llr <= bounds[0] or llr >= bounds[1]:
+                        verdict = 'H1' if llr >= bounds[1] else 'H0'
+                        # Leaving the with block terminates the games still running
+                        break
+    finally:
+        if pgn_file:
+            pgn_file.close()
+
+    elapsed = time.perf_counter() - start
+    played = wins + draws + losses
+    print(f"\n{played} games in {elapsed:.1f}s, A: +{wins} ={draws} -{losses}, "
+          f"score {(wins + draws / 2) / max(played, 1):.1%}")
+    print("Endings:", ", ".join(f"{r} {n}" for r, n in sorted(reasons.items(), key=lambda r: -r[1])))
+    margin = elo_margin(wins, draws, losses) if played else None
+    print(f"Elo A - B: {margin[0]:+.1f} +/- {margin[1]:.1f}" if margin else "Elo A - B: not enough information")
+    for name in nodes:
+        print(f"{name}: {nodes[name] / max(seconds[name], 1e-9):,.0f} nodes/s")
+    if sprt_elo:
+        llr = sprt(wins, draws, losses, *sprt_elo)
+        result = {'H1': f"H1 accepted (A is {sprt_elo[1]} Elo stronger)",
+                  'H0': f"H0 accepted (A is not {sprt_elo[1]} Elo stronger)"}.get(verdict, "inconclusive")
+        print(f"SPRT [{sprt_elo[0]}, {sprt_elo[1]}]: LLR {llr:.2f} ({bounds[0]:.2f}, {bounds[1]:.2f}) {result}")
+    return wins, draws, losses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play engine configuration A against B")
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--time', type=float, default=0.1, help="seconds per move for both engines")
+    for side in 'ab':
+        parser.add_argument(f'--time-{side}', type=float, default=None, help=f"seconds per move of {side.upper()}")
+        parser.add_argument(f'--depth-{side}', type=int, default=32, help=f"maximum depth of {side.upper()}")
+        parser.add_argument(f'--hash-{side}', type=int, default=1 << 16, help=f"table entries of {side.upper()}")
+        parser.add_argument(f'--book-{side}', default=None, help=f"opening book of {side.upper()}")
+    parser.add_argument('--max-plies', type=int, default=300, help="adjudicate a draw after this many plies")
+    parser.add_argument('--resign', type=int, default=0, metavar='CP',
+                        help="resign after 3 moves scored below -CP centipawns (0: never)")
+    parser.add_argument('--sprt', type=float, nargs=2, default=None, metavar=('ELO0', 'ELO1'),
+                        help="stop early once A is shown to be ELO1 stronger (H1) or not ELO0 stronger (H0)")
+    parser.add_argument('--pgn', default=None, help="write the games to this PGN file")
+    args = parser.parse_args(argv)
+
+    a = Config('A', args.time_a or args.time, args.depth_a, args.hash_a, args.book_a)
+    b = Config('B', args.time_b or args.time, args.depth_b, args.hash_b, args.book_b)
+    run_match(a, b, args.games, args.processes, args.max_plies, args.resign, args.sprt, args.pgn)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Headless perft (performance test) for the bitboard move generator
+
+Counts the leaf nodes of the legal move tree to a given depth, which is the
+standard way to check a move generator against known results and to measure
+its speed. No pygame display is needed.
+
+Usage:
+    python perft.py --depth 4
+    python perft.py --fen "<fen>" --depth 3 --divide
+    python perft.py --suite --depth 3
+
+The suite is the regression gate for castling, en passant and promotion
+rules, and checks that malformed FENs are rejected. The edge case positions
+only have published counts at depths 4-7, run `--suite --depth 7` (a few
+minutes) to include them.
+"""
+import argparse
+import sys
+import time
+
+from analyze import game_stats
+from bitboard import Position, START_FEN, move_uci
+from pgn import PGNError, read_games
+from transposition import TranspositionTable, EXACT
+
+
+# Reference positions and their known node counts, {depth: nodes}
+# https://www.chessprogramming.org/Perft_Results
+REFERENCE_POSITIONS = [
+    ("Start position", START_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("Kiwipete (castling, pins)",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("En passant and discovered checks",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("Promotions",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("Promotion with check",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("Middlegame",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+
+    # Edge cases, these only have counts at a single (deep) depth
+    ("Illegal en passant (white)", "8/5bk1/8/2Pp4/8/1K6/8/8 w - d6 0 1", {6: 824064}),
+    ("Illegal en passant (black)", "8/8/1k6/8/2pP4/8/5BK1/8 b - d3 0 1", {6: 824064}),
+    ("En passant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", {6: 1440467}),
+    ("Short castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", {6: 661072}),
+    ("Long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {6: 803711}),
+    ("Castling rights lost to captures", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {4: 1274206}),
+    ("Castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {4: 1720476}),
+    ("Promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", {6: 3821001}),
+    ("Discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", {5: 1004658}),
+    ("Promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", {6: 217342}),
+    ("Underpromote to check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", {6: 92683}),
+    ("Self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", {6: 2217}),
+    ("Stalemate and checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", {7: 567584}),
+    ("Double check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {4: 23527}),
+]
+
+
+def perft(position, depth, table=None):
+    "Number of leaf nodes of the legal move tree, table caches subtree counts"
+    if depth == 1:
+        return len(position.legal_moves())
+    if table is not None:
+        entry = table.probe(position.key)
+        if entry and entry[0] == depth:
+            return entry[1]
+
+    moves = position.legal_moves()
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1, table)
+        position.unmake_move()
+
+    if table is not None:
+        table.store(position.key, depth, nodes, EXACT)
+    return nodes
+
+
+def divide(position, depth, table=None):
+    "Node count for each root move, useful to find where two generators disagree"
+    counts = {}
+    for move in position.legal_moves():
+        position.make_move(move)
+        counts[move_uci(move)] = perft(position, depth - 1, table) if depth > 1 else 1
+        position.unmake_move()
+    return counts
+
+
+def run_perft(fen, depth, show_divide=False, hash_size=0):
+    position = Position.from_fen(fen)
+    table = TranspositionTable(hash_size) if hash_size else None
+    start = time.perf_counter()
+    if show_divide:
+        counts = divide(position, depth, table)
+        for move, count in sorted(counts.items()):
+            print(f"{move}: {count}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(position, depth, table)
+    elapsed = time.perf_counter() - start
+
+    print(f"Depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nodes / (elapsed or 1e-9):,.0f} nodes/s)")
+    return nodes
+
+
+# FENs that must be rejected with a ValueError, not crash or load something else
+INVALID_FENS = [
+    ("One character en passant square", "8/8/8/8/8/8/8/K6k w - e 0 1"),
+    ("En passant square off the board", "8/8/8/8/8/8/8/K6k w - e9 0 1"),
+    ("En passant file", "8/8/8/8/8/8/8/K6k w - z6 0 1"),
+    ("Side to move", "8/8/8/8/8/8/8/K6k x - - 0 1"),
+]
+
+
+def check_invalid_fens():
+    "Checks every INVALID_FENS is rejected, returns True if all are"
+    passed = True
+    for name, fen in INVALID_FENS:
+        try:
+            Position.from_fen(fen)
+            error = "accepted"
+        except ValueError:
+            error = None
+        except Exception as e:
+            error = f"raised {type(e).__name__}: {e}"
+        if not error:
+            # Same FEN as the [FEN] tag of a game, analyze.py reports it in the game's row
+            game = next(read_games([f'[FEN "{fen}"]', '', '1. Kb2 *']))
+            try:
+                row = game_stats(game)
+                if not row[-1].startswith('FEN:'):
+                    error = f"analyze.py row error {row[-1]!r}"
+            except Exception as e:
+                error = f"analyze.py raised {type(e).__name__}: {e}"
+        if not error:
+            # pgn.py's validator counts games whose replay raises one of these as invalid
+            try:
+                list(game.replay())
+                error = "pgn.py replayed it"
+            except (PGNError, ValueError):
+                pass
+            except Exception as e:
+                error = f"pgn.py raised {type(e).__name__}: {e}"
+        if error:
+            passed = False
+            print(f"FAIL {name}: {fen!r} {error}")
+    print(f"{'ok' if passed else 'FAIL'}   Malformed FENs rejected ({len(INVALID_FENS)})")
+    return passed
+
+
+def run_suite(max_depth):
+    "Checks every reference count up to max_depth, returns True if all match"
+    passed = True
+    total_nodes, total_time = 0, 0
+    for name, fen, expected in REFERENCE_POSITIONS:
+        depths = [d for d in sorted(expected) if d <= max_depth]
+        if not depths:
+            print(f"skip {name} (needs depth {min(expected)})")
+            continue
+
+        ok = True
+        for depth in depths:
+            start = time.perf_counter()
+            nodes = perft(Position.from_fen(fen), depth)
+            total_time += time.perf_counter() - start
+            total_nodes += nodes
+
+            if nodes != expected[depth]:
+                ok = False
+                print(f"FAIL {name} depth {depth}: got {nodes}, expected {expected[depth]}")
+        passed = passed and ok
+        print(f"{'ok' if ok else 'FAIL'}   {name} (depth {depths[-1]})")
+
+    passed = check_invalid_fens() and passed
+    print(f"{total_nodes} nodes in {total_time:.3f}s ({total_nodes / (total_time or 1e-9):,.0f} nodes/s)")
+    print("All positions passed" if passed else "Some positions FAILED")
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft test for the chess move generator")
+    parser.add_argument('--fen', default=START_FEN, help="position to search (default: start position)")
+    parser.add_argument('--depth', type=int, default=3, help="search depth in plies")
+    parser.add_argument('--divide', action='store_true', help="print the node count of every root move")
+    parser.add_argument('--suite', action='store_true', help="verify all reference positions up to --depth")
+    parser.add_argument('--hash', type=int, default=0, metavar='ENTRIES',
+                        help="cache subtree counts in a transposition table of this many entries")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.depth) else 1
+    run_perft(args.fen, args.depth, args.divide, args.hash)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Streaming PGN reader and writer
+
+read_games() yields one game at a time from any iterable of lines, so huge
+databases are processed in constant memory. Moves are replayed through the
+rules core (board.Board), which validates every move of the file.
+
+Usage:
+    python pgn.py games.pgn     # validate every game and report games/second
+"""
+import re
+import sys
+import time
+
+from bitboard import (
+    Position, START_FEN, WHITE, PAWN, CASTLE, move_from, move_to, move_flag, promotion_piece, square_name, parse_square
+)
+from board import Board
+
+
+SAN_PIECES = 'PNBRQK'
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+TAG_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_RE = re.compile(r'\{[^}]*\}|;[^\n]*|\$\d+|[()]|[^\s(){};]+')
+MOVE_NUMBER_RE = re.compile(r'^\d+\.+$')
+SAN_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+# Seven tag roster, written first and in this order
+ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+
+class PGNError(ValueError):
+    "Raised for malformed PGN or illegal moves"
+
+
+def san(position, move):
+    "Standard algebraic notation of a legal move in the position (Nf3, exd5, O-O, e8=Q+)"
+    frm, to = move_from(move), move_to(move)
+    ptype = position.squares[frm][1]
+
+    if move_flag(move) == CASTLE:
+        text = 'O-O' if to & 7 == 6 else 'O-O-O'
+    else:
+        capture = position.squares[to] is not None or (ptype == PAWN and frm & 7 != to & 7)
+        if ptype == PAWN:
+            text = square_name(frm)[0] + 'x' if capture else ''
+        else:
+            text = SAN_PIECES[ptype]
+            # Disambiguate between pieces of the same type that can reach the same square
+            others = [
+                move_from(m) for m in position.legal_moves()
+                if move_to(m) == to and move_from(m) != frm and position.squares[move_from(m)][1] == ptype
+            ]
+            if others:
+                if all(o & 7 != frm & 7 for o in others):
+                    text += square_name(frm)[0]
+                elif all(o >> 3 != frm >> 3 for o in others):
+                    text += square_name(frm)[1]
+                else:
+                    text += square_name(frm)
+            text += 'x' if capture else ''
+        text += square_name(to)
+        if promotion_piece(move) is not None:
+            text += '=' + SAN_PIECES[promotion_piece(move)]
+
+    position.make_move(move)
+    if position.in_check():
+        text += '#' if not position.legal_moves() else '+'
+    position.unmake_move()
+    return text
+
+
+def parse_san(position, text):
+    "The legal move a SAN string refers to, raises PGNError if there isn't exactly one"
+    text = text.rstrip('+#!?')
+    moves = position.legal_moves()
+
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        column = 6 if len(text) == 3 else 2
+        for m in moves:
+            if move_flag(m) == CASTLE and move_to(m) & 7 == column:
+                return m
+        raise PGNError(f"Illegal castling: {text}")
+
+    match = SAN_RE.match(text)
+    if not match:
+        raise PGNError(f"Invalid move: {text}")
+    piece, file, rank, target, promotion = match.groups()
+    ptype = SAN_PIECES.index(piece) if piece else PAWN
+    to = parse_square(target)
+    promotion = SAN_PIECES.index(promotion) if promotion else None
+
+    candidates = [
+        m for m in moves
+        if move_to(m) == to and position.squares[move_from(m)][1] == ptype
+        and promotion_piece(m) == promotion
+        and (file is None or square_name(move_from(m))[0] == file)
+        and (rank is None or square_name(move_from(m))[1] == rank)
+    ]
+    if len(candidates) != 1:
+        raise PGNError(f"{'Ambiguous' if candidates else 'Illegal'} move: {text}")
+    return candidates[0]
+
+
+class PGNGame:
+    "Tags and main line moves of a single game, moves are SAN strings until replayed"
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+    def start_fen(self):
+        return self.headers.get('FEN', START_FEN)
+
+    def replay(self):
+        "Yields (san, move, board) after every move, raises PGNError on an illegal move"
+        board = Board(Position.from_fen(self.start_fen()))
+        for ply, text in enumerate(self.moves):
+            try:
+                move = parse_san(board.position, text)
+            except PGNError as e:
+                raise PGNError(f"Ply {ply + 1}: {e}") from None
+            board.play(move)
+            yield text, move, board
+
+    def board(self):
+        "Board after the last move"
+        board = Board(Position.from_fen(self.start_fen()))
+        for _, _, board in self.replay():
+            pass
+        return board
+
+
+def parse_movetext(text):
+    "Main line SAN moves and result of a movetext section, variations and comments are skipped"
+    moves, result, depth = [], '*', 0
+    for token in TOKEN_RE.findall(text):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth or token[0] in '{;$' or MOVE_NUMBER_RE.match(token):
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            # Move numbers glued to the move (1.e4)
+            moves.append(token.split('.')[-1])
+    return moves, result
+
+
+def read_games(lines):
+    "Yields a PGNGame for every game, reading lines lazily"
+    headers, movetext = {}, []
+    # Open {comments} can span lines and contain anything
+    open_comments = 0
+    for line in lines:
+        line = line.strip()
+        if line.startswith('[') and not open_comments:
+            if movetext:
+                yield PGNGame(headers, *parse_movetext(' '.join(movetext)))
+                headers, movetext = {}, []
+            match = TAG_RE.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        elif line and not line.startswith('%'):
+            movetext.append(line)
+            open_comments += line.count('{') - line.count('}')
+            # A result token outside a comment ends the game
+            if not open_comments and line.split()[-1] in RESULTS:
+                yield PGNGame(headers, *parse_movetext(' '.join(movetext)))
+                headers, movetext = {}, []
+
+    if movetext or headers:
+        yield PGNGame(headers, *parse_movetext(' '.join(movetext)))
+
+
+def escape_tag(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def game_to_pgn(board, headers=None):
+    "PGN text of every move played on a Board"
+    headers = dict(headers or {})
+    position = Position.from_fen(board.start_fen)
+    moves = [record[0] for record in board.position.history[board.start_ply:]]
+
+    result = headers.get('Result', '*')
+    headers['Result'] = result
+    if board.start_fen != START_FEN:
+        headers['SetUp'], headers['FEN'] = '1', board.start_fen
+
+    tags = [(tag, headers.get(tag, '?')) for tag in ROSTER]
+    tags += [(tag, value) for tag, value in headers.items() if tag not in ROSTER]
+    lines = [f'[{tag} "{escape_tag(value)}"]' for tag, value in tags]
+    lines.append('')
+
+    tokens = []
+    for i, move in enumerate(moves):
+        if position.turn == WHITE:
+            tokens.append(f"{position.fullmove}.")
+        elif i == 0:
+            tokens.append(f"{position.fullmove}...")
+        tokens.append(san(position, move))
+        position.make_move(move)
+    tokens.append(result)
+
+    # Movetext lines are kept under 80 characters
+    line = ''
+    for token in tokens:
+        if len(line) + len(token) + 1 > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
+
+
+def write_game(stream, board, headers=None):
+    stream.write(game_to_pgn(board, headers))
+
+
+def validate(path):
+    "Replays every game of a PGN file, prints throughput and the games that fail"
+    games = moves = errors = 0
+    start = time.perf_counter()
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for game in read_games(f):
+            games += 1
+            try:
+                for _ in game.replay():
+                    moves += 1
+            except (PGNError, ValueError) as e:
+                errors += 1
+                print(f"Game {games} ({game.headers.get('White', '?')} - {game.headers.get('Black', '?')}): {e}")
+
+    elapsed = time.perf_counter() - start or 1e-9
+    print(f"{games} games, {moves} moves, {errors} invalid in {elapsed:.2f}s")
+    print(f"{games / elapsed:,.1f} games/s, {moves / elapsed:,.0f} moves/s")
+    return errors == 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python pgn.py <file.pgn>")
+        sys.exit(2)
+    sys.exit(0 if validate(sys.argv[1]) else 1)
@@ -13,6 +13,9 @@ BOARD_RECT = 0, 0, 500, 500
 BLOCK_SIZE = BOARD_RECT[2] / 8, BOARD_RECT[3] / 8
 PIECE_SIZE = 40, 40
 
+# Move hints drawn on a block
+MOVE, CAPTURE = 'MOVE', 'CAPTURE'
+
 # IMAGE LOCATIONS
 IMAGES = {
     "WHITE": {
@@ -35,7 +38,7 @@ IMAGES = {
 
 
 # Class for a block, usually handles all background changes when selected
-class Block(pygame.sprite.Sprite):
+class Block(pygame.sprite.DirtySprite):
     def __init__(self, x, y, color):
         super().__init__()
 
@@ -50,25 +53,59 @@ class Block(pygame.sprite.Sprite):
 
         self.selected = False
         self.is_check = False
+        # MOVE or CAPTURE when the selected piece can go here
+        self.mark = None
 
-    def select(self):
-        # Change color to yellow when selected and change back to original when unselected
-        if not self.selected:
+    def redraw(self):
+        "Repaint the block, the renderer only draws it again when it changed"
+        if self.selected:
             self.image.fill(YELLOW)
         elif self.is_check:
             self.image.fill(RED)
         else:
             self.image.fill(self.color)
 
+        # Dots are drawn on the block, under the piece, so captures get a ring instead
+        center = self.image.get_width() // 2, self.image.get_height() // 2
+        if self.mark == MOVE:
+            pygame.draw.circle(self.image, GREY, center, 10)
+        elif self.mark == CAPTURE:
+            pygame.draw.circle(self.image, GREY, center, min(center) - 2, 4)
+        self.dirty = 1
+
+    def select(self):
+        # Change color to yellow when selected and change back to original when unselected
         self.selected = not self.selected
+        self.redraw()
 
     def check(self, isCheck):
-        self.image.fill(RED if isCheck else self.color)
-        self.is_check = isCheck
+        if isCheck != self.is_check:
+            self.is_check = isCheck
+            self.redraw()
+
+    def set_mark(self, mark):
+        if mark != self.mark:
+            self.mark = mark
+            self.redraw()
+
 
+# One scaled surface per (color, piece type), shared by every sprite
+SURFACES = {}
+
+
+def piece_surface(color, piece):
+    "Load and scale the image of a piece the first time it is needed"
+    if (color, piece) not in SURFACES:
+        img = pygame.image.load(IMAGES[color][piece])
+        SURFACES[color, piece] = pygame.transform.scale(img, PIECE_SIZE)
+    return SURFACES[color, piece]
+
+
+# Base class for all pieces, only a view of the rules core in board.py
+class Piece(pygame.sprite.DirtySprite):
+    # Drawn above the blocks
+    _layer = 1
 
-# Base class for all pieces        
-class Piece(pygame.sprite.Sprite): 
     def __init__(self, x, y, color, piece):
         super().__init__()
 
@@ -80,177 +117,45 @@ class Piece(pygame.sprite.Sprite):
         self.color = color
         self.piece = piece
 
-        # Load the image and resize it
-        self.img = pygame.image.load(IMAGES[color][piece])
-        self.image = pygame.transform.scale(self.img, PIECE_SIZE)
+        # Shared image, nothing is loaded from disk after the first piece of a type
+        self.image = piece_surface(color, piece)
 
         self.rect = self.image.get_rect()
-        # Used for Castling
-        self.moved = False
-        # Used for En Passant
-        self.double = False
-
-    def move(self, x, y, board):
-        # update the coordinates of piece in square matrix
-        self.x = x
-        self.y = y
-
-    def serialize(self):
-        return ((self.y, self.x), self.piece, self.color, self.moved, self.double)
+        self.drawn_at = None
 
     def update(self):
-        # update position of image in the screen
-        self.rect.center = BOARD_RECT[0] + BLOCK_SIZE[0] * (self.x + 0.5), BOARD_RECT[1] + BLOCK_SIZE[1] * (self.y + 0.5)
-
-    def check_valid(self, board, x, y):
-        # Checks whether the move position is valid (not out of board and not occupied by same team pieces)
-        return 0 <= x < 8 and 0 <= y < 8 and (not board[y][x] or board[y][x].color != self.color)
-            
-    def gen_moves(self, board, lst):
-        # Get all valid moves based on incremented directions (diagonal, vertical, horizontal)
-        valid = []
-        
-        for ix, iy in lst:
-            curx, cury = self.x, self.y
-            
-            while True:
-                curx, cury = curx + ix, cury + iy
-                
-                if self.check_valid(board, curx, cury):
-                    valid.append((cury, curx))
-                    
-                    if board[cury][curx]:
-                        break
-                else:
-                    break
-        return valid
-
-    def diagonal_moves(self, board):
-        # Get all possible diagonal moves
-        lst = [(1, 1), (-1, 1), (-1, -1), (1, -1)]
-        return self.gen_moves(board, lst)
-        
-    def linear_moves(self, board):
-        # Get all horizontal and vertical moves
-        lst = [(1, 0), (0, 1), (-1, 0), (0, -1)]
-        return self.gen_moves(board, lst)         
+        # update position of image in the screen, only redrawn if it moved
+        if self.drawn_at != (self.x, self.y):
+            self.drawn_at = self.x, self.y
+            self.rect.center = BOARD_RECT[0] + BLOCK_SIZE[0] * (self.x + 0.5), BOARD_RECT[1] + BLOCK_SIZE[1] * (self.y + 0.5)
+            self.dirty = 1
 
 
 class Pawn(Piece):
-    # Reference for increment values of 2 colors
-    rec = {'WHITE': -1, 'BLACK': 1}
     def __init__(self, x, y, color):
         super().__init__(x, y, color, 'PAWN')
 
-    def moves(self, board):
-        valid = []
-        nposy = self.y + self.rec[self.color]
-        
-        if 0 <= nposy <= 7:
-            # Diagonal attack
-            if 0 <= self.x+1 <= 7 and board[nposy][self.x+1] and board[nposy][self.x+1].color != self.color:
-                valid.append((nposy, self.x+1))
-                
-            if 0 <= self.x-1 <= 7 and board[nposy][self.x-1] and board[nposy][self.x-1].color != self.color:
-                valid.append((nposy, self.x-1))
-
-        # Forward Movement
-        if 0 <= nposy <= 7 and board[nposy][self.x] == None:
-            valid.append((nposy, self.x))
-                
-            # Double Forward
-            if (self.color == 'WHITE' and self.y == 6) or (self.color == 'BLACK' and self.y == 1):
-                nposy += self.rec[self.color]
-
-                if board[nposy][self.x] == None:
-                    valid.append((nposy, self.x))
-        
-        # En passant rule
-        # 1. Both pawns must be in the same row and adjacent to each other
-        # 2. Victim pawn has moved 2 spaces in the previous move
-        if self.x > 0:
-            piece = board[self.y][self.x-1]
-            if type(piece) == Pawn and piece.color != self.color and piece.double:
-                valid.append((self.y + self.rec[self.color], self.x-1))
-        
-        if self.x < 7:    
-            piece = board[self.y][self.x+1]
-            if type(piece) == Pawn and piece.color != self.color and piece.double:
-                valid.append((self.y + self.rec[self.color], self.x+1))
-
-        return valid
-    
-    def move(self, x, y, board):
-        # Moved 2 spaces
-        if abs(self.y-y) == 2:
-            self.double = True
-
-        # If En Passant, Kill the other pawn
-        piece = board[y - self.rec[self.color]][x]
-        if type(piece) == Pawn and piece.color != self.color and piece.double:
-            board[piece.y][piece.x] = None
-            piece.kill()
-        self.x, self.y = x, y
-
-        return piece
-            
 
 class Rook(Piece):
     def __init__(self, x, y, color):
         super().__init__(x, y, color, 'ROOK')
 
-    def moves(self, board):
-        return self.linear_moves(board)
-
 
 class Knight(Piece):
     def __init__(self, x, y, color):
         super().__init__(x, y, color, 'KNIGHT')
 
-    def moves(self, board):
-        # Generates max 8 moves based on increment values
-        lst = [(1, 2), (2, 1), (-1, 2), (2, -1), (-1, -2), (-2, -1), (-2, 1), (1, -2)]
-        valid = []
-
-        for ix, iy in lst:
-            nx, ny = self.x + ix, self.y + iy
-            
-            if self.check_valid(board, nx, ny):
-                valid.append((ny, nx))
-
-        return valid                    
-
 
 class Bishop(Piece):
     def __init__(self, x, y, color):
         super().__init__(x, y, color, 'BISHOP')
 
-    def moves(self, board):
-        return self.diagonal_moves(board)
-
 
 class King(Piece):
     def __init__(self, x, y, color):
         super().__init__(x, y, color, 'KING')
 
-    def moves(self, board):
-        # Generates max 8 moves based on increment values (Similar to horse)
-        lst = [(1,1), (0,1), (1,0), (-1,-1), (0,-1), (-1,0), (-1,1), (1,-1)]
-        valid = []
-
-        for ix, iy in lst:
-            nx, ny = self.x + ix, self.y + iy
-
-            if self.check_valid(board, nx, ny):
-                valid.append((ny, nx))
-                
-        return valid
-
 
 class Queen(Piece):
     def __init__(self, x, y, color):
         super().__init__(x, y, color, 'QUEEN')
-
-    def moves(self, board):
-        return self.diagonal_moves(board) + self.linear_moves(board)
-
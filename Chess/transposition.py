@@ -0,0 +1,60 @@
+"""
+Fixed-size transposition table keyed by Position.key (Zobrist hash)
+"""
+
+# What the stored score means, relative to the alpha-beta window it was searched with
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TranspositionTable:
+    """
+    Stores (key, depth, score, flag, move, age) in a power-of-two sized list.
+
+    Each key maps to a single slot. A slot is replaced when it is empty, holds
+    the same position, was written by an older search or was searched less
+    deeply than the new entry, so deep results survive until they go stale.
+    """
+    def __init__(self, size=1 << 20):
+        # Round down to a power of 2 so the index is just a mask of the key
+        self.size = 1 << (max(size, 1).bit_length() - 1)
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+        self.age = 0
+
+        self.probes = self.hits = 0
+
+    def new_search(self):
+        "Marks all current entries as coming from an older search"
+        self.age += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.age = 0
+        self.probes = self.hits = 0
+
+    def probe(self, key):
+        "Returns (depth, score, flag, move) stored for key, None if missing"
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1:5]
+        return None
+
+    def store(self, key, depth, score, flag, move=None):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.age or depth >= entry[1]:
+            # Keep the old best move if the new result has none (fail low)
+            if move is None and entry is not None and entry[0] == key:
+                move = entry[4]
+            self.entries[index] = (key, depth, score, flag, move, self.age)
+
+    def best_move(self, key):
+        entry = self.entries[key & self.mask]
+        return entry[4] if entry is not None and entry[0] == key else None
+
+    def hashfull(self):
+        "Permille of the first 1000 slots used by the current search"
+        sample = self.entries[:1000]
+        return sum(1 for e in sample if e is not None and e[5] == self.age) * 1000 // len(sample)